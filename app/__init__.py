@@ -6,6 +6,8 @@ from flask_jwt_extended import JWTManager
 from .extensions import db
 from flask_login import current_user, LoginManager
 from app.services.tongyi_service import TongyiService
+from app.utils.json_provider import create_json_provider
+from app.utils.metrics import init_metrics
 
 from config import Config
 
@@ -16,11 +18,22 @@ jwt = JWTManager()
 def create_app(config_class):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.json = create_json_provider(app, app.config.get('JSON_PROVIDER', 'orjson'))
 
     # 初始化扩展
     db.init_app(app)
     jwt.init_app(app)
 
+    from app.services.execution_queue import execution_queue
+    from app.services.execution_writer import execution_writer
+    execution_queue.init_app(app)
+    execution_writer.init_app(app)
+
+    from app.services.archive_service import ArchiveService
+    from app.services.agent_reaper import agent_reaper
+    ArchiveService.init_app(app)
+    agent_reaper.init_app(app)
+
     with app.app_context():
         from . import models  # 确保模型注册到db
 
@@ -31,6 +44,7 @@ def create_app(config_class):
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(agent_bp, url_prefix='/agents')
     app.register_blueprint(auth_bp, url_prefix='/auth')
+    init_metrics(app)
 
     # 更完善的CORS配置
     CORS(app,
@@ -44,23 +58,19 @@ def create_app(config_class):
              }
          })
 
-    # 移除旧的初始化调用
-    # TongyiService.initialize(app.config['TONGYI_API_KEY'])
-
-    # 添加请求前初始化钩子（方案一：基于用户ID）
-    # 请求前初始化钩子
     login_manager = LoginManager(app)
     @login_manager.user_loader
     def load_user(user_id):
-        from .models import User  # 替换成你的 User 模型
-        return User.query.get(int(user_id))
+        from app.services.identity_service import IdentityService, LoginIdentity
+        identity = IdentityService.get(user_id)
+        return LoginIdentity(identity) if identity else None
+
+    # JWT 校验时检查吊销列表和缓存的用户状态，停用立即生效
+    @jwt.token_in_blocklist_loader
+    def check_user_revoked(jwt_header, jwt_payload):
+        from app.services.identity_service import IdentityService
+        return IdentityService.is_revoked(jwt_payload['sub'])
 
-    @app.before_request
-    def initialize_tongyi_service():
-        if current_user.is_authenticated:
-            try:
-                TongyiService.initialize_with_user_id(current_user.id)
-            except Exception as e:
-                app.logger.error(f"通义服务初始化失败: {str(e)}")
+    # 通义API密钥改为在模型调用时按用户解析（带缓存），不再在每个请求前查询并写入全局变量
 
     return app
\ No newline at end of file
@@ -0,0 +1,301 @@
+"""ASGI 服务模式
+
+模型调用类接口（/agents/<id>/execute、/api/execute/<id>、/api/chat，含 SSE 流式）由协程处理：
+模型请求走 httpx.AsyncClient，执行记录经异步数据库会话写入，等待上游期间不占用线程，
+单个进程可同时保持大量进行中的对话。这些请求同样在 Flask 请求上下文中处理，before_request/after_request
+钩子照常执行；鉴权、限流、配置快照和上下文加载在线程池中完成，参数校验和响应格式直接复用同步视图模块中的函数，
+只有模型调用本身换成协程。其余接口经 a2wsgi 原样交给 Flask 应用处理，行为不变。
+"""
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from io import BytesIO
+from typing import Optional
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from werkzeug.exceptions import HTTPException
+
+from app.extensions import db
+from app.routes import agent_routes, api_routes
+from app.services.agent_config_service import AgentConfigService
+from app.services.agent_service import AgentService
+from app.services.async_execution_service import (AsyncExecutionService, PreparedExecution,
+                                                  async_execution_store)
+from app.services.rate_limiter import rate_limiter
+from app.utils import metrics
+from app.utils.deadline import Deadline
+from app.utils.http_client import close_async_model_client, get_async_model_client, async_request_timeout
+from app.utils.rate_limit import admit_request
+from app.utils.request_utils import body_flag
+from app.utils.sse import async_execution_events, event_stream_response, wants_event_stream
+from config import Config
+
+# (路径, 处理方法, 提供参数校验和响应格式的视图模块)
+ASYNC_ROUTES = (
+    (re.compile(r'^/agents/(\d+)/execute/?$'), '_execute', agent_routes),
+    (re.compile(r'^/api/execute/(\d+)/?$'), '_execute', api_routes),
+    (re.compile(r'^/api/chat/?$'), '_chat', api_routes),
+)
+
+
+@dataclass
+class Admitted:
+    """请求通过了 before_request 钩子、鉴权、限流和参数校验"""
+    data: dict
+    slot_key: Optional[str] = None
+    stream: bool = False
+    prepared: Optional[PreparedExecution] = None
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _replay(body, receive):
+    """把已读出的请求体重新交给 a2wsgi，之后的消息（断开通知）照常转发"""
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def replay():
+        if pending:
+            return pending.pop()
+        return await receive()
+
+    return replay
+
+
+def _environ(scope, body: bytes) -> dict:
+    environ = build_environ(scope, BytesIO(body))
+    # 请求体已整体读出；分块上传时请求头里没有 Content-Length，由这里补上
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def _headers(response):
+    return [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response.headers.items()]
+
+
+class AsgiApp:
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        # 其余接口在独立线程池中交给 Flask，请求体和响应体按块转发，流式响应（导出、SSE）不会被整体缓冲
+        self.wsgi = WSGIMiddleware(flask_app, workers=Config.ASGI_THREAD_POOL_SIZE)
+        async_execution_store.init_app(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        route = self._match(scope)
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+
+        pattern, handler, views = route
+        body = await _read_body(receive)
+        if handler == '_execute' and self._submits_async(scope, body):
+            # 异步入队（async=true）本身不等待模型，原样交给 Flask 处理
+            return await self.wsgi(scope, _replay(body, receive), send)
+
+        # 请求上下文在协程中推入：contextvars 随 asyncio.to_thread 带入线程池，同步代码照常使用 request/g/db.session
+        ctx = self.flask_app.request_context(_environ(scope, body))
+        ctx.push()
+        try:
+            await getattr(self, handler)(receive, send, views, *pattern.match(scope['path']).groups())
+        finally:
+            await asyncio.to_thread(db.session.remove)
+            ctx.pop()
+
+    @staticmethod
+    def _match(scope):
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            return None
+        for route in ASYNC_ROUTES:
+            if route[0].match(scope['path']):
+                return route
+        return None
+
+    def _submits_async(self, scope, body):
+        with self.flask_app.request_context(_environ(scope, body)):
+            data = request.get_json(silent=True)
+            return isinstance(data, dict) and body_flag(data, 'async') and not wants_event_stream(data)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # 鉴权、上下文加载和 after_request 等同步代码在默认线程池中执行
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=Config.ASGI_THREAD_POOL_SIZE, thread_name_prefix='asgi-sync')
+                )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_model_client()
+                await async_execution_store.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ---- 准入（线程池内执行） ----
+
+    def _dispatch(self, admit, authenticate=True):
+        """与同步视图相同的顺序：before_request 钩子 -> JWT 鉴权 -> 限流准入 -> admit；
+        返回 Admitted，或直接作为响应的视图返回值"""
+        try:
+            rv = self.flask_app.preprocess_request()
+            if rv is not None:
+                return rv
+            if authenticate:
+                verify_jwt_in_request()
+            slot_key = None
+            if Config.RATE_LIMIT_ENABLED:
+                slot_key, rejected = admit_request()
+                if rejected is not None:
+                    return rejected
+            try:
+                rv = admit()
+            except Exception:
+                if slot_key:
+                    rate_limiter.release(slot_key)
+                raise
+            if isinstance(rv, Admitted):
+                rv.slot_key = slot_key
+            elif slot_key:
+                rate_limiter.release(slot_key)
+            return rv
+        except (JWTExtendedException, PyJWTError, HTTPException) as e:
+            # 令牌缺失/过期/吊销、请求体不是合法 JSON 等，沿用应用注册的错误响应
+            return self.flask_app.handle_user_exception(e)
+
+    @staticmethod
+    def _admit_execution(views, agent_id):
+        """参数校验和错误响应沿用视图模块；在这里加载配置快照和上下文"""
+        data, invalid = views.parse_execution_request()
+        if invalid:
+            return invalid
+        try:
+            user_id = get_jwt_identity()
+            deadline = Deadline.for_request(data.get('timeout'))
+            agent = AgentConfigService.get(user_id, agent_id)
+            if not agent:
+                raise ValueError("Agent not found or access denied")
+            stream = wants_event_stream(data)
+            prepared = AsyncExecutionService.prepare(
+                agent, data['input'], AgentService._resolve_parent_id(user_id, data.get('parent_execution_id')),
+                deadline, stream=stream
+            )
+        except Exception as e:
+            return views.execution_error_response(e)
+        return Admitted(data, stream=stream, prepared=prepared)
+
+    @staticmethod
+    def _admit_chat():
+        try:
+            data, invalid = api_routes.parse_chat_request()
+        except Exception as e:
+            return api_routes.chat_error_response(e)
+        return invalid or Admitted(data)
+
+    @staticmethod
+    async def _release(admitted):
+        if admitted.slot_key:
+            await asyncio.to_thread(rate_limiter.release, admitted.slot_key)
+
+    # ---- 响应 ----
+
+    def _finalize(self, rv):
+        """视图返回值 -> 经 after_request 钩子处理后的 Flask 响应"""
+        return self.flask_app.process_response(self.flask_app.make_response(rv))
+
+    async def _respond(self, send, rv):
+        response = await asyncio.to_thread(self._finalize, rv)
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': _headers(response)})
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def _send_events(self, receive, send, events):
+        """逐条下发 SSE 事件；客户端断开时取消生成，关闭上游连接"""
+        response = await asyncio.to_thread(self._finalize, event_stream_response())
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': _headers(response)})
+
+        async def pump():
+            async for event in events:
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        pumping = asyncio.ensure_future(pump())
+        watching = asyncio.ensure_future(wait_disconnect())
+        try:
+            await asyncio.wait({pumping, watching}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watching.cancel()
+            if not pumping.done():
+                pumping.cancel()
+            await asyncio.gather(pumping, return_exceptions=True)
+            await events.aclose()
+
+    # ---- 处理方法：与同步视图只差在模型调用 ----
+
+    async def _execute(self, receive, send, views, agent_id):
+        """POST /agents/<id>/execute、/api/execute/<id>"""
+        admitted = await asyncio.to_thread(self._dispatch, partial(self._admit_execution, views, int(agent_id)))
+        if not isinstance(admitted, Admitted):
+            return await self._respond(send, admitted)
+        try:
+            if admitted.stream:
+                state, chunks = await AsyncExecutionService.stream(admitted.prepared)
+                return await self._send_events(receive, send, async_execution_events(state, chunks))
+            output, execution_id = await AsyncExecutionService.execute(admitted.prepared)
+            rv = views.execution_response(output, execution_id, 'completed')
+        except Exception as e:
+            rv = views.execution_error_response(e)
+        finally:
+            await self._release(admitted)
+        await self._respond(send, rv)
+
+    async def _chat(self, receive, send, views):
+        """POST /api/chat"""
+        admitted = await asyncio.to_thread(self._dispatch, self._admit_chat, authenticate=False)
+        if not isinstance(admitted, Admitted):
+            return await self._respond(send, admitted)
+        try:
+            payload, headers = views.chat_request(admitted.data['input'])
+            breaker = views.chat_breaker(payload)
+            breaker.acquire()
+            start = time.perf_counter()
+            try:
+                with metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(payload["model"]), stream='false').time():
+                    response = await get_async_model_client().post(
+                        Config.TONGYI_API_URL, headers=headers, json=payload, timeout=async_request_timeout()
+                    )
+            except Exception as e:
+                views.record_chat_call(breaker, payload["model"], start, error=e)
+                raise
+            views.record_chat_call(breaker, payload["model"], start, response)
+            rv = views.chat_response(response, admitted.data['session_id'], payload["model"])
+        except Exception as e:
+            rv = views.chat_error_response(e)
+        finally:
+            await self._release(admitted)
+        await self._respond(send, rv)
+
+
+def create_asgi_app(flask_app):
+    """包装已创建的 Flask 应用，供 uvicorn 等 ASGI 服务器加载"""
+    return AsgiApp(flask_app)
@@ -3,9 +3,12 @@ from datetime import datetime
 from typing import Optional, Dict, Any
 from flask_login import UserMixin
 from app.extensions import db
-from flask_bcrypt import Bcrypt
+from app.services import password_hasher
+from sqlalchemy import literal
+from sqlalchemy.orm import aliased
 
-bcrypt = Bcrypt()
+def _serialize_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
 
 
 class User(db.Model,UserMixin):
@@ -17,14 +20,18 @@ class User(db.Model,UserMixin):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     is_admin = db.Column(db.Boolean, default=False)
+    tier = db.Column(db.String(32), default='free')  # 限流等级：free / pro，管理员固定使用 admin 限额
     api_key = db.relationship('Api', back_populates='user', uselist=False)
     agent = db.relationship('Agent', back_populates='owner')
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash_password(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.verify_password(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
         # flask_login要求的方法
 
@@ -33,6 +40,16 @@ class User(db.Model,UserMixin):
         return str(self.id)
 
 class Agent(db.Model):
+    __table_args__ = (
+        # 游标分页：我的Agent / 公开Agent 按 (created_at, id) 倒序
+        db.Index('ix_agent_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_agent_public_created', 'is_public', 'created_at', 'id'),
+    )
+    # 允许通过 fields= 投影的字段
+    PROJECTABLE_FIELDS = ('id', 'user_id', 'name', 'system_prompt', 'description', 'model', 'temperature',
+                          'max_tokens', 'is_public', 'cache_enabled', 'hedge_enabled', 'version', 'created_at',
+                          'updated_at')
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.Text)
@@ -41,13 +58,25 @@ class Agent(db.Model):
     temperature = db.Column(db.Float, default=0.7)
     max_tokens = db.Column(db.Integer, default=1000)
     is_public = db.Column(db.Boolean, default=False)
+    cache_enabled = db.Column(db.Boolean, nullable=True)  # None 表示仅在 temperature 为 0 时缓存
+    hedge_enabled = db.Column(db.Boolean, default=False)  # 是否对慢请求发出对冲请求
+    version = db.Column(db.Integer, default=1)  # 当前配置版本，对应 agent_version.version
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 软删除时间，非空表示等待后台清理
+    purged_executions = db.Column(db.Integer, default=0)  # 后台已清理的执行记录数
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     owner = db.relationship('User', back_populates='agent')
     execution = db.relationship('AgentExecution', backref='agent', lazy='dynamic')
 
-    def to_dict(self):
+    @classmethod
+    def live(cls):
+        """未被软删除的Agent"""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    def to_dict(self, fields=None):
+        if fields is not None:
+            return {field: _serialize_value(getattr(self, field)) for field in fields}
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -58,21 +87,73 @@ class Agent(db.Model):
             'temperature': self.temperature,
             'max_tokens': self.max_tokens,
             'is_public': self.is_public,
+            'cache_enabled': self.cache_enabled,
+            'hedge_enabled': bool(self.hedge_enabled),
+            'version': self.version or 1,
             # 其他需要返回的字段...
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 
+class AgentVersion(db.Model):
+    """Agent 配置的不可变快照：创建和每次修改执行相关配置时各写入一条"""
+    __tablename__ = 'agent_version'
+    __table_args__ = (
+        db.UniqueConstraint('agent_id', 'version', name='uq_agent_version'),
+    )
+    # 影响执行结果、需要随版本固定的字段
+    SNAPSHOT_FIELDS = ('name', 'description', 'model', 'system_prompt', 'temperature', 'max_tokens',
+                       'cache_enabled', 'hedge_enabled')
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    version_name = db.Column(db.String(64), nullable=False)
+    config_snapshot = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id', ondelete='CASCADE'), nullable=False)
+
+    @classmethod
+    def from_agent(cls, agent: 'Agent') -> 'AgentVersion':
+        version = agent.version or 1
+        return cls(
+            agent_id=agent.id,
+            version=version,
+            version_name=f"v{version}",
+            config_snapshot={field: getattr(agent, field) for field in cls.SNAPSHOT_FIELDS}
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'agent_id': self.agent_id,
+            'version': self.version,
+            'version_name': self.version_name,
+            'config_snapshot': self.config_snapshot,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
 class AgentExecution(db.Model):
     __tablename__ = 'agent_execution'  # 明确指定表名，避免潜在的表名不一致问题
+    __table_args__ = (
+        # 执行记录游标分页：按 (start_time, id) 倒序
+        db.Index('ix_execution_agent_user_start', 'agent_id', 'user_id', 'start_time', 'id'),
+        # 启动时恢复遗留的 pending 任务
+        db.Index('ix_execution_status_start', 'status', 'start_time'),
+    )
+    PROJECTABLE_FIELDS = ('id', 'agent_id', 'agent_version', 'input', 'output', 'status', 'parent_execution_id',
+                          'cached', 'start_time', 'end_time')
 
     id = db.Column(db.Integer, primary_key=True)
     input = db.Column(db.Text, nullable=False)
     output = db.Column(db.Text)
-    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed
+    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed, timeout, cancelled
     start_time = db.Column(db.DateTime, default=datetime.utcnow)
     end_time = db.Column(db.DateTime)
+    cached = db.Column(db.Boolean, default=False)  # 是否命中回复缓存
+    archive_segment = db.Column(db.String(255), nullable=True)  # 非空表示 input/output 已移入该归档段文件
+    agent_version = db.Column(db.Integer, nullable=True)  # 执行时使用的 Agent 配置版本
     agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
@@ -100,17 +181,84 @@ class AgentExecution(db.Model):
         lazy='dynamic'
     )
 
-    def to_dict(self):
+    @classmethod
+    def ancestor_chain(cls, execution_id, max_turns=None, include_self=True):
+        """
+        用一条递归CTE沿 parent_execution_id 向上取对话链，按从根到叶排序
+        :param execution_id: 起点执行ID
+        :param max_turns: 最多返回的轮数（None 表示整条链）
+        :param include_self: 是否包含起点本身
+        """
+        first_level = 0 if include_self else 1
+        chain = db.select(
+            cls.id, cls.parent_execution_id, literal(0).label('level')
+        ).where(cls.id == execution_id).cte('execution_chain', recursive=True)
+
+        parent = aliased(cls)
+        step = db.select(
+            parent.id, parent.parent_execution_id, chain.c.level + 1
+        ).join(chain, parent.id == chain.c.parent_execution_id)
+        if max_turns is not None:
+            step = step.where(chain.c.level + 1 < first_level + max_turns)
+        chain = chain.union_all(step)
+
+        query = cls.query.join(chain, cls.id == chain.c.id).filter(chain.c.level >= first_level)
+        return query.order_by(chain.c.level.desc()).all()
+
+    @classmethod
+    def row_columns(cls, fields=None):
+        """列表类接口的行查询列（with_entities）：跳过 ORM 对象构建，
+        额外带上游标分页所需的 id/start_time 和回填归档正文所需的 archive_segment"""
+        names = list(fields or cls.PROJECTABLE_FIELDS)
+        names += [name for name in ('id', 'start_time', 'archive_segment') if name not in names]
+        return [db.func.coalesce(cls.cached, False).label('cached') if name == 'cached' else getattr(cls, name)
+                for name in names]
+
+    @staticmethod
+    def row_to_dict(row, fields=None):
+        """行查询结果转 dict；datetime 原样保留，由 JSON Provider 序列化"""
+        mapping = row._mapping
+        return {field: mapping[field] for field in (fields or AgentExecution.PROJECTABLE_FIELDS)}
+
+    def to_dict(self, fields=None):
+        if fields is not None:
+            return {field: _serialize_value(getattr(self, field)) for field in fields}
         return {
             "id": self.id,
             "agent_id": self.agent_id,
+            "agent_version": self.agent_version,
             "input": self.input,
             "output": self.output,
             "status": self.status,
-            "start_time": self.start_time.isoformat() if self.start_time else None
+            "parent_execution_id": self.parent_execution_id,
+            "cached": bool(self.cached),
+            "start_time": self.start_time.isoformat() if self.start_time else None,
+            "end_time": self.end_time.isoformat() if self.end_time else None
         }
 
 
+@dataclass(frozen=True)
+class UserIdentity:
+    """已认证用户的精简快照，用于身份缓存"""
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    is_admin: bool
+    tier: str
+
+    @classmethod
+    def from_user(cls, user: 'User') -> 'UserIdentity':
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=bool(user.is_active),
+            is_admin=bool(user.is_admin),
+            tier=user.tier or 'free'
+        )
+
+
 @dataclass
 class ApiKey:
     """API密钥数据类"""
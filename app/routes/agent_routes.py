@@ -1,13 +1,33 @@
-from flask import Blueprint, request, jsonify
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, current_app, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import TongyiService
 from app.models import Agent, AgentExecution
 from app.services.agent_service import AgentService
+from app.services.batch_service import BatchService
+from app.services.catalog_service import agent_catalog
+from app.services.archive_service import ArchiveService
 from app.utils.cors_utils import build_cors_preflight_response
+from app.utils.sse import wants_event_stream, execution_event_stream
+from app.utils.request_utils import body_flag
+from app.utils.rate_limit import hand_off_slot, rate_limited
+from app.utils.compression import compressed
+from app.utils.pagination import parse_limit, parse_fields
+from app.services.execution_queue import QueueFullError
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.circuit_breaker import CircuitOpenError
+from app.utils.deadline import Deadline, DeadlineExceeded
+from config import Config
 
 agent_bp = Blueprint('agents', __name__)
+
+EXPORT_FIELDS = AgentExecution.PROJECTABLE_FIELDS
 CORS(agent_bp,
      origins=["http://localhost:5173"],
      supports_credentials=True,
@@ -24,7 +44,7 @@ def chat():
     user_input = data['input']
     session_id = data.get('session_id')  # 关键：客户端需传递会话ID
 
-    agent = Agent.query.get(agent_id)
+    agent = Agent.live().filter_by(id=agent_id).first()
 
     # 获取或创建执行记录链
     if session_id:
@@ -64,7 +84,9 @@ def create_agent():
         model=data.get('model', 'qwen-turbo'),
         temperature=data.get('temperature', 0.7),
         max_tokens=data.get('max_tokens', 1000),
-        is_public=data.get('is_public', False)
+        is_public=data.get('is_public', False),
+        cache_enabled=data.get('cache_enabled'),
+        hedge_enabled=bool(data.get('hedge_enabled', False))
     )
 
     return jsonify(agent.to_dict()), 201
@@ -72,14 +94,56 @@ def create_agent():
 @agent_bp.route('', methods=['GET'])
 @agent_bp.route('/', methods=['GET'])
 @jwt_required()
+@compressed
 def list_agents():
     if request.method == 'OPTIONS':
         return build_cors_preflight_response()
     user_id = get_jwt_identity()
     public = request.args.get('public', '').lower() == 'true'
 
+    try:
+        fields = parse_fields(request.args.get('fields'), Agent.PROJECTABLE_FIELDS)
+        if public:
+            return _public_catalog(fields)
+        # 携带 limit/cursor 时使用游标分页，否则保持原有的全量列表
+        if 'limit' in request.args or 'cursor' in request.args:
+            agents, next_cursor = AgentService.page_agents(
+                user_id, public,
+                limit=parse_limit(request.args.get('limit')),
+                cursor=request.args.get('cursor'),
+                fields=fields
+            )
+            return jsonify({
+                "items": [agent.to_dict(fields) for agent in agents],
+                "next_cursor": next_cursor
+            }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     agents = AgentService.list_agents(user_id, public)
-    return jsonify([agent.to_dict() for agent in agents]), 200
+    return jsonify([agent.to_dict(fields) for agent in agents]), 200
+
+
+def _public_catalog(fields):
+    """公开Agent目录：读进程内快照，支持 q 全文检索、游标分页与 ETag/304"""
+    query = request.args.get('q', '').strip()
+    paged = bool(query) or 'limit' in request.args or 'cursor' in request.args
+    limit = parse_limit(request.args.get('limit')) if paged else None
+    cursor = request.args.get('cursor')
+
+    etag = agent_catalog.etag(query, limit, cursor, ','.join(fields or ()))
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        entries, next_cursor, total = agent_catalog.search(query, limit=limit, cursor=cursor)
+        if fields:
+            entries = [{field: entry[field] for field in fields} for entry in entries]
+        # 不带 q/limit/cursor 时保持原有的全量列表格式
+        body = {"items": entries, "next_cursor": next_cursor, "total": total} if paged else entries
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @agent_bp.route('/<int:agent_id>', methods=['GET'])
@@ -124,51 +188,281 @@ def delete_agent(agent_id):
     return jsonify({"message": "Agent deleted successfully"}), 200
 
 
+@agent_bp.route('/<int:agent_id>/versions', methods=['GET'])
+@jwt_required()
+def list_agent_versions(agent_id):
+    """Agent 的配置版本历史，按版本倒序"""
+    user_id = get_jwt_identity()
+    versions = AgentService.list_versions(user_id, agent_id)
+
+    if versions is None:
+        return jsonify({"error": "Agent not found or access denied"}), 404
+
+    return jsonify([version.to_dict() for version in versions]), 200
+
+
 @agent_bp.route('/<int:agent_id>/executions', methods=['GET'])
 @jwt_required()
+@compressed
 def list_agent_executions(agent_id):
     user_id = get_jwt_identity()
-    executions = AgentService.list_agent_executions(user_id, agent_id)
 
-    if executions is None:
+    try:
+        fields = parse_fields(request.args.get('fields'), AgentExecution.PROJECTABLE_FIELDS)
+        if 'limit' in request.args or 'cursor' in request.args:
+            page = AgentService.page_agent_executions(
+                user_id, agent_id,
+                limit=parse_limit(request.args.get('limit')),
+                cursor=request.args.get('cursor'),
+                fields=fields
+            )
+            if page is None:
+                return jsonify({"error": "Agent not found or access denied"}), 404
+            rows, next_cursor = page
+            items = [AgentExecution.row_to_dict(row, fields) for row in rows]
+            return jsonify({
+                "items": ArchiveService.hydrate_rows(rows, items),
+                "next_cursor": next_cursor
+            }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = AgentService.list_agent_executions(user_id, agent_id, fields)
+
+    if rows is None:
         return jsonify({"error": "Agent not found or access denied"}), 404
 
-    return jsonify([execution.to_dict() for execution in executions]), 200
+    items = [AgentExecution.row_to_dict(row, fields) for row in rows]
+    return jsonify(ArchiveService.hydrate_rows(rows, items)), 200
+
+
+def _parse_export_time(name):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        raise ValueError(f"Invalid {name}, expected ISO 8601 datetime")
+
+
+def _export_lines(rows, export_format):
+    """逐行编码导出内容，攒到约 64KB 再下发，避免每行一次写出"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+
+    for row in rows:
+        item = ArchiveService.hydrate_rows([row], [AgentExecution.row_to_dict(row)])[0]
+        if writer:
+            writer.writerow([item[field].isoformat() if isinstance(item[field], datetime) else item[field]
+                             for field in EXPORT_FIELDS])
+        else:
+            buffer.write(current_app.json.dumps(item, sort_keys=False))
+            buffer.write("\n")
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@agent_bp.route('/<int:agent_id>/executions/export', methods=['GET'])
+@jwt_required()
+@compressed
+def export_agent_executions(agent_id):
+    """
+    流式导出执行记录（NDJSON 或 CSV），内存占用与总行数无关
+    支持 since/until（ISO 时间）、status（逗号分隔）过滤；
+    按 id 升序输出，中断后以 after_id=<最后收到的 id> 续传
+    """
+    user_id = get_jwt_identity()
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    try:
+        after_id = request.args.get('after_id', type=int)
+        statuses = [s.strip() for s in request.args.get('status', '').split(',') if s.strip()]
+        rows = AgentService.export_executions(
+            user_id, agent_id,
+            since=_parse_export_time('since'),
+            until=_parse_export_time('until'),
+            statuses=statuses,
+            after_id=after_id
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if rows is None:
+        return jsonify({"error": "Agent not found or access denied"}), 404
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"agent_{agent_id}_executions.{export_format}"
+    return Response(
+        stream_with_context(_export_lines(rows, export_format)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+def parse_execution_request():
+    """读取并校验执行请求体，返回 (data, 参数错误时的响应)；同步视图与 ASGI 模式共用"""
+    data = request.get_json()
+    if not data or 'input' not in data:
+        return data, (jsonify({"error": "Missing input"}), 400)
+    return data, None
+
+
+def execution_response(response_text, execution_id, status):
+    return jsonify({
+        "success": True,
+        "response_text": response_text,
+        "execution_id": execution_id,  # 确保返回 execution.id
+        "status": status
+    }), 200
+
+
+def execution_error_response(e):
+    """执行失败时的响应；同步视图与 ASGI 模式共用"""
+    if isinstance(e, DeadlineExceeded):
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "status": 'timeout'
+        }), 504
+    if isinstance(e, CircuitOpenError):
+        response = jsonify({
+            "success": False,
+            "error": str(e),
+            "retry_after": e.retry_after
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    if isinstance(e, QueueFullError):
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 503
+    return jsonify({
+        "success": False,
+        "error": str(e)
+    }), 500
 
 
 @agent_bp.route('/<int:agent_id>/execute', methods=['POST'])
 @jwt_required()
+@rate_limited
 def execute_agent(agent_id):
     """执行Agent对话"""
     user_id = get_jwt_identity()
-    data = request.get_json()
-
-    if not data or 'input' not in data:
-        return jsonify({"error": "Missing input"}), 400
+    data, invalid = parse_execution_request()
+    if invalid:
+        return invalid
 
     parent_execution_id = data.get('parent_execution_id')
 
     try:
+        deadline = Deadline.for_request(data.get('timeout'))
+        if wants_event_stream(data):
+            execution, chunks = AgentService.stream_agent(
+                user_id=user_id,
+                agent_id=agent_id,
+                user_input=data['input'],
+                parent_execution_id=parent_execution_id,
+                deadline=deadline
+            )
+            return execution_event_stream(execution, chunks)
+
+        # 异步模式：入队后立即返回 202，客户端轮询 /api/execution/<id>
+        if body_flag(data, 'async'):
+            execution = AgentService.submit_execution(
+                user_id=user_id,
+                agent_id=agent_id,
+                user_input=data['input'],
+                parent_execution_id=parent_execution_id,
+                slot_key=hand_off_slot()  # 在途槽位保留到任务执行结束
+            )
+            return jsonify({
+                "execution_id": execution.id,
+                "status": execution.status,
+                "poll_url": f"/api/execution/{execution.id}"
+            }), 202
+
         response_text, execution = AgentService.execute_agent(
             user_id=user_id,
             agent_id=agent_id,
             user_input=data['input'],
-            parent_execution_id=parent_execution_id
+            parent_execution_id=parent_execution_id,
+            deadline=deadline
         )
+        return execution_response(response_text, execution.id, execution.status)
+
+    except Exception as e:
+        return execution_error_response(e)
 
-        return jsonify({
-            "success": True,
-            "response_text": response_text,
-            "execution_id": execution.id,  # 确保返回 execution.id
-            "status": execution.status
-        }), 200
 
+
+def _parse_batch_inputs():
+    """支持 JSON {"inputs": [...]}、NDJSON 请求体或 multipart 上传的 NDJSON 文件"""
+    upload = request.files.get('file')
+    if upload is not None:
+        lines = upload.read().decode('utf-8').splitlines()
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lines = request.get_data(as_text=True).splitlines()
+    else:
+        data = request.get_json(silent=True) or {}
+        items = data.get('inputs')
+        if not isinstance(items, list):
+            raise ValueError("inputs must be a list")
+        return [item['input'] if isinstance(item, dict) else str(item) for item in items]
+
+    inputs = []
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid JSON on line {line_no}")
+        inputs.append(item['input'] if isinstance(item, dict) else str(item))
+    return inputs
+
+
+@agent_bp.route('/<int:agent_id>/batch', methods=['POST'])
+@jwt_required()
+@rate_limited
+def batch_execute_agent(agent_id):
+    """批量执行Agent，按完成顺序以 NDJSON 流式返回每条结果"""
+    user_id = get_jwt_identity()
+
+    try:
+        inputs = _parse_batch_inputs()
+        max_concurrency = request.args.get('max_concurrency') or (request.get_json(silent=True) or {}).get('max_concurrency')
+        executions, results = BatchService.run_batch(user_id, agent_id, inputs, max_concurrency)
+    except RateLimitExceeded as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
 
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"X-Batch-Size": str(len(executions)), "X-Accel-Buffering": "no"}
+    )
 
 
 @agent_bp.route('/models', methods=['GET'])
@@ -176,10 +470,5 @@ def execute_agent(agent_id):
 def list_available_models():
     """获取可用的通义模型列表"""
     return jsonify({
-        "models": [
-            {"id": "qwen-turbo", "name": "通义千问Turbo"},
-            {"id": "qwen-plus", "name": "通义千问Plus"},
-            {"id": "qwen-max", "name": "通义千问Max"},
-            {"id": "qwen-1.8b", "name": "通义千问1.8B"}
-        ]
+        "models": Config.AVAILABLE_MODELS
     }), 200
\ No newline at end of file
@@ -1,15 +1,27 @@
 import json
 import os
 import sys
+import time
 import uuid
 
-import requests
-
 from app.services.agent_service import AgentService
+from app.services.completion_cache import CompletionCache
+from app.services.model_router import model_router
+from app.utils.http_client import get_model_session, model_request_timeout
+from app.utils import metrics
+from app.utils.sse import wants_event_stream, execution_event_stream
+from app.utils.request_utils import body_flag
+from app.utils.rate_limit import hand_off_slot, rate_limited
+from app.utils.compression import compressed
+from app.services.execution_queue import QueueFullError
+from app.services.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.services.identity_service import IdentityService
+from app.utils.deadline import Deadline, DeadlineExceeded
 from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
+from config import Config
 
 api_bp = Blueprint('api', __name__)
 conversations = {}
@@ -17,15 +29,110 @@ conversations = {}
 # 加载.env文件中的环境变量
 load_dotenv()
 
-# 通义千问API配置
+# 通义千问API配置（请求地址见 Config.TONGYI_API_URL）
 TONGYI_API_KEY = os.getenv("TONGYI_API_KEY")
-TONGYI_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
 
 # 检查API密钥是否存在
 if not TONGYI_API_KEY:
     print("警告: 未找到通义千问API密钥，请设置TONGYI_API_KEY环境变量")
 
 
+def chat_request(user_input):
+    """/chat 发往通义千问的请求体和请求头（同步视图与 ASGI 模式共用）"""
+    # 构建符合最新API规范的消息
+    messages = [
+        {"role": "system", "content": "你是一个专业的人工智能助手，用中文简洁回答"},
+        {"role": "user", "content": user_input}
+    ]
+
+    payload = {
+        "model": "qwen-turbo",
+        "input": {
+            "messages": messages
+        },
+        "parameters": {
+            "result_format": "message",
+            "temperature": 0.7,
+            "top_p": 0.8
+        }
+    }
+
+    # 修正后的请求头（移除无效字段）
+    headers = {
+        "Authorization": f"Bearer {TONGYI_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    return payload, headers
+
+
+def chat_reply(result):
+    # 安全提取回复
+    return result.get("output", {}).get("choices", [{}])[0].get("message", {}).get("content", "无法生成回复")
+
+
+def parse_chat_request():
+    """读取并校验 /chat 请求体，返回 (data, 参数错误时的响应)；同步视图与 ASGI 模式共用"""
+    data = request.json
+    if not all([data.get('session_id'), data.get('input')]):
+        return data, (jsonify({"error": "Missing required parameters"}), 400)
+    return data, None
+
+
+def chat_breaker(payload):
+    return circuit_breakers.get('dashscope', payload["model"], TONGYI_API_KEY)
+
+
+def record_chat_call(breaker, model, start, response=None, error=None):
+    """记录上游调用结果；4xx 是请求本身的问题，只有限流和服务端错误计入熔断"""
+    latency = time.perf_counter() - start
+    if error is not None:
+        breaker.record(latency, ok=False)
+        metrics.record_upstream_error(model, error)
+        return
+    breaker.record(latency, ok=response.status_code != 429 and response.status_code < 500)
+
+
+def chat_response(response, session_id, model):
+    """把上游响应（requests 或 httpx）转换为接口响应；同步视图与 ASGI 模式共用"""
+    # 增强错误处理
+    if response.status_code != 200:
+        metrics.UPSTREAM_ERRORS.labels(model=metrics.model_label(model), kind=f"http_{response.status_code}").inc()
+        error_detail = response.text
+        print(f"API Error Details: {error_detail}")
+        return jsonify({
+            "error": "AI service error",
+            "status_code": response.status_code,
+            "detail": error_detail[:200]  # 截取部分错误信息
+        }), 503
+
+    result = response.json()
+    print(f"Full API response: {json.dumps(result, indent=2, ensure_ascii=False)}")
+
+    assistant_response = chat_reply(result)
+
+    return jsonify({
+        "response": assistant_response,
+        "session_id": session_id
+    })
+
+
+def chat_error_response(e):
+    if isinstance(e, CircuitOpenError):
+        return _circuit_open_response(e)
+    print(f"Unexpected error: {str(e)}")
+    return jsonify({
+        "error": "Internal server error",
+        "details": str(e)[:200]
+    }), 500
+
+
+def _circuit_open_response(e):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+
 @api_bp.route('/start_chat', methods=['POST'])
 def start_chat():
     session_id = str(uuid.uuid4())
@@ -34,119 +141,132 @@ def start_chat():
 
 
 @api_bp.route('/chat', methods=['POST'])
+@rate_limited
 def chat():
     try:
-        data = request.json
-        session_id = data.get('session_id')
-        user_input = data.get('input')
-
-        if not all([session_id, user_input]):
-            return jsonify({"error": "Missing required parameters"}), 400
-
-        # 构建符合最新API规范的消息
-        messages = [
-            {"role": "system", "content": "你是一个专业的人工智能助手，用中文简洁回答"},
-            {"role": "user", "content": user_input}
-        ]
-
-        payload = {
-            "model": "qwen-turbo",
-            "input": {
-                "messages": messages
-            },
-            "parameters": {
-                "result_format": "message",
-                "temperature": 0.7,
-                "top_p": 0.8
-            }
-        }
+        data, invalid = parse_chat_request()
+        if invalid:
+            return invalid
 
-        # 修正后的请求头（移除无效字段）
-        headers = {
-            "Authorization": f"Bearer {TONGYI_API_KEY}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        payload, headers = chat_request(data['input'])
 
         # 打印调试信息
         print(f"Final request payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
 
-        response = requests.post(
-            TONGYI_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
+        # 熔断打开时直接返回 503，不再等待上游超时
+        breaker = chat_breaker(payload)
+        breaker.acquire()
+        start = time.perf_counter()
+        try:
+            with metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(payload["model"]), stream='false').time():
+                response = get_model_session().post(
+                    Config.TONGYI_API_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=model_request_timeout()
+                )
+        except Exception as e:
+            record_chat_call(breaker, payload["model"], start, error=e)
+            raise
+        record_chat_call(breaker, payload["model"], start, response)
+        return chat_response(response, data['session_id'], payload["model"])
 
-        # 增强错误处理
-        if response.status_code != 200:
-            error_detail = response.text
-            print(f"API Error Details: {error_detail}")
-            return jsonify({
-                "error": "AI service error",
-                "status_code": response.status_code,
-                "detail": error_detail[:200]  # 截取部分错误信息
-            }), 503
+    except Exception as e:
+        return chat_error_response(e)
 
-        result = response.json()
-        print(f"Full API response: {json.dumps(result, indent=2, ensure_ascii=False)}")
 
-        # 安全提取回复
-        assistant_response = result.get("output", {}).get("choices", [{}])[0].get("message", {}).get("content",
-                                                                                                     "无法生成回复")
+def parse_execution_request():
+    """读取并校验执行请求体，返回 (data, 参数错误时的响应)；同步视图与 ASGI 模式共用"""
+    data = request.get_json()
+    if not data or 'input' not in data:
+        return data, (jsonify({"error": "Missing input parameter"}), 400)
+    return data, None
 
-        return jsonify({
-            "response": assistant_response,
-            "session_id": session_id
-        })
 
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        return jsonify({
-            "error": "Internal server error",
-            "details": str(e)[:200]
-        }), 500
+def execution_response(output, execution_id, status):
+    return jsonify({
+        "execution_id": execution_id,
+        "output": output,
+        "status": status,
+        "timestamp": datetime.utcnow().isoformat()
+    }), 200
+
+
+def execution_error_response(e):
+    """执行失败时的响应；同步视图与 ASGI 模式共用"""
+    if isinstance(e, ValueError):
+        return jsonify({"error": str(e)}), 404  # 资源未找到
+    if isinstance(e, DeadlineExceeded):
+        return jsonify({"error": str(e), "status": 'timeout'}), 504
+    if isinstance(e, CircuitOpenError):
+        return _circuit_open_response(e)
+    if isinstance(e, QueueFullError):
+        return jsonify({"error": str(e)}), 503
+    return jsonify({
+        "error": "Internal server error",
+        "details": str(e)
+    }), 500
+
 
 @api_bp.route('/execute/<int:agent_id>', methods=['POST'])
 @jwt_required()
+@rate_limited
 def execute_agent(agent_id):
     user_id = get_jwt_identity()
-    data = request.get_json()
-
     # 参数校验
-    if not data or 'input' not in data:
-        return jsonify({"error": "Missing input parameter"}), 400
+    data, invalid = parse_execution_request()
+    if invalid:
+        return invalid
 
     try:
         # 获取上下文ID（用于多轮对话）
         parent_execution_id = data.get('parent_execution_id')
+        # 截止时间：AGENT_EXECUTION_TIMEOUT 为上限，可用 timeout 参数缩短
+        deadline = Deadline.for_request(data.get('timeout'))
+
+        # 流式模式：以 SSE 逐段下发模型输出
+        if wants_event_stream(data):
+            execution, chunks = AgentService.stream_agent(
+                user_id=user_id,
+                agent_id=agent_id,
+                user_input=data['input'],
+                parent_execution_id=parent_execution_id,
+                deadline=deadline
+            )
+            return execution_event_stream(execution, chunks)
+
+        # 异步模式：入队后立即返回 202，客户端轮询 /api/execution/<id>
+        if body_flag(data, 'async'):
+            execution = AgentService.submit_execution(
+                user_id=user_id,
+                agent_id=agent_id,
+                user_input=data['input'],
+                parent_execution_id=parent_execution_id,
+                slot_key=hand_off_slot()  # 在途槽位保留到任务执行结束
+            )
+            return jsonify({
+                "execution_id": execution.id,
+                "status": execution.status,
+                "poll_url": f"/api/execution/{execution.id}"
+            }), 202
 
         # 调用服务层
         ai_response, execution = AgentService.execute_agent(
             user_id=user_id,
             agent_id=agent_id,
             user_input=data['input'],
-            parent_execution_id=parent_execution_id  # 传递上下文
+            parent_execution_id=parent_execution_id,  # 传递上下文
+            deadline=deadline
         )
+        return execution_response(ai_response, execution.id, execution.status)
 
-        return jsonify({
-            "execution_id": execution.id,
-            "output": ai_response,
-            "status": execution.status,
-            "timestamp": datetime.utcnow().isoformat()
-        }), 200
-
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 404  # 资源未找到
     except Exception as e:
-        return jsonify({
-            "error": "Internal server error",
-            "details": str(e)
-        }), 500
+        return execution_error_response(e)
 
 
 @api_bp.route('/execution/<int:execution_id>', methods=['GET'])
 @jwt_required()
+@compressed
 def get_execution(execution_id):
     user_id = get_jwt_identity()
 
@@ -166,4 +286,39 @@ def get_execution(execution_id):
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def cache_stats():
+    """模型回复缓存命中统计"""
+    return jsonify({"completion_cache": CompletionCache.stats()}), 200
+
+
+@api_bp.route('/router/status', methods=['GET'])
+@jwt_required()
+def router_status():
+    """各模型后端滑动窗口内的错误率、p95 延迟和健康状态"""
+    return jsonify({"backends": model_router.status()}), 200
+
+
+@api_bp.route('/admin/breakers', methods=['GET'])
+@jwt_required()
+def breaker_status():
+    """各模型后端（按 provider/model/密钥）熔断器的状态，仅管理员可见"""
+    identity = IdentityService.get(get_jwt_identity())
+    if not identity or not identity.is_admin:
+        return jsonify({"error": "Admin privileges required"}), 403
+    return jsonify({"breakers": circuit_breakers.status()}), 200
+
+
+@api_bp.route('/admin/breakers/reset', methods=['POST'])
+@jwt_required()
+def reset_breakers():
+    """手动关闭熔断器；body 中的 name 为空时重置全部"""
+    identity = IdentityService.get(get_jwt_identity())
+    if not identity or not identity.is_admin:
+        return jsonify({"error": "Admin privileges required"}), 403
+    name = (request.get_json(silent=True) or {}).get('name')
+    return jsonify({"reset": circuit_breakers.reset(name)}), 200
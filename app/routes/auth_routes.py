@@ -5,22 +5,35 @@ from app.services.auth_service import AuthService
 from app.utils.auth import validate_user_input
 from app.utils.cors_utils import build_cors_preflight_response
 from app.services.api_service import ApiService
+from app.services.identity_service import IdentityService
+from app.services.password_hasher import PasswordHasherBusy
+from app.utils.rate_limit import login_concurrency_limited
 
 auth_bp = Blueprint('auth', __name__)
 
 
+def _hasher_busy_response(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @auth_bp.route('/register', methods=['POST'])
+@login_concurrency_limited
 def register():
     data = request.get_json()
     errors = validate_user_input(data)
     if errors:
         return jsonify({"errors": errors}), 400
 
-    result = AuthService.register_user(
-        username=data['username'],
-        email=data['email'],
-        password=data['password']
-    )
+    try:
+        result = AuthService.register_user(
+            username=data['username'],
+            email=data['email'],
+            password=data['password']
+        )
+    except PasswordHasherBusy as e:
+        return _hasher_busy_response(e)
 
     if result['success']:
         return jsonify({"message": "User registered successfully"}), 201
@@ -29,6 +42,7 @@ def register():
 
 
 @auth_bp.route('/login', methods=['POST'])
+@login_concurrency_limited
 def login():
     data = request.get_json()
     username_or_email = data.get('username_or_email')
@@ -37,7 +51,10 @@ def login():
     if not username_or_email or not password:
         return jsonify({"error": "Missing username/email or password"}), 400
 
-    user = AuthService.authenticate_user(username_or_email, password)
+    try:
+        user = AuthService.authenticate_user(username_or_email, password)
+    except PasswordHasherBusy as e:
+        return _hasher_busy_response(e)
     if not user:
         return jsonify({"error": "Invalid credentials"}), 401
 
@@ -74,7 +91,8 @@ import json
 @jwt_required()
 def get_current_user():
     user_id = get_jwt_identity()
-    user = AuthService.get_user_by_id(user_id)
+    # 读缓存的身份快照，不查询 user 表
+    user = IdentityService.get(user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -0,0 +1,79 @@
+from typing import Optional
+
+from app.extensions import db
+from app.models import Agent, AgentVersion
+from app.services.tongyi_service import CompiledAgent
+from app.utils.cache import TTLCache
+from config import Config
+
+# agent_id -> 当前版本；命中时按 agent 表的版本号校验，其他进程的修改和删除立即生效
+current_config_cache = TTLCache(maxsize=Config.AGENT_CONFIG_CACHE_SIZE, ttl=Config.AGENT_CONFIG_CACHE_TTL)
+# (agent_id, version) -> 编译结果；版本内容不可变，只按容量淘汰
+version_config_cache = TTLCache(maxsize=Config.AGENT_CONFIG_CACHE_SIZE, ttl=24 * 3600)
+
+
+class AgentConfigService:
+    """执行路径使用的 Agent 配置：按 (agent_id, version) 缓存编译后的快照，热点 Agent 执行时只按主键读取版本号，
+    不加载整行也不重新编译；一次执行自始至终使用同一个快照，执行期间 Agent 被修改也不受影响"""
+
+    @staticmethod
+    def compile(agent: Agent) -> CompiledAgent:
+        config = {field: getattr(agent, field) for field in AgentVersion.SNAPSHOT_FIELDS}
+        return CompiledAgent.compile(agent.id, agent.user_id, agent.version or 1, config)
+
+    @staticmethod
+    def current(agent_id) -> Optional[CompiledAgent]:
+        """当前版本，Agent 不存在或已删除时返回 None"""
+        agent_id = int(agent_id)
+        compiled = current_config_cache.get(agent_id)
+        if compiled is not None:
+            # 缓存可能由本进程写入，而修改或删除发生在其他进程：版本号一致且未删除才使用
+            row = db.session.query(Agent.version).filter(Agent.id == agent_id, Agent.deleted_at.is_(None)).first()
+            if row is not None and (row.version or 1) == compiled.version:
+                return compiled
+            current_config_cache.pop(agent_id)
+            if row is None:
+                return None
+
+        agent = Agent.live().filter_by(id=agent_id).first()
+        if agent is None:
+            return None
+        return AgentConfigService.refresh(agent)
+
+    @staticmethod
+    def get(user_id, agent_id) -> Optional[CompiledAgent]:
+        """用户自己的 Agent 的当前版本，不属于该用户时返回 None"""
+        compiled = AgentConfigService.current(agent_id)
+        if compiled is None or compiled.user_id != int(user_id):
+            return None
+        return compiled
+
+    @staticmethod
+    def get_version(agent_id, version) -> Optional[CompiledAgent]:
+        """指定版本（异步执行按入队时的版本运行），Agent 已删除时返回 None"""
+        current = AgentConfigService.current(agent_id)
+        if current is None or version is None or current.version == version:
+            return current
+
+        key = (current.id, version)
+        compiled = version_config_cache.get(key)
+        if compiled is None:
+            row = AgentVersion.query.filter_by(agent_id=current.id, version=version).first()
+            if row is None:
+                # 升级前创建的Agent没有历史快照，退回当前版本
+                return current
+            compiled = CompiledAgent.compile(current.id, current.user_id, version, row.config_snapshot)
+            version_config_cache.set(key, compiled)
+        return compiled
+
+    @staticmethod
+    def refresh(agent: Agent) -> CompiledAgent:
+        """Agent 创建或修改提交后调用，用最新版本替换本进程的缓存"""
+        compiled = AgentConfigService.compile(agent)
+        current_config_cache.set(compiled.id, compiled)
+        version_config_cache.set((compiled.id, compiled.version), compiled)
+        return compiled
+
+    @staticmethod
+    def invalidate(agent_id):
+        current_config_cache.pop(int(agent_id))
@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+
+import click
+
+from app.extensions import db
+from app.models import Agent, AgentExecution, AgentVersion
+from app.services.archive_service import ArchiveService
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AgentReaper:
+    """后台清理软删除的Agent。
+
+    每次只删除 AGENT_REAPER_CHUNK_SIZE 条执行记录并立即提交，块间休眠 AGENT_REAPER_PAUSE 秒，
+    避免长事务和长时间行锁；进度即数据库中剩余的行，进程重启后会从剩余部分继续。
+    每个块的事务先锁定 Agent 行（SKIP LOCKED），多个进程同时运行时同一块只由一个进程删除。
+    已归档到段文件的正文在删除执行记录之前先从段文件中清除。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AGENT_REAPER_ENABLED', True)
+        self.chunk_size = app.config.get('AGENT_REAPER_CHUNK_SIZE', 1000)
+        self.pause = app.config.get('AGENT_REAPER_PAUSE', 0.2)
+        self.interval = app.config.get('AGENT_REAPER_INTERVAL', 300)
+        app.extensions['agent_reaper'] = self
+
+        if self.enabled:
+            # 首个请求时启动后台线程，接着处理重启前未清理完的Agent
+            @app.before_request
+            def _start_agent_reaper():
+                self._ensure_thread()
+
+        @app.cli.command('reap-agents')
+        def reap_agents():
+            """清理所有已软删除的Agent及其执行记录"""
+            click.echo(f"purged {self.reap()} executions")
+
+    def wake(self):
+        """有新的软删除时立即唤醒后台线程"""
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='agent-reaper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.reap()
+            except Exception as e:
+                logger.error(f"清理已删除Agent失败: {str(e)}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def reap(self) -> int:
+        """按删除时间顺序清理所有软删除的Agent，返回删除的执行记录数"""
+        agent_ids = [agent_id for (agent_id,) in db.session.query(Agent.id)
+                     .filter(Agent.deleted_at.isnot(None)).order_by(Agent.deleted_at)]
+        return sum(self._purge(agent_id) for agent_id in agent_ids)
+
+    @staticmethod
+    def _claim(agent_id) -> bool:
+        """在当前事务中锁定待清理的Agent行；其他进程正在处理同一个Agent时返回 False"""
+        return db.session.query(Agent.id).filter(Agent.id == agent_id, Agent.deleted_at.isnot(None)) \
+            .with_for_update(skip_locked=True).first() is not None
+
+    def _purge(self, agent_id) -> int:
+        purged = 0
+        try:
+            if not self._claim(agent_id):
+                db.session.rollback()
+                return purged
+            segments = [segment for (segment,) in db.session.query(AgentExecution.archive_segment)
+                        .filter(AgentExecution.agent_id == agent_id, AgentExecution.archive_segment.isnot(None))
+                        .distinct()]
+            if segments:
+                archived = ArchiveService.purge_agent(agent_id, segments)
+                logger.info(f"Agent {agent_id}: 已从 {len(segments)} 个归档段删除 {archived} 条记录")
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        while True:
+            try:
+                if not self._claim(agent_id):
+                    db.session.rollback()
+                    return purged
+                # 按 id 倒序删除：子对话先于父对话删除，减少自引用外键的级联更新
+                ids = [execution_id for (execution_id,) in db.session.query(AgentExecution.id)
+                       .filter_by(agent_id=agent_id).order_by(AgentExecution.id.desc()).limit(self.chunk_size)]
+                if not ids:
+                    break
+                deleted = db.session.query(AgentExecution).filter(AgentExecution.id.in_(ids)) \
+                    .delete(synchronize_session=False)
+                db.session.query(Agent).filter_by(id=agent_id).update(
+                    {Agent.purged_executions: db.func.coalesce(Agent.purged_executions, 0) + deleted},
+                    synchronize_session=False
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            purged += deleted
+            metrics.AGENT_EXECUTIONS_PURGED.inc(deleted)
+            logger.info(f"Agent {agent_id}: 已清理 {purged} 条执行记录")
+            if self.pause:
+                time.sleep(self.pause)
+
+        # 仍持有 Agent 行锁
+        try:
+            db.session.query(AgentVersion).filter_by(agent_id=agent_id).delete(synchronize_session=False)
+            db.session.query(Agent).filter_by(id=agent_id).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info(f"Agent {agent_id} 清理完成，共删除 {purged} 条执行记录")
+        return purged
+
+agent_reaper = AgentReaper()
@@ -1,52 +1,111 @@
 from app.extensions import db
-from app.models import Agent, AgentExecution
+from app.models import Agent, AgentExecution, AgentVersion
 from datetime import datetime
+from sqlalchemy.orm import load_only
+from app.utils.pagination import keyset_page
 from app.services.tongyi_service import Message
 from app.services.tongyi_service import TongyiService
+from app.services.execution_queue import execution_queue
+from app.services.catalog_service import agent_catalog
+from app.services.agent_reaper import agent_reaper
+from app.services.archive_service import ArchiveService
+from app.services.agent_config_service import AgentConfigService
+from app.services.rate_limiter import rate_limiter
+from config import Config
 
 
 class AgentService:
+    # 允许通过接口修改的字段；id、user_id、version、deleted_at 等由服务端维护，不接受客户端写入
+    UPDATABLE_FIELDS = AgentVersion.SNAPSHOT_FIELDS + ('is_public',)
 
     @staticmethod
     def list_agents(user_id, public=False):
-        query = Agent.query
+        query = Agent.live()
         if public:
             query = query.filter_by(is_public=True)
         else:
             query = query.filter_by(user_id=user_id)
         return query.order_by(Agent.created_at.desc()).all()
 
+    @staticmethod
+    def page_agents(user_id, public=False, limit=50, cursor=None, fields=None):
+        """
+        按 (created_at, id) 游标分页列出Agent
+        :param fields: 需要返回的字段，仅加载对应列
+        :return: (agents, next_cursor)
+        """
+        query = Agent.live()
+        if public:
+            query = query.filter_by(is_public=True)
+        else:
+            query = query.filter_by(user_id=user_id)
+        if fields:
+            query = query.options(load_only(*AgentService._load_columns(Agent, fields, 'created_at')))
+        return keyset_page(query, Agent.created_at, Agent.id, limit, cursor)
+
+    @staticmethod
+    def _load_columns(model, fields, time_field):
+        """投影字段 + 游标所需的排序列"""
+        names = set(fields) | {'id', time_field}
+        return [getattr(model, name) for name in names]
+
     @staticmethod
     def get_agent(user_id, agent_id):
-        return Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        return Agent.live().filter_by(id=agent_id, user_id=user_id).first()
 
     @staticmethod
     def update_agent(user_id, agent_id, update_data):
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        """修改Agent；执行相关的配置有变化时版本号加一并写入新的配置快照"""
+        # 行锁保证并发修改时版本号依次递增
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).with_for_update().first()
         if not agent:
             return None
 
+        previous = AgentVersion.from_agent(agent)
+        changed = False
         for key, value in update_data.items():
-            if hasattr(agent, key):
-                setattr(agent, key, value)
+            if key not in AgentService.UPDATABLE_FIELDS:
+                continue
+            if key in AgentVersion.SNAPSHOT_FIELDS and getattr(agent, key) != value:
+                changed = True
+            setattr(agent, key, value)
+
+        if changed:
+            # 升级前创建的Agent没有初始快照，先补上修改前的版本
+            if not AgentVersion.query.filter_by(agent_id=agent.id, version=previous.version).first():
+                db.session.add(previous)
+            agent.version = previous.version + 1
+            db.session.add(AgentVersion.from_agent(agent))
 
         db.session.commit()
+        agent_catalog.upsert(agent)
+        AgentConfigService.refresh(agent)
         return agent
 
+    @staticmethod
+    def list_versions(user_id, agent_id):
+        """Agent 的全部配置快照，按版本倒序；Agent 不存在时返回 None"""
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
+        if not agent:
+            return None
+        return AgentVersion.query.filter_by(agent_id=agent_id).order_by(AgentVersion.version.desc()).all()
+
     @staticmethod
     def delete_agent(user_id, agent_id):
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        """软删除：立即从列表中消失，执行记录和Agent本身由 agent_reaper 分块清理"""
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
         if not agent:
             return False
-        # 手动删除所有关联的 AgentExecution
-        AgentExecution.query.filter_by(agent_id=agent_id).delete()
-        db.session.delete(agent)
+        agent.deleted_at = datetime.utcnow()
         db.session.commit()
+        agent_catalog.remove(agent_id)
+        AgentConfigService.invalidate(agent_id)
+        agent_reaper.wake()
         return True
 
     @staticmethod
     def create_execution(user_id, agent_id, input_text):
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
         if not agent:
             return None
 
@@ -78,22 +137,63 @@ class AgentService:
         return execution
 
     @staticmethod
-    def list_agent_executions(user_id, agent_id):
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+    def list_agent_executions(user_id, agent_id, fields=None):
+        """返回行查询结果（Row），用 AgentExecution.row_to_dict 序列化"""
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
         if not agent:
             return None
 
         return AgentExecution.query.filter_by(
             agent_id=agent_id,
             user_id=user_id
-        ).order_by(AgentExecution.start_time.desc()).all()
+        ).with_entities(*AgentExecution.row_columns(fields)).order_by(AgentExecution.start_time.desc()).all()
+
+    @staticmethod
+    def page_agent_executions(user_id, agent_id, limit=50, cursor=None, fields=None):
+        """
+        按 (start_time, id) 游标分页列出执行记录
+        :param fields: 需要返回的字段，仅查询对应列
+        :return: (rows, next_cursor)，Agent 不存在时返回 None
+        """
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
+        if not agent:
+            return None
+
+        query = AgentExecution.query.filter_by(agent_id=agent_id, user_id=user_id)
+        query = query.with_entities(*AgentExecution.row_columns(fields))
+        return keyset_page(query, AgentExecution.start_time, AgentExecution.id, limit, cursor)
+
+    @staticmethod
+    def export_executions(user_id, agent_id, since=None, until=None, statuses=None, after_id=None):
+        """
+        按 id 升序读取执行记录，用于导出；迭代时走服务端游标，每次只缓冲 EXPORT_BATCH_SIZE 行
+        :param after_id: 断点续传，只返回 id 大于该值的记录
+        :return: 行查询（需在请求上下文内迭代），Agent 不存在时返回 None
+        """
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
+        if not agent:
+            return None
+
+        query = AgentExecution.query.filter_by(agent_id=agent_id, user_id=user_id)
+        if since:
+            query = query.filter(AgentExecution.start_time >= since)
+        if until:
+            query = query.filter(AgentExecution.start_time < until)
+        if statuses:
+            query = query.filter(AgentExecution.status.in_(statuses))
+        if after_id:
+            query = query.filter(AgentExecution.id > after_id)
+        query = query.with_entities(*AgentExecution.row_columns()).order_by(AgentExecution.id)
+        return query.execution_options(yield_per=Config.EXPORT_BATCH_SIZE)
 
     @staticmethod
     def get_execution(user_id, execution_id):
-        return AgentExecution.query.filter_by(
+        execution = AgentExecution.query.filter_by(
             id=execution_id,
             user_id=user_id
         ).first()
+        ArchiveService.hydrate([execution])
+        return execution
 
 
     @staticmethod
@@ -108,7 +208,10 @@ class AgentService:
             **kwargs
         )
         db.session.add(agent)
+        db.session.flush()
+        db.session.add(AgentVersion.from_agent(agent))
         db.session.commit()
+        agent_catalog.upsert(agent)
 
         # 测试模型连接
         try:
@@ -123,65 +226,104 @@ class AgentService:
         return agent
 
     @staticmethod
-    def execute_agent(user_id, agent_id, user_input, parent_execution_id=None):
+    def _resolve_parent_id(user_id, parent_execution_id):
+        """验证父级执行记录归属，合法时返回其ID，由上下文构建按 token 预算加载整条对话链"""
+        if not parent_execution_id:
+            return None
+        parent = AgentExecution.query.filter_by(
+            id=parent_execution_id,
+            user_id=user_id,
+            status='completed'
+        ).first()
+        return parent.id if parent else None
+
+    @staticmethod
+    def stream_agent(user_id, agent_id, user_input, parent_execution_id=None, deadline=None):
         """
-        执行Agent对话（支持多轮上下文）
+        流式执行Agent对话
         :param user_id: 用户ID
         :param agent_id: Agent ID
         :param user_input: 用户输入
         :param parent_execution_id: 父级执行ID（用于上下文关联）
-        :return: (response_text, execution)
+        :param deadline: 截止时间（Deadline），默认 AGENT_EXECUTION_TIMEOUT
+        :return: (execution, chunks) chunks 为增量文本迭代器，迭代结束时输出已写入 execution
         """
-        # 验证Agent归属
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        agent = AgentConfigService.get(user_id, agent_id)
         if not agent:
             raise ValueError("Agent not found or access denied")
-        execution = None
+
+        return TongyiService.stream_response(
+            agent=agent,
+            user_input=user_input,
+            execution_id=AgentService._resolve_parent_id(user_id, parent_execution_id),
+            deadline=deadline
+        )
+
+    @staticmethod
+    def submit_execution(user_id, agent_id, user_input, parent_execution_id=None, slot_key=None):
+        """
+        异步执行Agent对话：创建 pending 执行记录并入队，由后台线程完成模型调用
+        :param slot_key: 请求占用的限流在途槽位，交给队列在任务结束时释放（入队失败时立即释放）
+        :return: execution（status 为 pending）
+        """
         try:
+            agent = AgentConfigService.get(user_id, agent_id)
+            if not agent:
+                raise ValueError("Agent not found or access denied")
 
-            # 获取对话历史（如果是多轮对话）
-            history_message = []
-            # 验证父级执行记录归属（如果存在）
-            if parent_execution_id:
-                history = AgentExecution.query.filter_by(
-                    id=parent_execution_id,
-                    user_id=user_id,
-                    status='completed'
-                ).first()
-                if history and history.output:
-                    history_message.extend([
-                        Message(role="user", content=history.input),
-                        Message(role="assistant", content=history.output)
-                    ])
-
-            # 调用AI服务生成回复
-            ai_response = TongyiService.generate_response(
-                agent=agent,
-                user_input=user_input,
-                history_messages=history_message
+            execution = AgentExecution(
+                agent_id=agent.id,
+                agent_version=agent.version,
+                user_id=agent.user_id,
+                input=user_input,
+                status='pending',
+                parent_execution_id=AgentService._resolve_parent_id(user_id, parent_execution_id)
             )
+            db.session.add(execution)
+            db.session.commit()
+        except Exception:
+            if slot_key:
+                rate_limiter.release(slot_key)
+            raise
 
-            # 如果是首次对话，则创建新执行记录
-            if parent_execution_id:
-                execution = AgentExecution.query.get(parent_execution_id)
-            else:
-                execution = AgentExecution(
-                    agent_id=agent_id,
-                    user_id=user_id,
-                    input=user_input,
-                    output=ai_response,
-                    status='completed',
-                    parent_execution_id=None
-                )
-                db.session.add(execution)
-                db.session.commit()
+        try:
+            execution_queue.submit(execution.id, slot_key)
+        except Exception as e:
+            if slot_key:
+                rate_limiter.release(slot_key)
+            execution.status = 'failed'
+            execution.output = str(e)
+            execution.end_time = datetime.utcnow()
+            db.session.commit()
+            raise
+        return execution
 
-            return ai_response, execution
+    @staticmethod
+    def get_conversation_chain(execution_id):
+        """获取从根节点到当前执行记录（不含当前）的对话链"""
+        return ArchiveService.hydrate(AgentExecution.ancestor_chain(execution_id, include_self=False))
 
+    @staticmethod
+    def execute_agent(user_id, agent_id, user_input, parent_execution_id=None, deadline=None):
+        """
+        执行Agent对话（支持多轮上下文）
+        :param user_id: 用户ID
+        :param agent_id: Agent ID
+        :param user_input: 用户输入
+        :param parent_execution_id: 父级执行ID（用于上下文关联）
+        :param deadline: 截止时间（Deadline），默认 AGENT_EXECUTION_TIMEOUT，超时后执行记录标记为 timeout
+        :return: (response_text, execution)
+        """
+        # 验证Agent归属（走配置快照缓存，不查询 agent 表）
+        agent = AgentConfigService.get(user_id, agent_id)
+        if not agent:
+            raise ValueError("Agent not found or access denied")
 
-        except Exception as e:
-            if execution is not None:  # 安全检查
-                execution.status = 'failed'
-                execution.error_message = str(e)
-                db.session.commit()
-            raise
\ No newline at end of file
+        # 调用AI服务生成回复（多轮对话时由父级执行记录加载上下文）；
+        # 执行记录由 TongyiService 统一创建和更新，失败时标记为 failed，超时标记为 timeout
+        return TongyiService.generate_response(
+            agent=agent,
+            user_input=user_input,
+            execution_id=AgentService._resolve_parent_id(user_id, parent_execution_id),
+            deadline=deadline
+        )
@@ -3,6 +3,11 @@ from app.extensions import db
 from typing import Optional, Dict, Any
 from datetime import datetime
 from app.models import ApiKey
+from app.utils.cache import TTLCache
+from config import Config
+
+# user_id -> {provider: 密钥}，避免每次对话都查询 api 表
+api_key_cache = TTLCache(maxsize=Config.API_KEY_CACHE_SIZE, ttl=Config.API_KEY_CACHE_TTL)
 
 
 class ApiService:
@@ -21,6 +26,39 @@ class ApiService:
             )
         return None
 
+    @staticmethod
+    def get_provider_keys(user_id: int) -> Dict[str, str]:
+        """获取用户已配置的各模型服务密钥 {provider: key}（带进程内缓存），未配置的服务不出现在结果中"""
+        user_id = int(user_id)
+        keys = api_key_cache.get(user_id)
+        if keys is not None:
+            return keys
+
+        api = Api.query.filter_by(user_id=user_id).first()
+        if not api:
+            raise ValueError(f"用户ID {user_id} 未找到API记录")
+
+        keys = {}
+        if api.tongyi_api_key:
+            keys['dashscope'] = api.tongyi_api_key
+        if api.openai_api_key:
+            keys['openai'] = api.openai_api_key
+        api_key_cache.set(user_id, keys)
+        return keys
+
+    @staticmethod
+    def get_tongyi_api_key(user_id: int) -> str:
+        """获取用户的通义API密钥（带进程内缓存）"""
+        tongyi_api_key = ApiService.get_provider_keys(user_id).get('dashscope')
+        if not tongyi_api_key:
+            raise ValueError(f"用户ID {user_id} 的通义API密钥为空")
+        return tongyi_api_key
+
+    @staticmethod
+    def invalidate_api_key(user_id: int):
+        """密钥变更后清除缓存"""
+        api_key_cache.pop(int(user_id))
+
     @staticmethod
     def update_api_key(user_id: int, data: Dict[str, Any]) -> Optional[ApiKey]:
         """更新用户的API密钥"""
@@ -41,6 +79,7 @@ class ApiService:
 
         api.updated_at = datetime.utcnow()
         db.session.commit()
+        ApiService.invalidate_api_key(user_id)
 
         return ApiKey(
             id=api.id,
@@ -0,0 +1,288 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.utils.cache import TTLCache
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：不做跨进程加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 段文件相对路径 -> {execution_id: (偏移, 长度)}；只缓存偏移索引，正文按需从段文件读取单条
+segment_index_cache = TTLCache(maxsize=Config.ARCHIVE_SEGMENT_CACHE_SIZE, ttl=600)
+
+ARCHIVABLE_STATUSES = ('completed', 'failed', 'timeout', 'cancelled')
+
+_ARCHIVE_COLUMNS = (
+    AgentExecution.id, AgentExecution.user_id, AgentExecution.agent_id, AgentExecution.parent_execution_id,
+    AgentExecution.input, AgentExecution.output, AgentExecution.status, AgentExecution.cached,
+    AgentExecution.start_time, AgentExecution.end_time
+)
+
+_CORRUPT_ERRORS = (OSError, EOFError, zlib.error, ValueError)
+
+
+class ArchiveService:
+    """把过期执行记录的 input/output 移入按 月/用户 分区的 gzip JSONL 段文件
+
+    数据库中保留原行作为索引（input 置空、output 置 NULL、archive_segment 指向段文件），
+    对话链、分页和外键都不受影响；读取时按 archive_segment 从段文件回填。
+    段文件中每条记录是一个独立的 gzip member，旁边的 .idx 文件记录 id -> (偏移, 长度)，读取单条只需 seek 一次。
+    """
+
+    @staticmethod
+    def segment_path(start_time, user_id):
+        return f"{start_time:%Y-%m}/user_{user_id}.jsonl.gz"
+
+    @staticmethod
+    def _absolute(segment):
+        root = os.path.abspath(Config.ARCHIVE_DIR)
+        path = os.path.abspath(os.path.join(root, segment))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"Invalid archive segment: {segment}")
+        return path
+
+    @staticmethod
+    @contextmanager
+    def _write_lock():
+        """追加归档与清理重写段文件的跨进程互斥"""
+        root = os.path.abspath(Config.ARCHIVE_DIR)
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _append_records(raw, records):
+        """逐条写入 gzip member，返回索引行"""
+        raw.seek(0, os.SEEK_END)
+        offset = raw.tell()
+        entries = []
+        for record in records:
+            member = gzip.compress(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            raw.write(member)
+            entries.append(f"{record['id']}\t{offset}\t{len(member)}\n")
+            offset += len(member)
+        raw.flush()
+        os.fsync(raw.fileno())
+        return entries
+
+    @staticmethod
+    def _append_index(path, entries):
+        with open(path + '.idx', 'a', encoding='utf-8') as index:
+            index.writelines(entries)
+            index.flush()
+            os.fsync(index.fileno())
+
+    @staticmethod
+    def _write_segment(segment, records):
+        """追加写入并落盘；重复归档时读取以最后一条为准"""
+        path = ArchiveService._absolute(segment)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with ArchiveService._write_lock():
+            if os.path.exists(path) and not os.path.exists(path + '.idx'):
+                # 旧格式（一批记录一个 member、无索引）的段文件先转换，之后整个文件都可按偏移读取
+                ArchiveService._rewrite(segment)
+            with open(path, 'ab') as raw:
+                entries = ArchiveService._append_records(raw, records)
+            ArchiveService._append_index(path, entries)
+        segment_index_cache.pop(segment)
+
+    @staticmethod
+    def _iter_segment(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def _rewrite(segment, keep=None) -> int:
+        """流式重写段文件为逐条 member + 索引的格式，keep 返回 False 的记录被丢弃；调用方需持有写锁
+
+        :return: 丢弃的记录数
+        """
+        path = ArchiveService._absolute(segment)
+        if not os.path.exists(path):
+            return 0
+        dropped = 0
+        entries = []
+        with open(path + '.tmp', 'wb') as raw:
+            batch = []
+            for record in ArchiveService._iter_segment(path):
+                if keep is not None and not keep(record):
+                    dropped += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= Config.ARCHIVE_BATCH_SIZE:
+                    entries += ArchiveService._append_records(raw, batch)
+                    batch = []
+            entries += ArchiveService._append_records(raw, batch)
+        with open(path + '.idx.tmp', 'w', encoding='utf-8') as index:
+            index.writelines(entries)
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(path + '.tmp', path)
+        os.replace(path + '.idx.tmp', path + '.idx')
+        segment_index_cache.pop(segment)
+        return dropped
+
+    @staticmethod
+    def purge_agent(agent_id, segments) -> int:
+        """从段文件中删除某个Agent的归档记录（清理已删除的Agent时调用），返回删除的记录数"""
+        purged = 0
+        with ArchiveService._write_lock():
+            for segment in segments:
+                purged += ArchiveService._rewrite(segment, keep=lambda record: record.get('agent_id') != agent_id)
+        return purged
+
+    @staticmethod
+    def load_index(segment):
+        """段文件的偏移索引；没有 .idx 的旧格式段文件返回 None"""
+        index = segment_index_cache.get(segment)
+        if index is not None:
+            return index
+
+        path = ArchiveService._absolute(segment) + '.idx'
+        if not os.path.exists(path):
+            return None
+        index = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    execution_id, offset, length = line.split('\t')
+                    index[int(execution_id)] = (int(offset), int(length))
+                except ValueError:
+                    continue  # 写入中断留下的残行
+        segment_index_cache.set(segment, index)
+        return index
+
+    @staticmethod
+    def _read_at(segment, offset, length):
+        with open(ArchiveService._absolute(segment), 'rb') as raw:
+            raw.seek(offset)
+            return json.loads(gzip.decompress(raw.read(length)))
+
+    @staticmethod
+    def _find(segment, execution_id):
+        try:
+            for _ in range(2):
+                index = ArchiveService.load_index(segment)
+                if index is None:
+                    # 旧格式：流式扫描，不整体载入内存
+                    record = None
+                    for item in ArchiveService._iter_segment(ArchiveService._absolute(segment)):
+                        if item['id'] == execution_id:
+                            record = item
+                    return record
+                entry = index.get(execution_id)
+                if entry is None:
+                    return None
+                try:
+                    record = ArchiveService._read_at(segment, *entry)
+                    if record.get('id') == execution_id:
+                        return record
+                except _CORRUPT_ERRORS:
+                    pass
+                # 段文件已被其他进程重写（清理已删除Agent），缓存的偏移失效，重新读取索引
+                segment_index_cache.pop(segment)
+            return None
+        except _CORRUPT_ERRORS as e:
+            logger.error(f"读取归档段 {segment} 失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def hydrate(executions):
+        """为已归档的执行记录回填 input/output（不标记为脏数据，不会被写回数据库）"""
+        for execution in executions:
+            if execution is None or not execution.archive_segment:
+                continue
+            record = ArchiveService._find(execution.archive_segment, execution.id)
+            if record is not None:
+                set_committed_value(execution, 'input', record['input'])
+                set_committed_value(execution, 'output', record['output'])
+        return executions
+
+    @staticmethod
+    def hydrate_rows(rows, items):
+        """行查询结果版本：rows 需包含 archive_segment 列，items 为对应的 dict"""
+        for row, item in zip(rows, items):
+            segment = row._mapping.get('archive_segment')
+            if not segment or not ({'input', 'output'} & item.keys()):
+                continue
+            record = ArchiveService._find(segment, row.id)
+            if record is not None:
+                for field in ('input', 'output'):
+                    if field in item:
+                        item[field] = record[field]
+        return items
+
+    @staticmethod
+    def archive(older_than_days=None, batch_size=None):
+        """
+        归档 start_time 早于 older_than_days 天、已结束的执行记录
+        :return: 归档条数
+        """
+        days = Config.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        archived = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(*_ARCHIVE_COLUMNS).filter(
+                AgentExecution.id > last_id,
+                AgentExecution.start_time < cutoff,
+                AgentExecution.status.in_(ARCHIVABLE_STATUSES),
+                AgentExecution.archive_segment.is_(None)
+            ).order_by(AgentExecution.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            segments = defaultdict(list)
+            for row in rows:
+                record = dict(row._mapping)
+                record['start_time'] = row.start_time.isoformat() if row.start_time else None
+                record['end_time'] = row.end_time.isoformat() if row.end_time else None
+                segments[ArchiveService.segment_path(row.start_time, row.user_id)].append(record)
+
+            # 先落盘段文件，再清空数据库中的正文；中途失败时最多留下重复的归档记录
+            for segment, records in segments.items():
+                ArchiveService._write_segment(segment, records)
+                db.session.query(AgentExecution).filter(
+                    AgentExecution.id.in_([record['id'] for record in records])
+                ).update({'input': '', 'output': None, 'archive_segment': segment}, synchronize_session=False)
+            db.session.commit()
+            archived += len(rows)
+            logger.info(f"已归档 {archived} 条执行记录（截至 id={last_id}）")
+
+        return archived
+
+    @staticmethod
+    def init_app(app):
+        @app.cli.command('archive-executions')
+        @click.option('--older-than-days', type=int, default=None, help='归档多少天以前的执行记录')
+        @click.option('--batch-size', type=int, default=None, help='每批处理的记录数')
+        def archive_executions(older_than_days, batch_size):
+            """把过期执行记录的正文移入压缩段文件"""
+            count = ArchiveService.archive(older_than_days, batch_size)
+            click.echo(f"archived {count} executions")
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.services.completion_cache import CompletionCache
+from app.services.model_router import model_router
+from app.services.tongyi_service import CompiledAgent, TongyiService
+from app.utils import metrics
+from app.utils.deadline import Deadline, aiter_within
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # 可选依赖（需要 greenlet）
+except ImportError:  # pragma: no cover
+    async_sessionmaker = create_async_engine = None
+
+# 同步驱动 -> 对应的异步驱动
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url: str) -> str:
+    scheme, sep, rest = url.partition('://')
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+class AsyncExecutionStore:
+    """ASGI 模式下执行记录的写入：有异步驱动时使用 AsyncSession，
+    否则退回到线程池中用同步会话写入（不阻塞事件循环，但每次写入占用一个线程）"""
+
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.sessionmaker = None
+
+    def init_app(self, app):
+        self.app = app
+        url = app.config.get('ASYNC_DATABASE_URL') or async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        options = {} if url.startswith('sqlite') else dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        try:
+            if create_async_engine is None:
+                raise ImportError("sqlalchemy.ext.asyncio 不可用")
+            self.engine = create_async_engine(url, **options)
+            self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        except Exception as e:
+            logger.warning(f"异步数据库驱动不可用，执行记录改为在线程池中写入: {str(e)}")
+            self.engine = self.sessionmaker = None
+        app.extensions['async_execution_store'] = self
+
+    async def _execute(self, statement):
+        if self.sessionmaker is None:
+            return await asyncio.to_thread(self._execute_sync, statement)
+        async with self.sessionmaker() as session:
+            async with session.begin():
+                return await session.execute(statement)
+
+    def _execute_sync(self, statement):
+        with self.app.app_context():
+            result = db.session.execute(statement)
+            db.session.commit()
+            return result
+
+    async def create(self, **values) -> int:
+        result = await self._execute(insert(AgentExecution).values(**values))
+        return result.inserted_primary_key[0]
+
+    async def save(self, execution_id: int, **values):
+        await self._execute(update(AgentExecution).where(AgentExecution.id == execution_id).values(**values))
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+
+async_execution_store = AsyncExecutionStore()
+
+
+@dataclass
+class PreparedExecution:
+    """线程池中（应用上下文内）完成的准备工作：配置快照、密钥、对话上下文和回复缓存查找"""
+    agent: CompiledAgent
+    user_input: str
+    parent_execution_id: Optional[int]
+    dashscope_messages: List[dict]
+    api_keys: Dict[str, str]
+    deadline: Deadline
+    cache_key: Optional[str]
+    cached_response: Optional[str]
+
+
+@dataclass
+class ExecutionState:
+    """流式执行的进度，供 SSE 的 done/error 事件读取"""
+    execution_id: int
+    status: str = 'running'
+    output: Optional[str] = None
+
+
+class AsyncExecutionService:
+    """执行Agent对话的协程版本：模型调用和执行记录写入都不占用线程，
+    与 TongyiService.generate_response / stream_response 的记录、缓存和计量行为一致"""
+
+    @staticmethod
+    def prepare(agent: CompiledAgent, user_input: str, parent_execution_id: Optional[int],
+                deadline: Deadline, stream: bool = False) -> PreparedExecution:
+        """同步部分，需在应用上下文中调用（多数查询命中进程内缓存）"""
+        api_keys = TongyiService.resolve_api_keys(agent.user_id)
+        messages = TongyiService.generate_context_messages(
+            agent, user_input, parent_execution_id, None, Config.CONTEXT_MAX_HISTORY_TURNS
+        )
+        dashscope_messages = TongyiService.convert_messages_to_dashscope_format(messages)
+        cache_key = TongyiService._completion_cache_key(agent, dashscope_messages)
+        cached_response = CompletionCache.get(cache_key)
+        if stream and cached_response is None:
+            # 响应头发出后无法再改状态码：后端全部熔断时在建立流之前直接失败
+            model_router.available(agent.model, api_keys)
+        return PreparedExecution(agent, user_input, parent_execution_id, dashscope_messages, api_keys,
+                                 deadline, cache_key, cached_response)
+
+    @staticmethod
+    async def _create_record(prepared: PreparedExecution) -> int:
+        agent = prepared.agent
+        return await async_execution_store.create(
+            agent_id=agent.id,
+            agent_version=agent.version,
+            user_id=agent.user_id,
+            input=prepared.user_input,
+            status='running',
+            parent_execution_id=prepared.parent_execution_id
+        )
+
+    @staticmethod
+    async def _call_model(prepared: PreparedExecution, stream=False):
+        agent = prepared.agent
+        temperature, max_tokens = TongyiService.resolve_generation_params(agent)
+        return await model_router.acall(agent.model, prepared.dashscope_messages, prepared.api_keys,
+                                        temperature, max_tokens, stream=stream, deadline=prepared.deadline,
+                                        hedge=agent.hedge_enabled)
+
+    @staticmethod
+    async def _finish(prepared: PreparedExecution, text: str, usage):
+        CompletionCache.set(prepared.cache_key, text)
+        # 限额计数可能落在 Redis，放到线程池中执行
+        await asyncio.to_thread(TongyiService._record_usage, prepared.agent, usage, prepared.dashscope_messages, text)
+
+    @staticmethod
+    async def execute(prepared: PreparedExecution) -> Tuple[str, int]:
+        """非流式执行，返回 (回复文本, execution_id)；失败时执行记录标记为 failed/timeout 后抛出原异常"""
+        agent = prepared.agent
+        execution_id = await AsyncExecutionService._create_record(prepared)
+        try:
+            ai_response, cached = prepared.cached_response, True
+            if ai_response is None:
+                cached = False
+                with metrics.EXECUTIONS_IN_FLIGHT.labels(mode='async').track_inprogress():
+                    try:
+                        with metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(agent.model), stream='false').time():
+                            response = await AsyncExecutionService._call_model(prepared)
+                        if not response or response.output is None or response.output.text is None:
+                            raise ValueError("AI模型返回结果为空，请检查输入内容或API密钥")
+                    except Exception as e:
+                        metrics.record_upstream_error(agent.model, e)
+                        raise
+                ai_response = response.output.text
+                await AsyncExecutionService._finish(prepared, ai_response, response.usage)
+
+            await async_execution_store.save(execution_id, output=ai_response, status='completed', cached=cached,
+                                             end_time=datetime.utcnow())
+            return ai_response, execution_id
+        except Exception as e:
+            await async_execution_store.save(execution_id,
+                                             status=TongyiService.failure_status(e, prepared.deadline),
+                                             output=str(e), end_time=datetime.utcnow())
+            raise
+
+    @staticmethod
+    async def stream(prepared: PreparedExecution) -> Tuple[ExecutionState, AsyncIterator[str]]:
+        """流式执行：先写入执行记录，再返回增量文本的异步迭代器，迭代结束时输出已写回执行记录"""
+        state = ExecutionState(await AsyncExecutionService._create_record(prepared))
+        return state, AsyncExecutionService._iter_stream(prepared, state)
+
+    @staticmethod
+    async def _iter_stream(prepared: PreparedExecution, state: ExecutionState) -> AsyncIterator[str]:
+        """提前关闭（客户端断开）或任务被取消时执行记录同样会结束（超过截止时间为 timeout，否则为 cancelled）"""
+        agent = prepared.agent
+        deadline = prepared.deadline
+        parts = []
+        usage = None
+        try:
+            if prepared.cached_response is not None:
+                parts.append(prepared.cached_response)
+                yield prepared.cached_response
+            else:
+                metrics.EXECUTIONS_IN_FLIGHT.labels(mode='async').inc()
+                start = time.perf_counter()
+                responses = None
+                try:
+                    responses = await AsyncExecutionService._call_model(prepared, stream=True)
+                    # 上游停滞时在截止时间即中断，而不是等到读超时
+                    async for response in aiter_within(responses, deadline):
+                        usage = response.usage or usage
+                        chunk = response.output.text if response.output else None
+                        if chunk:
+                            if not parts:
+                                metrics.MODEL_FIRST_TOKEN_LATENCY.labels(model=metrics.model_label(agent.model)).observe(time.perf_counter() - start)
+                            parts.append(chunk)
+                            yield chunk
+                        deadline.check()
+                    metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(agent.model), stream='true').observe(time.perf_counter() - start)
+                except (GeneratorExit, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    metrics.record_upstream_error(agent.model, e)
+                    raise
+                finally:
+                    # 提前结束（超时、客户端断开）时关闭上游连接
+                    if responses is not None:
+                        await responses.aclose()
+                    metrics.EXECUTIONS_IN_FLIGHT.labels(mode='async').dec()
+                await AsyncExecutionService._finish(prepared, ''.join(parts), usage)
+
+            state.status, state.output = 'completed', ''.join(parts)
+            await async_execution_store.save(state.execution_id, output=state.output, status=state.status,
+                                             cached=prepared.cached_response is not None, end_time=datetime.utcnow())
+        except (GeneratorExit, asyncio.CancelledError):
+            # 保留已下发的部分输出；shield 保证再次取消时记录仍能写完
+            state.status = 'timeout' if deadline.expired() else 'cancelled'
+            await asyncio.shield(async_execution_store.save(state.execution_id, status=state.status,
+                                                            output=''.join(parts), end_time=datetime.utcnow()))
+            raise
+        except Exception as e:
+            state.status = TongyiService.failure_status(e, deadline)
+            await async_execution_store.save(state.execution_id, status=state.status,
+                                             output=''.join(parts) or str(e), end_time=datetime.utcnow())
+            raise
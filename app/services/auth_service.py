@@ -3,6 +3,8 @@ from flask_bcrypt import Bcrypt
 from app import TongyiService
 from app.models import User, AgentExecution, Agent, Api
 from app.extensions import db
+from app.services.identity_service import IdentityService
+from app.services.password_hasher import PasswordHasherBusy
 from datetime import datetime
 
 bcrypt = Bcrypt()
@@ -57,6 +59,9 @@ class AuthService:
                 "message": "用户注册成功，API记录已创建",
                 "user": new_user
             }
+        except PasswordHasherBusy:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             return {
@@ -78,6 +83,13 @@ class AuthService:
         ).first()
 
         if user and user.check_password(password) and user.is_active:
+            # bcrypt cost 调整后，借登录成功时的明文密码透明升级存量哈希
+            if user.password_needs_rehash():
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
             return user
         return None
 
@@ -104,10 +116,17 @@ class AuthService:
 
         try:
             for key, value in update_data.items():
-                if hasattr(user, key) and key not in ['id', 'password_hash']:
+                if hasattr(user, key) and key not in ['id', 'password_hash', 'is_admin', 'tier']:
                     setattr(user, key, value)
 
             db.session.commit()
+            if 'is_active' in update_data:
+                if user.is_active:
+                    IdentityService.restore(user.id)
+                else:
+                    IdentityService.revoke(user.id)
+            else:
+                IdentityService.invalidate(user.id)
             return user
         except Exception as e:
             db.session.rollback()
@@ -129,6 +148,7 @@ class AuthService:
         try:
             user.set_password(new_password)
             db.session.commit()
+            IdentityService.invalidate(user.id)
             return True
         except Exception:
             db.session.rollback()
@@ -136,7 +156,7 @@ class AuthService:
 
     @staticmethod
     def execute_agent(user_id, agent_id, user_input, execution_id=None):
-        agent = Agent.query.filter_by(id=agent_id, user_id=user_id).first()
+        agent = Agent.live().filter_by(id=agent_id, user_id=user_id).first()
         if not agent:
             raise ValueError("Agent not found or access denied")
 
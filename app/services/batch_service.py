@@ -0,0 +1,161 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from functools import partial
+from typing import Iterator, List, Tuple
+
+from flask import current_app
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.services.agent_config_service import AgentConfigService
+from app.services.context_service import ContextService
+from app.services.rate_limiter import rate_limiter
+from app.services.tongyi_service import TongyiService
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class BatchService:
+    """同一Agent批量执行：一次性落库执行记录，按有限并发调用模型，结果完成即返回"""
+
+    @staticmethod
+    def run_batch(user_id, agent_id, inputs: List[str], max_concurrency=None) -> Tuple[List[AgentExecution], Iterator[dict]]:
+        """
+        :param inputs: 输入文本列表
+        :param max_concurrency: 并发上限，不超过 BATCH_MAX_CONCURRENCY
+        :return: (executions, results) results 为按完成顺序产出的逐条结果
+        """
+        agent = AgentConfigService.get(user_id, agent_id)
+        if not agent:
+            raise ValueError("Agent not found or access denied")
+        if not inputs:
+            raise ValueError("No inputs provided")
+        if len(inputs) > Config.BATCH_MAX_ITEMS:
+            raise ValueError(f"Too many inputs (max {Config.BATCH_MAX_ITEMS})")
+
+        concurrency = min(int(max_concurrency or Config.BATCH_MAX_CONCURRENCY), Config.BATCH_MAX_CONCURRENCY)
+        if Config.RATE_LIMIT_ENABLED:
+            # 同时进行的模型调用数不超过用户等级的在途执行上限
+            concurrency = min(concurrency, rate_limiter.limits_for(rate_limiter.tier_for(user_id))['max_in_flight'])
+        api_keys = TongyiService.resolve_api_keys(agent.user_id)
+
+        # 模型调用只读取不可变的配置快照；工作线程另有应用上下文，记录用量时可查询用户等级
+        jobs = [
+            TongyiService.convert_messages_to_dashscope_format(
+                TongyiService.generate_context_messages(agent, text, None, None, 0)
+            )
+            for text in inputs
+        ]
+        # 按 输入 token + max_tokens 预扣整批的 token 额度，超出时整批拒绝；每条完成后退回预扣、按实际用量扣减
+        _, max_tokens = TongyiService.resolve_generation_params(agent)
+        estimates = [sum(ContextService.message_tokens(m["content"]) for m in messages) + max_tokens
+                     for messages in jobs]
+        rate_limiter.reserve_tokens(agent.user_id, sum(estimates))
+
+        # 单个事务批量插入所有执行记录；进程中途退出时停留在 running 的记录由 execution_queue.recover 标记为 failed
+        executions = [
+            AgentExecution(agent_id=agent.id, agent_version=agent.version, user_id=agent.user_id, input=text,
+                           status='running')
+            for text in inputs
+        ]
+        try:
+            db.session.add_all(executions)
+            db.session.flush()
+            # 提交前读取主键：提交后实例已过期，逐条读取 id 会各触发一次 SELECT
+            execution_ids = [execution.id for execution in executions]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            rate_limiter.refund_tokens(agent.user_id, sum(estimates))
+            raise
+
+        return executions, BatchService._iter_results(current_app._get_current_object(), agent, api_keys,
+                                                      execution_ids, jobs, estimates, max(1, concurrency))
+
+    @staticmethod
+    def _complete(app, agent, messages, api_keys, estimate):
+        """工作线程中执行一条：调用结束（成功或失败）后才退回该条的预扣额度，实际用量由 complete 扣减"""
+        with app.app_context():
+            try:
+                return TongyiService.complete(agent, messages, api_keys)
+            finally:
+                rate_limiter.refund_tokens(agent.user_id, estimate)
+
+    @staticmethod
+    def _result_update(future) -> dict:
+        try:
+            output, cached = future.result()
+            update = {"status": 'completed', "output": output, "cached": cached}
+        except Exception as e:
+            update = {"status": TongyiService.failure_status(e), "output": str(e), "cached": False}
+        update["end_time"] = datetime.utcnow()
+        return update
+
+    @staticmethod
+    def _iter_results(app, agent, api_keys, execution_ids, jobs, estimates, concurrency) -> Iterator[dict]:
+        pending_updates = {}
+        finished = set()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-worker')
+        submitted = []
+        try:
+            for index, messages in enumerate(jobs):
+                submitted.append(executor.submit(BatchService._complete, app, agent, messages, api_keys,
+                                                 estimates[index]))
+            futures = {future: index for index, future in enumerate(submitted)}
+            for future in as_completed(futures):
+                index = futures[future]
+                execution_id = execution_ids[index]
+                update = BatchService._result_update(future)
+                pending_updates[execution_id] = update
+                finished.add(execution_id)
+
+                # 结果分组提交，避免逐条 commit
+                if len(pending_updates) >= Config.BATCH_COMMIT_SIZE:
+                    BatchService._flush(pending_updates)
+
+                yield {
+                    "index": index,
+                    "execution_id": execution_id,
+                    "status": update["status"],
+                    "output": update["output"],
+                    "cached": update["cached"]
+                }
+        finally:
+            # 客户端中途断开时：尚未开始的条目取消并标记为失败、退回预扣额度；
+            # 已在调用中的无法取消，调用结束后由工作线程退回额度并写入实际结果
+            for index, execution_id in enumerate(execution_ids):
+                if execution_id in finished:
+                    continue
+                future = submitted[index] if index < len(submitted) else None
+                if future is None or future.cancel():
+                    pending_updates[execution_id] = {
+                        "status": 'failed', "output": "批量任务已中断", "end_time": datetime.utcnow()
+                    }
+                    rate_limiter.refund_tokens(agent.user_id, estimates[index])
+                else:
+                    future.add_done_callback(partial(BatchService._save_late_result, app, execution_id))
+            executor.shutdown(wait=False)
+            BatchService._flush(pending_updates)
+
+    @staticmethod
+    def _save_late_result(app, execution_id, future):
+        """批量任务中断时仍在调用中的条目，调用结束后单独写入结果"""
+        with app.app_context():
+            try:
+                BatchService._flush({execution_id: BatchService._result_update(future)})
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"写入批量执行 {execution_id} 的结果失败: {str(e)}")
+
+    @staticmethod
+    def _flush(pending_updates: dict):
+        if not pending_updates:
+            return
+        db.session.bulk_update_mappings(
+            AgentExecution,
+            [dict(id=execution_id, **update) for execution_id, update in pending_updates.items()]
+        )
+        db.session.commit()
+        pending_updates.clear()
@@ -0,0 +1,178 @@
+import bisect
+import hashlib
+import re
+import threading
+import time
+from datetime import datetime
+
+from app.models import Agent
+from app.utils.pagination import encode_cursor, decode_cursor
+from config import Config
+
+# 英文/数字按单词切分（同时索引前缀），中文按单字 + 双字切分
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[一-鿿]+')
+_MIN_PREFIX = 2
+
+
+def _index_tokens(text):
+    tokens = set()
+    for word in _TOKEN_RE.findall((text or '').lower()):
+        if word.isascii():
+            tokens.update(word[:i] for i in range(_MIN_PREFIX, len(word) + 1))
+            tokens.add(word)
+        else:
+            tokens.update(word)
+            tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _query_tokens(text):
+    tokens = set()
+    for word in _TOKEN_RE.findall((text or '').lower()):
+        if word.isascii() or len(word) == 1:
+            tokens.add(word)
+        else:
+            tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _sort_key(entry):
+    created_at = entry['created_at']
+    return (datetime.fromisoformat(created_at) if created_at else datetime.min), entry['id']
+
+
+class AgentCatalog:
+    """公开Agent目录的进程内快照 + 名称/描述倒排索引
+
+    首次访问时全量加载，之后由 AgentService 在增删改公开Agent时增量更新；
+    每隔 CATALOG_REFRESH_INTERVAL 秒重新全量加载一次，以同步其他进程的写入。
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval
+        self._entries = {}  # agent_id -> to_dict()
+        self._order = []  # 升序的 (created_at, id)，倒序遍历即为最新在前
+        self._index = {}  # token -> {agent_id}
+        self._digest = None
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def _interval(self):
+        return Config.CATALOG_REFRESH_INTERVAL if self.refresh_interval is None else self.refresh_interval
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._interval():
+            return
+        agents = Agent.live().filter_by(is_public=True).all()
+        with self._lock:
+            self._entries = {}
+            self._order = []
+            self._index = {}
+            for agent in agents:
+                self._add(agent.to_dict())
+            self._order.sort()
+            self._digest = None
+            self._loaded_at = time.monotonic()
+
+    def _add(self, entry, keep_sorted=False):
+        self._entries[entry['id']] = entry
+        key = _sort_key(entry)
+        if keep_sorted:
+            bisect.insort(self._order, key)
+        else:
+            self._order.append(key)
+        for token in _index_tokens(entry['name']) | _index_tokens(entry['description']):
+            self._index.setdefault(token, set()).add(entry['id'])
+
+    def _discard(self, agent_id):
+        entry = self._entries.pop(agent_id, None)
+        if entry is None:
+            return
+        key = _sort_key(entry)
+        pos = bisect.bisect_left(self._order, key)
+        if pos < len(self._order) and self._order[pos] == key:
+            del self._order[pos]
+        for token in _index_tokens(entry['name']) | _index_tokens(entry['description']):
+            ids = self._index.get(token)
+            if ids is not None:
+                ids.discard(agent_id)
+                if not ids:
+                    del self._index[token]
+
+    def upsert(self, agent):
+        """Agent 新建或更新后调用：公开则写入快照，否则移出"""
+        if self._loaded_at is None:
+            return
+        entry = agent.to_dict() if agent.is_public else None
+        with self._lock:
+            self._discard(agent.id)
+            if entry is not None:
+                self._add(entry, keep_sorted=True)
+            self._digest = None
+
+    def remove(self, agent_id):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._discard(agent_id)
+            self._digest = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def digest(self):
+        """快照内容摘要：只取 (id, updated_at)，相同内容在不同进程得到相同值"""
+        self._ensure_loaded()
+        with self._lock:
+            if self._digest is None:
+                h = hashlib.sha1()
+                for agent_id in sorted(self._entries):
+                    h.update(f"{agent_id}:{self._entries[agent_id]['updated_at']};".encode('utf-8'))
+                self._digest = h.hexdigest()
+            return self._digest
+
+    def etag(self, *parts):
+        """当前快照 + 查询参数对应的 ETag"""
+        h = hashlib.sha1(self.digest().encode('ascii'))
+        for part in parts:
+            h.update(b'\0' + str(part).encode('utf-8'))
+        return h.hexdigest()
+
+    def search(self, query=None, limit=None, cursor=None):
+        """按 created_at 倒序返回 (entries, next_cursor, total)；query 的所有词都须命中"""
+        self._ensure_loaded()
+        with self._lock:
+            matched = None
+            if query:
+                tokens = _query_tokens(query)
+                if not tokens:
+                    return [], None, 0
+                for token in sorted(tokens, key=lambda t: len(self._index.get(t, ()))):
+                    ids = self._index.get(token)
+                    if not ids:
+                        return [], None, 0
+                    matched = set(ids) if matched is None else matched & ids
+                    if not matched:
+                        return [], None, 0
+
+            keys = self._order
+            if matched is not None:
+                keys = [key for key in keys if key[1] in matched]
+            total = len(keys)
+
+            end = len(keys)
+            if cursor:
+                timestamp, row_id = decode_cursor(cursor)
+                end = bisect.bisect_left(keys, (timestamp or datetime.min, row_id))
+            start = 0 if limit is None else max(0, end - limit)
+            page = [self._entries[key[1]] for key in reversed(keys[start:end])]
+
+        next_cursor = None
+        if limit is not None and start > 0:
+            timestamp, row_id = _sort_key(page[-1])
+            next_cursor = encode_cursor(timestamp, row_id)
+        return page, next_cursor, total
+
+
+agent_catalog = AgentCatalog()
@@ -0,0 +1,178 @@
+import hashlib
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from app.utils import metrics
+from config import Config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def key_fingerprint(api_key) -> str:
+    """API 密钥的短摘要，用于区分同一后端的不同密钥而不暴露密钥本身"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:8]
+
+
+class CircuitBreaker:
+    """单个 provider/model/API 密钥的熔断器
+
+    closed：记录最近 BREAKER_WINDOW_SECONDS 秒内的调用结果，样本数达到 BREAKER_MIN_CALLS 且
+    失败率或慢调用率（耗时超过 BREAKER_SLOW_CALL_SECONDS）超限时打开；
+    open：BREAKER_OPEN_SECONDS 内直接拒绝；
+    half_open：冷却结束后放行最多 BREAKER_HALF_OPEN_CALLS 个试探调用，全部成功则关闭，任一失败重新打开。
+    """
+
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+        self.state = CLOSED
+        self.opened_at = None
+        self.opened_count = 0
+        self._samples = deque()  # (时间, 是否失败, 是否慢调用)
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.opened_count += 1
+        elif state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        else:
+            self.opened_at = None
+            self._samples.clear()
+        metrics.CIRCUIT_BREAKER_TRANSITIONS.labels(backend=self.backend, state=state).inc()
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 1
+        return max(1, int(Config.BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at) + 0.999))
+
+    def _cooled_down(self):
+        return time.monotonic() - self.opened_at >= Config.BREAKER_OPEN_SECONDS
+
+    def available(self) -> bool:
+        """不占用试探名额的检查，用于挑选候选后端"""
+        with self._lock:
+            if self.state == OPEN:
+                return self._cooled_down()
+            if self.state == HALF_OPEN:
+                return self._probes < Config.BREAKER_HALF_OPEN_CALLS
+            return True
+
+    def acquire(self):
+        """调用前获取许可；打开状态或试探名额已满时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN and self._cooled_down():
+                self._transition(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probes >= Config.BREAKER_HALF_OPEN_CALLS):
+                metrics.CIRCUIT_BREAKER_REJECTIONS.labels(backend=self.backend).inc()
+                raise CircuitOpenError(f"模型服务 {self.backend} 暂时不可用（熔断中），请稍后重试",
+                                       retry_after=self.retry_after())
+            if self.state == HALF_OPEN:
+                self._probes += 1
+
+    def record(self, latency, ok):
+        """调用结束后记录结果；慢调用与失败同样计入熔断条件"""
+        slow = latency > Config.BREAKER_SLOW_CALL_SECONDS
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if not ok or slow:
+                    self._transition(OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= Config.BREAKER_HALF_OPEN_CALLS:
+                    self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                return
+
+            now = time.monotonic()
+            self._samples.append((now, not ok, slow))
+            self._trim(now)
+            count = len(self._samples)
+            if count < Config.BREAKER_MIN_CALLS:
+                return
+            failures = sum(1 for _, failed, _ in self._samples if failed)
+            slow_calls = sum(1 for _, _, is_slow in self._samples if is_slow)
+            if failures / count >= Config.BREAKER_FAILURE_RATE or slow_calls / count >= Config.BREAKER_SLOW_CALL_RATE:
+                self._transition(OPEN)
+
+    def release(self):
+        """调用未得出结论（例如客户端截止时间先到）时归还试探名额，不计入统计"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def reset(self):
+        with self._lock:
+            self._transition(CLOSED)
+
+    def _trim(self, now):
+        cutoff = now - Config.BREAKER_WINDOW_SECONDS
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def snapshot(self):
+        with self._lock:
+            if self.state == CLOSED:
+                self._trim(time.monotonic())
+            samples = list(self._samples)
+            count = len(samples)
+            return {
+                "name": self.name,
+                "backend": self.backend,
+                "state": self.state,
+                "samples": count,
+                "failure_rate": round(sum(1 for _, failed, _ in samples if failed) / count, 4) if count else 0.0,
+                "slow_call_rate": round(sum(1 for _, _, slow in samples if slow) / count, 4) if count else 0.0,
+                "opened_count": self.opened_count,
+                "retry_after": self.retry_after() if self.state == OPEN else 0
+            }
+
+
+class CircuitBreakerRegistry:
+    """按 (provider, model, 密钥摘要) 维护的进程内熔断器集合"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, model, api_key) -> CircuitBreaker:
+        key = (provider, model, key_fingerprint(api_key))
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(f"{provider}/{model}#{key[2]}", f"{provider}/{model}")
+                    self._breakers[key] = breaker
+        return breaker
+
+    def status(self):
+        return [breaker.snapshot() for breaker in list(self._breakers.values())]
+
+    def reset(self, name: Optional[str] = None) -> int:
+        """手动关闭熔断器：指定 name 时只重置该熔断器，返回重置的数量"""
+        breakers = [b for b in list(self._breakers.values()) if name is None or b.name == name]
+        for breaker in breakers:
+            breaker.reset()
+        return len(breakers)
+
+
+circuit_breakers = CircuitBreakerRegistry()
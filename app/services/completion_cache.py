@@ -0,0 +1,48 @@
+import hashlib
+import json
+from typing import List, Optional
+
+from app.models import Agent
+from app.utils.cache import TTLCache
+from config import Config
+
+completion_cache = TTLCache(maxsize=Config.COMPLETION_CACHE_SIZE, ttl=Config.COMPLETION_CACHE_TTL)
+
+
+class CompletionCache:
+    """模型回复缓存：相同配置 + 相同消息列表直接复用上次结果"""
+
+    @staticmethod
+    def enabled_for(agent: Agent) -> bool:
+        """Agent 显式开关优先；未设置时仅在 temperature 为 0（输出确定）时默认开启"""
+        if agent.cache_enabled is not None:
+            return agent.cache_enabled
+        return agent.temperature == 0
+
+    @staticmethod
+    def make_key(agent: Agent, temperature: float, max_tokens: int, messages: List[dict]) -> str:
+        normalized = [
+            {"role": m["role"].strip().lower(), "content": " ".join(m["content"].split())}
+            for m in messages
+        ]
+        raw = json.dumps({
+            "model": agent.model,
+            "system_prompt": agent.system_prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": normalized
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get(key: Optional[str]) -> Optional[str]:
+        return completion_cache.get(key) if key else None
+
+    @staticmethod
+    def set(key: Optional[str], text: str):
+        if key and text:
+            completion_cache.set(key, text)
+
+    @staticmethod
+    def stats():
+        return completion_cache.stats()
@@ -0,0 +1,102 @@
+import math
+import re
+from typing import List, Optional
+
+from app.models import AgentExecution
+from app.utils.cache import TTLCache
+from config import Config
+
+# 各模型的上下文窗口（token），未列出的模型使用默认值
+MODEL_CONTEXT_LIMITS = {
+    'qwen-turbo': 8000,
+    'qwen-plus': 32000,
+    'qwen-max': 8000,
+    'qwen-1.8b': 8000,
+}
+DEFAULT_CONTEXT_LIMIT = 8000
+# 每条消息的角色/分隔符开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+# execution_id -> 该轮 user+assistant 的 token 数；已完成的执行记录不再变化，可长期缓存
+execution_token_cache = TTLCache(maxsize=Config.CONTEXT_TOKEN_CACHE_SIZE, ttl=3600)
+
+
+class ContextService:
+    """按 token 预算构建多轮对话上下文"""
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """本地近似估算：中日韩字符按 1 token/字，其余按约 4 字符/token"""
+        if not text:
+            return 0
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    @staticmethod
+    def message_tokens(content: str) -> int:
+        return ContextService.estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def execution_tokens(execution: AgentExecution) -> int:
+        """单轮对话（输入+输出）的 token 数，已完成的记录走缓存"""
+        cached = execution_token_cache.get(execution.id)
+        if cached is not None:
+            return cached
+
+        tokens = ContextService.message_tokens(execution.input)
+        if execution.output:
+            tokens += ContextService.message_tokens(execution.output)
+        if execution.status == 'completed':
+            execution_token_cache.set(execution.id, tokens)
+        return tokens
+
+    @staticmethod
+    def history_budget(model: str, max_tokens: int, system_prompt: str, user_input: str,
+                       system_tokens: Optional[int] = None) -> int:
+        """上下文窗口扣除回复预留、系统提示和本轮输入后，可用于历史的 token 数
+
+        :param system_tokens: 预先算好的系统提示 token 数，传入时不再重新估算
+        """
+        limit = MODEL_CONTEXT_LIMITS.get(model, DEFAULT_CONTEXT_LIMIT)
+        if system_tokens is None:
+            system_tokens = ContextService.message_tokens(system_prompt)
+        used = max_tokens + system_tokens + ContextService.message_tokens(user_input)
+        return max(0, limit - used)
+
+    @staticmethod
+    def select_executions(executions: List[AgentExecution], budget: int) -> List[AgentExecution]:
+        """从最新一轮开始向前填充，直到超出预算；返回结果保持从旧到新"""
+        selected = []
+        for execution in reversed(executions):
+            tokens = ContextService.execution_tokens(execution)
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append(execution)
+        selected.reverse()
+        return selected
+
+    @staticmethod
+    def trim_messages(messages: list, budget: int) -> list:
+        """对调用方直接传入的历史消息按同样规则裁剪：以一轮（user 及其后的回复）为单位取舍，不拆开问答
+
+        第一条 user 消息之前的消息缺少对应的提问，不发送给模型。
+        """
+        turns = []
+        for message in messages:
+            if message.role == 'user':
+                turns.append([message])
+            elif turns:
+                turns[-1].append(message)
+
+        selected = []
+        for turn in reversed(turns):
+            tokens = sum(ContextService.message_tokens(message.content) for message in turn)
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append(turn)
+        selected.reverse()
+        return [message for turn in selected for message in turn]
@@ -0,0 +1,181 @@
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import click
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.services.rate_limiter import rate_limiter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """执行队列已满，调用方应稍后重试"""
+
+
+class ExecutionQueue:
+    """进程内异步执行队列：HTTP 请求只负责入队，后台线程池驱动模型调用
+
+    队列只在内存中，不持久：进程重启或发布时队列中的任务随之丢失，对应的执行记录停留在 pending。
+    进程处理首个请求时（或执行 flask recover-executions）会把这些遗留任务重新入队，
+    超过 EXECUTION_QUEUE_RECOVER_MAX_AGE 秒的不再执行，直接标记为 failed；执行到一半中断、停留在 running 的记录也一并标记为 failed。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue: Optional[queue.Queue] = None
+        self._workers = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config.get('EXECUTION_QUEUE_MAXSIZE', 1000))
+        self._workers = []  # 已有的工作线程阻塞在旧队列上，新队列首次入队时重新启动
+        self.recover_max_age = app.config.get('EXECUTION_QUEUE_RECOVER_MAX_AGE', 3600)
+        self._recovered = False
+        app.extensions['execution_queue'] = self
+
+        @app.before_request
+        def _recover_executions():
+            if not self._recovered:
+                self._recover_once()
+
+        @app.cli.command('recover-executions')
+        def recover_executions():
+            """重新入队重启前遗留的 pending 执行记录"""
+            requeued, failed = self.recover()
+            click.echo(f"requeued {requeued}, failed {failed} stale executions")
+
+    def _ensure_workers(self):
+        """首次入队时才启动工作线程，避免在 reloader 父进程或脚本导入时空转"""
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.app.config.get('EXECUTION_QUEUE_WORKERS', 4)):
+                worker = threading.Thread(target=self._worker_loop, name=f'execution-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _recover_once(self):
+        with self._lock:
+            if self._recovered:
+                return
+            self._recovered = True
+        try:
+            requeued, failed = self.recover()
+            if requeued or failed:
+                logger.warning(f"恢复重启前遗留的异步执行：重新入队 {requeued} 条，超时标记失败 {failed} 条")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"恢复遗留的异步执行失败: {str(e)}")
+
+    def recover(self) -> Tuple[int, int]:
+        """处理 pending 状态的执行记录：超过 recover_max_age 的标记为 failed，其余重新入队（队列满时留待下次恢复）
+
+        其他进程队列中的任务也可能被重新入队，由 _run 的原子认领保证每条记录只执行一次。
+        已被认领（running）但进程随后退出的记录不会再有结果：排队最多 recover_max_age 秒、执行不超过截止时间上限，
+        超过两者之和仍为 running 的同样标记为 failed。
+        :return: (重新入队数, 标记失败数)
+        """
+        now = datetime.utcnow()
+        pending = AgentExecution.query.filter(AgentExecution.status == 'pending')
+        failed = pending.filter(
+            AgentExecution.start_time < now - timedelta(seconds=self.recover_max_age)
+        ).update({
+            'status': 'failed',
+            'output': 'Execution was lost before it could run (server restarted)',
+            'end_time': now
+        }, synchronize_session=False)
+        failed += AgentExecution.query.filter(
+            AgentExecution.status == 'running',
+            AgentExecution.start_time < now - timedelta(seconds=self.recover_max_age + Config.AGENT_EXECUTION_TIMEOUT)
+        ).update({
+            'status': 'failed',
+            'output': 'Execution was interrupted (server restarted)',
+            'end_time': now
+        }, synchronize_session=False)
+        db.session.commit()
+
+        capacity = self._queue.maxsize - self.qsize() if self._queue.maxsize > 0 else None
+        rows = pending.with_entities(AgentExecution.id).order_by(AgentExecution.start_time).limit(capacity).all()
+        requeued = 0
+        for (execution_id,) in rows:
+            try:
+                self.submit(execution_id)
+            except QueueFullError:
+                break
+            requeued += 1
+        return requeued, failed
+
+    def submit(self, execution_id: int, slot_key: Optional[str] = None):
+        """将 pending 状态的执行记录加入队列
+
+        :param slot_key: 请求占用的限流在途槽位，入队成功后由队列在任务结束时释放
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((execution_id, slot_key))
+        except queue.Full:
+            raise QueueFullError("执行队列已满，请稍后重试")
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _worker_loop(self):
+        while True:
+            execution_id, slot_key = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self._run(execution_id)
+            except Exception as e:
+                logger.error(f"异步执行 {execution_id} 失败: {str(e)}")
+            finally:
+                if slot_key:
+                    rate_limiter.release(slot_key)
+                self._queue.task_done()
+
+    @staticmethod
+    def _run(execution_id: int):
+        from app.services.agent_config_service import AgentConfigService
+        from app.services.tongyi_service import TongyiService
+
+        execution = AgentExecution.query.get(execution_id)
+        if not execution or execution.status != 'pending':
+            return
+
+        # 按入队时的配置版本执行，期间 Agent 被修改不影响这次执行
+        agent = AgentConfigService.get_version(execution.agent_id, execution.agent_version)
+        if agent is None:
+            # Agent 已被删除，等待后台清理，不再调用模型
+            execution.status = 'failed'
+            execution.output = 'Agent has been deleted'
+            execution.end_time = datetime.utcnow()
+            db.session.commit()
+            return
+
+        # 原子认领：同一任务可能同时在多个进程的队列中（重启恢复），只有把 pending 改为 running 的一方执行
+        claimed = AgentExecution.query.filter_by(id=execution_id, status='pending').update(
+            {'status': 'running'}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+
+        TongyiService.generate_response(
+            agent=agent,
+            user_input=execution.input,
+            execution_id=execution.parent_execution_id,
+            execution=execution
+        )
+
+
+execution_queue = ExecutionQueue()
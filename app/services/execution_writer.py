@@ -0,0 +1,128 @@
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from app.extensions import db
+from app.models import AgentExecution
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionWriter:
+    """执行记录状态/输出的持久化入口。
+
+    默认直接提交；开启 EXECUTION_WRITE_BEHIND 后由后台线程把多个并发执行的更新合并为批量提交。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.write_behind = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.write_behind = app.config.get('EXECUTION_WRITE_BEHIND', False)
+        self.batch_size = app.config.get('EXECUTION_WRITE_BATCH_SIZE', 100)
+        self.flush_interval = app.config.get('EXECUTION_WRITE_FLUSH_INTERVAL', 0.05)
+        app.extensions['execution_writer'] = self
+
+    def save(self, execution: AgentExecution, **fields):
+        """更新执行记录字段并持久化"""
+        if not self.write_behind:
+            for key, value in fields.items():
+                setattr(execution, key, value)
+            db.session.commit()
+            return
+
+        # 先加载全部列再脱离会话：响应仍可读取该对象，而会话不会再自行写回
+        execution_id = execution.id
+        for key, value in fields.items():
+            setattr(execution, key, value)
+        db.session.expunge(execution)
+        if self._stop.is_set():
+            # 后台线程已随进程退出停止，直接写入
+            self._write([dict(id=execution_id, **fields)])
+            return
+        self._ensure_thread()
+        self._queue.put(dict(id=execution_id, **fields))
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='execution-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _drain(self, first=None):
+        """取出一批待写更新，同一执行记录的多次更新合并为最后一次"""
+        updates = {}
+        if first is not None:
+            updates.setdefault(first['id'], {}).update(first)
+        while len(updates) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                updates.setdefault(item['id'], {}).update(item)
+        return list(updates.values())
+
+    def _write(self, mappings):
+        """批量写入，失败时整批重试一次，仍失败则逐条写入，只放弃本身无法写入的记录"""
+        if not mappings:
+            return
+        with self.app.app_context():
+            for attempt in range(2):
+                if self._commit(mappings):
+                    return
+                logger.warning(f"批量写入执行记录失败（{len(mappings)} 条，第 {attempt + 1} 次）")
+            for mapping in mappings:
+                if self._commit([mapping]):
+                    continue
+                # 输出等字段无法写入时至少让记录离开 running 状态（结果已丢失，记为 failed）
+                fallback = dict(id=mapping['id'], status='failed', end_time=mapping.get('end_time') or datetime.utcnow())
+                if not self._commit([fallback]):
+                    logger.error(f"写入执行记录 {mapping['id']} 失败，已放弃: {mapping.get('status')}")
+
+    @staticmethod
+    def _commit(mappings) -> bool:
+        try:
+            db.session.bulk_update_mappings(AgentExecution, mappings)
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"写入执行记录失败: {str(e)}")
+            return False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is not None:
+                # 短暂等待，让并发执行的更新攒成一批；flush 时立即写出
+                self._stop.wait(self.flush_interval)
+            self._write(self._drain(first))
+            if self._stop.is_set() and self._queue.empty():
+                return
+
+    def flush(self, timeout=10):
+        """写出队列中剩余的更新并停止后台线程（进程退出时调用）"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)  # 唤醒阻塞在 get() 上的线程
+            thread.join(timeout)
+        while not self._queue.empty():
+            self._write(self._drain())
+
+
+execution_writer = ExecutionWriter()
@@ -0,0 +1,122 @@
+import logging
+import threading
+from typing import Optional
+
+from flask_login import UserMixin
+
+from app.models import User, UserIdentity
+from app.utils.cache import TTLCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# user_id -> UserIdentity
+identity_cache = TTLCache(maxsize=Config.IDENTITY_CACHE_SIZE, ttl=Config.IDENTITY_CACHE_TTL)
+
+
+class MemoryRevocationList:
+    def __init__(self):
+        self._revoked = set()
+        self._lock = threading.Lock()
+
+    def add(self, user_id):
+        with self._lock:
+            self._revoked.add(user_id)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._revoked.discard(user_id)
+
+    def contains(self, user_id):
+        return user_id in self._revoked
+
+
+class RedisRevocationList:
+    """多进程共享的吊销列表，停用立即在所有 worker 生效"""
+
+    KEY = 'identity:revoked'
+
+    def __init__(self, url):
+        import redis  # 可选依赖
+        self._client = redis.Redis.from_url(url)
+
+    def add(self, user_id):
+        self._client.sadd(self.KEY, user_id)
+
+    def discard(self, user_id):
+        self._client.srem(self.KEY, user_id)
+
+    def contains(self, user_id):
+        return bool(self._client.sismember(self.KEY, user_id))
+
+
+_revocations = None
+_revocations_lock = threading.Lock()
+
+
+def _revocation_list():
+    global _revocations
+    if _revocations is None:
+        with _revocations_lock:
+            if _revocations is None:
+                url = Config.IDENTITY_REVOCATION_URL
+                _revocations = RedisRevocationList(url) if url.startswith('redis') else MemoryRevocationList()
+    return _revocations
+
+
+class LoginIdentity(UserMixin):
+    """flask_login 使用的缓存用户对象"""
+
+    def __init__(self, identity: UserIdentity):
+        self.identity = identity
+        self.id = identity.id
+        self.username = identity.username
+        self.is_admin = identity.is_admin
+
+    @property
+    def is_active(self):
+        return self.identity.is_active
+
+
+class IdentityService:
+    """用户身份快照缓存：已认证的读接口无需查询 user 表"""
+
+    @staticmethod
+    def get(user_id) -> Optional[UserIdentity]:
+        user_id = int(user_id)
+        identity = identity_cache.get(user_id)
+        if identity is not None:
+            return identity
+
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        identity = UserIdentity.from_user(user)
+        identity_cache.set(user_id, identity)
+        return identity
+
+    @staticmethod
+    def invalidate(user_id):
+        identity_cache.pop(int(user_id))
+
+    @staticmethod
+    def revoke(user_id):
+        """停用用户：加入吊销列表并清除缓存，持有的令牌立即失效"""
+        _revocation_list().add(int(user_id))
+        IdentityService.invalidate(user_id)
+
+    @staticmethod
+    def restore(user_id):
+        _revocation_list().discard(int(user_id))
+        IdentityService.invalidate(user_id)
+
+    @staticmethod
+    def is_revoked(user_id) -> bool:
+        """令牌校验时调用：吊销列表命中或快照显示已停用均视为失效"""
+        try:
+            if _revocation_list().contains(int(user_id)):
+                return True
+        except Exception as e:
+            logger.error(f"读取吊销列表失败: {str(e)}")
+        identity = IdentityService.get(user_id)
+        return identity is None or not identity.is_active
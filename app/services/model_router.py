@@ -0,0 +1,634 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+import requests
+from dashscope import Generation
+
+from app.services.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.utils import metrics
+from app.utils.deadline import DeadlineExceeded
+from app.utils.http_client import (async_request_timeout, get_async_model_client, get_model_session,
+                                   model_request_timeout)
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 对冲请求在独立线程中执行，落后的那次调用不占用请求线程
+_hedge_executor = ThreadPoolExecutor(max_workers=Config.ROUTER_HEDGE_WORKERS, thread_name_prefix='model-hedge')
+
+
+class ProviderError(RuntimeError):
+    """上游模型服务返回了错误响应；status_code 为上游 HTTP 状态码（流式事件中的错误没有状态码时为 None）"""
+
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+# 内容审核拦截：即使没有 HTTP 状态码也属于请求本身的问题
+CONTENT_FILTER_CODES = ('DataInspectionFailed', 'data_inspection_failed', 'content_filter')
+
+_TRANSPORT_ERRORS = (TimeoutError, ConnectionError, requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                     requests.exceptions.ChunkedEncodingError, httpx.TransportError)
+
+
+def is_backend_failure(error) -> bool:
+    """只有 5xx、限流（429）、超时和连接错误算作后端故障，计入熔断和健康度并触发切换；
+    其余 4xx（参数错误、密钥无效、内容审核等）换后端也不会成功，直接抛给调用方"""
+    if isinstance(error, ProviderError):
+        if error.code in CONTENT_FILTER_CODES:
+            return False
+        return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, _TRANSPORT_ERRORS)
+
+
+@dataclass
+class ModelOutput:
+    text: Optional[str]
+
+
+@dataclass
+class ModelUsage:
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+@dataclass
+class ModelResponse:
+    """与 dashscope 响应同构的统一结果：调用方只读取 status_code/output.text/usage"""
+    output: ModelOutput
+    usage: Optional[ModelUsage] = None
+    status_code: int = 200
+    code: str = ''
+    message: str = ''
+
+
+@dataclass(frozen=True)
+class Backend:
+    provider: str
+    model: str
+
+    def __str__(self):
+        return f"{self.provider}/{self.model}"
+
+
+class DashScopeProvider:
+    name = 'dashscope'
+
+    def call(self, model, messages, api_key, temperature, max_tokens, stream=False, timeout=None):
+        kwargs = dict(
+            model=model,
+            api_key=api_key,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            session=get_model_session(),
+            request_timeout=timeout or Config.MODEL_HTTP_READ_TIMEOUT
+        )
+        if stream:
+            # incremental_output 让每个分片只携带新增文本，而不是累计全文
+            return self._checked(Generation.call(stream=True, incremental_output=True, **kwargs))
+
+        response = Generation.call(**kwargs)
+        if response is not None and getattr(response, 'status_code', 200) != 200:
+            raise ProviderError(f"AI模型调用失败: {response.code} {response.message}",
+                                status_code=response.status_code, code=response.code)
+        return response
+
+    @staticmethod
+    def _checked(responses):
+        for response in responses:
+            if response.status_code != 200:
+                raise ProviderError(f"AI模型调用失败: {response.code} {response.message}",
+                                    status_code=response.status_code, code=response.code)
+            yield response
+
+
+class OpenAICompatibleProvider:
+    """OpenAI 兼容的 /chat/completions 接口，复用共享的 requests 连接池"""
+    name = 'openai'
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+
+    def call(self, model, messages, api_key, temperature, max_tokens, stream=False, timeout=None):
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        if stream:
+            payload.update(stream=True, stream_options={"include_usage": True})
+
+        connect_timeout, read_timeout = model_request_timeout()
+        if timeout:
+            # timeout 由截止时间剩余部分算出，建立连接同样不能超过
+            connect_timeout = min(connect_timeout, timeout)
+        response = get_model_session().post(
+            f"{(self.base_url or Config.OPENAI_BASE_URL).rstrip('/')}/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=(connect_timeout, timeout or read_timeout),
+            stream=stream
+        )
+        if response.status_code != 200:
+            detail = response.text[:200]
+            response.close()
+            raise ProviderError(f"AI模型调用失败: http_{response.status_code} {detail}",
+                                status_code=response.status_code)
+
+        if stream:
+            return self._iter_events(response)
+        body = response.json()
+        return ModelResponse(
+            output=ModelOutput(text=body['choices'][0]['message']['content']),
+            usage=self._usage(body.get('usage'))
+        )
+
+    @staticmethod
+    def _usage(usage):
+        if not usage:
+            return None
+        return ModelUsage(input_tokens=usage.get('prompt_tokens', 0), output_tokens=usage.get('completion_tokens', 0))
+
+    @staticmethod
+    def _iter_events(response) -> Iterator[ModelResponse]:
+        response.encoding = 'utf-8'
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                event = json.loads(data)
+                choices = event.get('choices') or []
+                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                yield ModelResponse(output=ModelOutput(text=delta), usage=OpenAICompatibleProvider._usage(event.get('usage')))
+
+
+PROVIDERS = {
+    DashScopeProvider.name: DashScopeProvider(),
+    OpenAICompatibleProvider.name: OpenAICompatibleProvider(),
+}
+
+
+async def _apost(url, payload, headers, stream, timeout):
+    """经共享的 httpx.AsyncClient 发出请求；非 200 时读出错误信息并抛出 ProviderError"""
+    client = get_async_model_client()
+    request = client.build_request('POST', url, json=payload, headers=headers, timeout=async_request_timeout(timeout))
+    response = await client.send(request, stream=stream)
+    if response.status_code != 200:
+        detail = (await response.aread()).decode('utf-8', 'replace')[:200]
+        await response.aclose()
+        raise ProviderError(f"AI模型调用失败: http_{response.status_code} {detail}", status_code=response.status_code)
+    return response
+
+
+async def _aiter_sse_data(response) -> AsyncIterator[str]:
+    """逐条产出 SSE 的 data 字段，结束时关闭连接"""
+    try:
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            yield data
+    finally:
+        await response.aclose()
+
+
+class AsyncDashScopeProvider:
+    """DashScope HTTP 接口的协程版本（ASGI 模式），结果与 SDK 响应同构"""
+    name = 'dashscope'
+
+    async def call(self, model, messages, api_key, temperature, max_tokens, stream=False, timeout=None):
+        payload = {
+            "model": model,
+            "input": {"messages": messages},
+            "parameters": {"result_format": "message", "temperature": temperature, "max_tokens": max_tokens}
+        }
+        headers = {"Authorization": f"Bearer {api_key}"}
+        if stream:
+            payload["parameters"]["incremental_output"] = True
+            headers.update({"Accept": "text/event-stream", "X-DashScope-SSE": "enable"})
+
+        response = await _apost(Config.TONGYI_API_URL, payload, headers, stream, timeout)
+        if stream:
+            return self._iter_events(response)
+        return self._parse(response.json())
+
+    @staticmethod
+    def _parse(body) -> ModelResponse:
+        if body.get('code') and not body.get('output'):
+            raise ProviderError(f"AI模型调用失败: {body.get('code')} {body.get('message')}", code=body.get('code'))
+        choices = (body.get('output') or {}).get('choices') or [{}]
+        usage = body.get('usage')
+        return ModelResponse(
+            output=ModelOutput(text=(choices[0].get('message') or {}).get('content')),
+            usage=ModelUsage(input_tokens=usage.get('input_tokens', 0),
+                             output_tokens=usage.get('output_tokens', 0)) if usage else None
+        )
+
+    @staticmethod
+    async def _iter_events(response) -> AsyncIterator[ModelResponse]:
+        async for data in _aiter_sse_data(response):
+            yield AsyncDashScopeProvider._parse(json.loads(data))
+
+
+class AsyncOpenAICompatibleProvider(OpenAICompatibleProvider):
+    """OpenAI 兼容接口的协程版本（ASGI 模式）"""
+
+    async def call(self, model, messages, api_key, temperature, max_tokens, stream=False, timeout=None):
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        if stream:
+            payload.update(stream=True, stream_options={"include_usage": True})
+
+        response = await _apost(f"{(self.base_url or Config.OPENAI_BASE_URL).rstrip('/')}/chat/completions",
+                                payload, {"Authorization": f"Bearer {api_key}"}, stream, timeout)
+        if stream:
+            return self._aiter_events(response)
+        body = response.json()
+        return ModelResponse(
+            output=ModelOutput(text=body['choices'][0]['message']['content']),
+            usage=self._usage(body.get('usage'))
+        )
+
+    @staticmethod
+    async def _aiter_events(response) -> AsyncIterator[ModelResponse]:
+        async for data in _aiter_sse_data(response):
+            event = json.loads(data)
+            choices = event.get('choices') or []
+            delta = (choices[0].get('delta') or {}).get('content') if choices else None
+            yield ModelResponse(output=ModelOutput(text=delta), usage=OpenAICompatibleProvider._usage(event.get('usage')))
+
+
+ASYNC_PROVIDERS = {
+    AsyncDashScopeProvider.name: AsyncDashScopeProvider(),
+    AsyncOpenAICompatibleProvider.name: AsyncOpenAICompatibleProvider(),
+}
+
+
+class BackendStats:
+    """单个 provider/model 最近 ROUTER_WINDOW_SECONDS 秒内的延迟和错误样本"""
+
+    def __init__(self):
+        self._samples = deque(maxlen=Config.ROUTER_WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+
+    def snapshot(self):
+        """返回 (样本数, 错误率, p95 延迟)"""
+        cutoff = time.monotonic() - Config.ROUTER_WINDOW_SECONDS
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+        if not samples:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, _, ok in samples if not ok)
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        return len(samples), errors / len(samples), p95
+
+
+class ModelRouter:
+    """按 Agent 模型选择后端：优先使用健康的主后端，主后端超出延迟 SLO 或出错时自动切换到备用后端
+
+    健康度基于滑动窗口内的错误率和 p95 延迟（流式调用按首个分片耗时计）；
+    窗口内样本过期后不健康的后端自然恢复为可用，无需单独探活。
+    每个 provider/model/API 密钥另有熔断器（见 circuit_breaker），熔断打开的后端直接跳过。
+    """
+
+    def __init__(self):
+        self._stats: Dict[Backend, BackendStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def routes_for(model) -> List[Backend]:
+        """MODEL_ROUTES 中配置的后端顺序；未配置的模型按名称推断唯一的后端"""
+        routes = Config.MODEL_ROUTES.get(model)
+        if routes:
+            return [Backend(provider, backend_model) for provider, backend_model in routes]
+        provider = 'openai' if model.startswith(('gpt-', 'o1', 'o3', 'o4')) else 'dashscope'
+        return [Backend(provider, model)]
+
+    def stats(self, backend) -> BackendStats:
+        stats = self._stats.get(backend)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(backend, BackendStats())
+        return stats
+
+    def record(self, backend, latency, ok):
+        self.stats(backend).record(latency, ok)
+
+    def health(self, backend):
+        count, error_rate, p95 = self.stats(backend).snapshot()
+        healthy = count < Config.ROUTER_MIN_SAMPLES or (
+            error_rate <= Config.ROUTER_MAX_ERROR_RATE and p95 <= Config.ROUTER_LATENCY_SLO
+        )
+        return healthy, error_rate, p95
+
+    def candidates(self, model, api_keys) -> List[Backend]:
+        """有密钥的后端，健康的按配置顺序在前，不健康的按错误率、延迟排在后面"""
+        ranked = []
+        for index, backend in enumerate(self.routes_for(model)):
+            if backend.provider not in PROVIDERS or not api_keys.get(backend.provider):
+                continue
+            healthy, error_rate, p95 = self.health(backend)
+            ranked.append(((0, index, 0.0) if healthy else (1, error_rate, p95), backend))
+        ranked.sort(key=lambda item: item[0])
+        return [backend for _, backend in ranked]
+
+    def status(self):
+        """各后端当前的健康度，供监控接口使用"""
+        result = []
+        for backend in list(self._stats):
+            count, error_rate, p95 = self.stats(backend).snapshot()
+            result.append({
+                "backend": str(backend),
+                "samples": count,
+                "error_rate": round(error_rate, 4),
+                "p95_latency": round(p95, 4),
+                "healthy": self.health(backend)[0]
+            })
+        return result
+
+    @staticmethod
+    def breaker(backend, api_keys):
+        return circuit_breakers.get(backend.provider, backend.model, api_keys[backend.provider])
+
+    def available(self, model, api_keys) -> List[Backend]:
+        """熔断器未打开的候选后端；全部熔断时抛出 CircuitOpenError，调用方无需等待上游即可失败"""
+        candidates = self.candidates(model, api_keys)
+        if not candidates:
+            raise RuntimeError(f"模型 {model} 没有可用的后端，请检查API密钥配置")
+        breakers = [(backend, self.breaker(backend, api_keys)) for backend in candidates]
+        available = [backend for backend, breaker in breakers if breaker.available()]
+        if not available:
+            raise CircuitOpenError(f"模型 {model} 的服务暂时不可用（熔断中），请稍后重试",
+                                   retry_after=min(breaker.retry_after() for _, breaker in breakers))
+        return available
+
+    def call(self, model, messages, api_keys, temperature, max_tokens, stream=False, deadline=None, hedge=False):
+        """依次尝试候选后端直到成功；流式调用只在首个分片前切换
+
+        :param deadline: 截止时间，用于限制每次网络调用的超时，到期后不再切换后端而是抛出 DeadlineExceeded
+        :param hedge: 非流式调用在等待超过该后端 p95 延迟后再发一次相同请求，取先成功的结果
+        """
+        candidates = self.available(model, api_keys)
+
+        last_error = None
+        for attempt, backend in enumerate(candidates):
+            if deadline is not None:
+                deadline.check()
+            if attempt:
+                metrics.MODEL_FAILOVERS.labels(model=metrics.model_label(model), backend=str(backend)).inc()
+                logger.warning(f"模型 {model} 切换到备用后端 {backend}: {last_error}")
+
+            breaker = self.breaker(backend, api_keys)
+            invoke = partial(self._invoke, backend, breaker, messages, api_keys[backend.provider],
+                             temperature, max_tokens, stream, deadline)
+            try:
+                if stream:
+                    return self._primed(backend, breaker, invoke, deadline)
+                if hedge:
+                    return self._hedged(model, backend, invoke, deadline)
+                return invoke()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）") from e
+                if not isinstance(e, CircuitOpenError) and not is_backend_failure(e):
+                    raise  # 请求本身的问题，换后端也不会成功
+                last_error = e
+        raise last_error
+
+    def _invoke(self, backend, breaker, messages, api_key, temperature, max_tokens, stream, deadline):
+        """单次调用后端并记录样本（流式调用的样本由 _primed 按首个分片记录）"""
+        breaker.acquire()
+        timeout = deadline.timeout(Config.MODEL_HTTP_READ_TIMEOUT) if deadline is not None else None
+        start = time.perf_counter()
+        try:
+            response = PROVIDERS[backend.provider].call(
+                backend.model, messages, api_key, temperature, max_tokens, stream=stream, timeout=timeout
+            )
+        except Exception as e:
+            self._record_failure(backend, breaker, time.perf_counter() - start, deadline, e)
+            raise
+        if not stream:
+            latency = time.perf_counter() - start
+            self.record(backend, latency, ok=True)
+            breaker.record(latency, ok=True)
+        return response
+
+    def _record_failure(self, backend, breaker, latency, deadline, error):
+        """请求本身的错误（4xx、内容审核）和客户端截止时间先到导致的失败不代表后端故障，只归还熔断器的试探名额"""
+        if not is_backend_failure(error):
+            breaker.release()
+            return
+        self.record(backend, latency, ok=False)
+        if deadline is not None and deadline.expired():
+            breaker.release()
+        else:
+            breaker.record(latency, ok=False)
+
+    def _hedged(self, model, backend, invoke, deadline):
+        """先发一次；超过该后端 p95 仍未返回时再发一次相同请求，先成功者胜出，落后的调用在后台自然结束"""
+        count, _, p95 = self.stats(backend).snapshot()
+        if count < Config.ROUTER_MIN_SAMPLES:
+            return invoke()
+
+        delay = max(p95, Config.ROUTER_HEDGE_MIN_DELAY)
+        if deadline is not None:
+            delay = min(delay, deadline.remaining())
+        first = _hedge_executor.submit(invoke)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.MODEL_HEDGES.labels(model=metrics.model_label(model), outcome='fired').inc()
+        second = _hedge_executor.submit(invoke)
+        pending = {first, second}
+        error = None
+        while pending:
+            timeout = deadline.remaining() if deadline is not None else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）")
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        metrics.MODEL_HEDGES.labels(model=metrics.model_label(model), outcome='won').inc()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _primed(self, backend, breaker, invoke, deadline):
+        """先取出首个分片（失败时由 call 切换后端），再返回完整的分片迭代器"""
+        start = time.perf_counter()
+        responses = iter(invoke())
+        try:
+            first = next(responses, None)
+        except Exception as e:
+            self._record_failure(backend, breaker, time.perf_counter() - start, deadline, e)
+            raise
+        latency = time.perf_counter() - start
+        self.record(backend, latency, ok=True)
+        breaker.record(latency, ok=True)
+
+        def chained():
+            try:
+                if first is not None:
+                    yield first
+                yield from responses
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                if is_backend_failure(e):
+                    self.record(backend, time.perf_counter() - start, ok=False)
+                raise
+            finally:
+                close = getattr(responses, 'close', None)
+                if close is not None:
+                    close()
+
+        return chained()
+
+    async def acall(self, model, messages, api_keys, temperature, max_tokens, stream=False, deadline=None,
+                    hedge=False):
+        """call 的协程版本（ASGI 模式）：经 httpx 调用后端，健康度统计和熔断器与同步调用共享；
+        流式调用返回异步分片迭代器"""
+        candidates = self.available(model, api_keys)
+
+        last_error = None
+        for attempt, backend in enumerate(candidates):
+            if deadline is not None:
+                deadline.check()
+            if attempt:
+                metrics.MODEL_FAILOVERS.labels(model=metrics.model_label(model), backend=str(backend)).inc()
+                logger.warning(f"模型 {model} 切换到备用后端 {backend}: {last_error}")
+
+            breaker = self.breaker(backend, api_keys)
+            invoke = partial(self._ainvoke, backend, breaker, messages, api_keys[backend.provider],
+                             temperature, max_tokens, stream, deadline)
+            try:
+                if stream:
+                    return await self._aprimed(backend, breaker, invoke, deadline)
+                if hedge:
+                    return await self._ahedged(model, backend, invoke, deadline)
+                return await invoke()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）") from e
+                if not isinstance(e, CircuitOpenError) and not is_backend_failure(e):
+                    raise  # 请求本身的问题，换后端也不会成功
+                last_error = e
+        raise last_error
+
+    @staticmethod
+    async def _within(awaitable, deadline):
+        """等待不超过截止时间的剩余时间，到期时取消等待并抛出 TimeoutError"""
+        if deadline is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+
+    async def _ainvoke(self, backend, breaker, messages, api_key, temperature, max_tokens, stream, deadline):
+        breaker.acquire()
+        timeout = deadline.timeout(Config.MODEL_HTTP_READ_TIMEOUT) if deadline is not None else None
+        start = time.perf_counter()
+        try:
+            response = await self._within(ASYNC_PROVIDERS[backend.provider].call(
+                backend.model, messages, api_key, temperature, max_tokens, stream=stream, timeout=timeout
+            ), deadline)
+        except Exception as e:
+            self._record_failure(backend, breaker, time.perf_counter() - start, deadline, e)
+            raise
+        if not stream:
+            latency = time.perf_counter() - start
+            self.record(backend, latency, ok=True)
+            breaker.record(latency, ok=True)
+        return response
+
+    async def _ahedged(self, model, backend, invoke, deadline):
+        """与 _hedged 相同的策略；先返回的一方胜出后，落后的请求直接取消"""
+        count, _, p95 = self.stats(backend).snapshot()
+        if count < Config.ROUTER_MIN_SAMPLES:
+            return await invoke()
+
+        delay = max(p95, Config.ROUTER_HEDGE_MIN_DELAY)
+        if deadline is not None:
+            delay = min(delay, deadline.remaining())
+        first = asyncio.ensure_future(invoke())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.MODEL_HEDGES.labels(model=metrics.model_label(model), outcome='fired').inc()
+        second = asyncio.ensure_future(invoke())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                timeout = deadline.remaining() if deadline is not None else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）")
+                for future in done:
+                    if future.exception() is None:
+                        if future is second:
+                            metrics.MODEL_HEDGES.labels(model=metrics.model_label(model), outcome='won').inc()
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _aprimed(self, backend, breaker, invoke, deadline):
+        """先取出首个分片（失败时由 acall 切换后端），再返回完整的异步分片迭代器"""
+        start = time.perf_counter()
+        responses = await invoke()
+        try:
+            first = await self._within(anext(responses, None), deadline)
+        except Exception as e:
+            self._record_failure(backend, breaker, time.perf_counter() - start, deadline, e)
+            await responses.aclose()
+            raise
+        latency = time.perf_counter() - start
+        self.record(backend, latency, ok=True)
+        breaker.record(latency, ok=True)
+
+        async def chained():
+            try:
+                if first is not None:
+                    yield first
+                async for response in responses:
+                    yield response
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                if is_backend_failure(e):
+                    self.record(backend, time.perf_counter() - start, ok=False)
+                raise
+            finally:
+                await responses.aclose()
+
+        return chained()
+
+
+model_router = ModelRouter()
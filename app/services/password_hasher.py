@@ -0,0 +1,66 @@
+"""密码哈希：bcrypt 计算放到独立进程池，避免登录高峰占满请求线程。
+
+本模块不导入应用代码，进程池子进程只需加载 bcrypt。
+"""
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from config import Config
+
+_BCRYPT_COST_PATTERN = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+_executor = None
+_executor_lock = threading.Lock()
+# 限制排队中的哈希任务数，队列满时快速失败而不是无限堆积
+_slots = threading.BoundedSemaphore(Config.PASSWORD_HASH_QUEUE_SIZE)
+
+
+class PasswordHasherBusy(RuntimeError):
+    """哈希队列已满"""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+def _run(func, *args):
+    if not Config.PASSWORD_HASH_USE_PROCESS_POOL:
+        return func(*args)
+    if not _slots.acquire(timeout=Config.PASSWORD_HASH_TIMEOUT):
+        raise PasswordHasherBusy("密码校验繁忙，请稍后重试")
+    try:
+        return _get_executor().submit(func, *args).result(timeout=Config.PASSWORD_HASH_TIMEOUT)
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _run(_hash, password, Config.BCRYPT_LOG_ROUNDS)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    if not password_hash:
+        return False
+    return _run(_check, password, password_hash)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """已存哈希的 cost 与当前配置不一致时需要重新哈希"""
+    match = _BCRYPT_COST_PATTERN.match(password_hash or '')
+    return not match or int(match.group(1)) != Config.BCRYPT_LOG_ROUNDS
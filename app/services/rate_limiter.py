@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from typing import Tuple
+
+from app.utils.cache import TTLCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶：容量 capacity，每秒补充 rate；force=True 时允许透支（事后按实际用量扣减）
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local force = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+local wait = 0
+if force == 1 or (tokens >= cost and tokens > 0) then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (math.max(cost, 1) - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return {allowed, tostring(wait)}
+"""
+
+
+class MemoryBackend:
+    """进程内存储，仅对单进程生效
+
+    令牌桶在补满所需的时间后过期（与满桶等价，淘汰不丢失状态），总数按 LRU 限制在 RATE_LIMIT_MEMORY_MAX_KEYS 以内。
+    """
+
+    def __init__(self):
+        self._buckets = TTLCache(maxsize=Config.RATE_LIMIT_MEMORY_MAX_KEYS)
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost, force=False) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            if force or (tokens >= cost and tokens > 0):
+                tokens -= cost
+                allowed, wait = True, 0.0
+            else:
+                allowed, wait = False, (max(cost, 1) - tokens) / rate
+            self._buckets.set(key, (tokens, now), ttl=max(0.0, capacity - tokens) / rate)
+            return allowed, wait
+
+    def acquire_slot(self, key, limit) -> bool:
+        with self._lock:
+            count = self._slots.get(key, 0)
+            if count >= limit:
+                return False
+            self._slots[key] = count + 1
+            return True
+
+    def release_slot(self, key):
+        with self._lock:
+            count = self._slots.get(key, 0) - 1
+            if count > 0:
+                self._slots[key] = count
+            else:
+                self._slots.pop(key, None)
+
+
+class RedisBackend:
+    """Redis 共享存储，多个 worker 进程共享同一组限额"""
+
+    def __init__(self, url):
+        import redis  # 可选依赖，仅在配置 redis:// 时需要
+        self._client = redis.Redis.from_url(url)
+        self._bucket_script = self._client.register_script(_TOKEN_BUCKET_LUA)
+
+    def take(self, key, rate, capacity, cost, force=False) -> Tuple[bool, float]:
+        allowed, wait = self._bucket_script(keys=[key], args=[rate, capacity, cost, time.time(), int(force)])
+        return bool(int(allowed)), float(wait)
+
+    def acquire_slot(self, key, limit) -> bool:
+        pipe = self._client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, Config.AGENT_EXECUTION_TIMEOUT * 10)  # 进程崩溃未释放时兜底过期
+        count, _ = pipe.execute()
+        if count > limit:
+            self._client.decr(key)
+            return False
+        return True
+
+    def release_slot(self, key):
+        self._client.decr(key)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class RateLimiter:
+    """按用户等级做请求数/模型token数令牌桶限流和在途执行数限制"""
+
+    def __init__(self):
+        self._backend = None
+        self._backend_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    url = Config.RATE_LIMIT_STORAGE_URL
+                    self._backend = RedisBackend(url) if url.startswith('redis') else MemoryBackend()
+        return self._backend
+
+    def tier_for(self, user_id) -> str:
+        if user_id is None:
+            return 'anonymous'
+        from app.services.identity_service import IdentityService
+        identity = IdentityService.get(user_id)
+        if identity is None:
+            return 'anonymous'
+        return 'admin' if identity.is_admin else identity.tier
+
+    @staticmethod
+    def limits_for(tier) -> dict:
+        tiers = Config.RATE_LIMIT_TIERS
+        return tiers.get(tier) or tiers['free']
+
+    def admit(self, subject, tier):
+        """准入检查：请求数桶扣 1，token 桶未透支，且在途执行数未满；返回需要释放的槽位 key"""
+        limits = self.limits_for(tier)
+        backend = self.backend
+
+        rpm = limits['requests_per_minute']
+        allowed, wait = backend.take(f"rl:req:{subject}", rpm / 60.0, rpm, 1)
+        if not allowed:
+            raise RateLimitExceeded("请求过于频繁，请稍后重试", wait)
+
+        tpm = limits['tokens_per_minute']
+        allowed, wait = backend.take(f"rl:tok:{subject}", tpm / 60.0, tpm, 0)
+        if not allowed:
+            raise RateLimitExceeded("模型 token 用量超出限额，请稍后重试", wait)
+
+        slot_key = f"rl:inflight:{subject}"
+        if not backend.acquire_slot(slot_key, limits['max_in_flight']):
+            raise RateLimitExceeded("进行中的执行数已达上限", 1)
+        return slot_key
+
+    def release(self, slot_key):
+        try:
+            self.backend.release_slot(slot_key)
+        except Exception as e:
+            logger.error(f"释放限流槽位失败: {str(e)}")
+
+    def reserve_tokens(self, user_id, tokens):
+        """预扣一批调用的预估 token（批量执行）：超过等级的每分钟额度时抛出 ValueError，当前余量不足时抛出 RateLimitExceeded"""
+        if not Config.RATE_LIMIT_ENABLED or not tokens:
+            return
+        tpm = self.limits_for(self.tier_for(user_id))['tokens_per_minute']
+        if tokens > tpm:
+            raise ValueError(f"预估 token 用量 {tokens} 超过每分钟限额 {tpm}，请拆分批量任务")
+        allowed, wait = self.backend.take(f"rl:tok:user:{user_id}", tpm / 60.0, tpm, tokens)
+        if not allowed:
+            raise RateLimitExceeded("模型 token 用量超出限额，请稍后重试", wait)
+
+    def refund_tokens(self, user_id, tokens):
+        """退回预扣的 token（实际用量另由 record_tokens 扣减）"""
+        self.record_tokens(user_id, -tokens)
+
+    def record_tokens(self, user_id, tokens):
+        """按实际用量扣减 token 桶（允许透支，透支期间新请求会被拒绝）"""
+        if not Config.RATE_LIMIT_ENABLED or not tokens:
+            return
+        try:
+            limits = self.limits_for(self.tier_for(user_id))
+            tpm = limits['tokens_per_minute']
+            self.backend.take(f"rl:tok:user:{user_id}", tpm / 60.0, tpm, tokens, force=True)
+        except Exception as e:
+            logger.error(f"记录 token 用量失败: {str(e)}")
+
+
+rate_limiter = RateLimiter()
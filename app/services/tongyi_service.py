@@ -1,10 +1,24 @@
-import dashscope
-from dashscope import Generation
+import time
+
 from datetime import datetime
 from app.extensions import db
-from app.models import AgentExecution, Agent, Api
+from app.models import AgentExecution, Agent
+from app.services.api_service import ApiService
+from app.services.context_service import ContextService
+from app.services.completion_cache import CompletionCache
+from app.services.rate_limiter import rate_limiter
+from app.services.execution_writer import execution_writer
+from app.services.archive_service import ArchiveService
+from app.services.model_router import model_router
+from app.utils.deadline import Deadline, DeadlineExceeded, iter_within
+from app.utils import metrics
+from config import Config
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 1000
+
 
 @dataclass
 class Message:
@@ -13,27 +27,60 @@ class Message:
     content: str
 
 
+@dataclass(frozen=True)
+class CompiledAgent:
+    """Agent 某个配置版本的编译结果，与 Agent 行同样可传给 TongyiService
+
+    生成参数已裁剪、系统消息及其 token 数已预先计算；只读，可在线程间共享。
+    """
+    id: int
+    user_id: int
+    version: int
+    name: str
+    description: Optional[str]
+    model: str
+    system_prompt: str
+    temperature: Optional[float]
+    max_tokens: Optional[int]
+    cache_enabled: Optional[bool]
+    hedge_enabled: bool
+    generation_params: Tuple[float, int]
+    system_message: Message
+    system_tokens: int
+
+    @classmethod
+    def compile(cls, agent_id: int, user_id: int, version: int, config: Dict[str, Any]) -> 'CompiledAgent':
+        """config 为 AgentVersion.config_snapshot 格式的配置"""
+        system_prompt = config['system_prompt']
+        return cls(
+            id=agent_id,
+            user_id=user_id,
+            version=version,
+            name=config.get('name'),
+            description=config.get('description'),
+            model=config.get('model'),
+            system_prompt=system_prompt,
+            temperature=config.get('temperature'),
+            max_tokens=config.get('max_tokens'),
+            cache_enabled=config.get('cache_enabled'),
+            hedge_enabled=bool(config.get('hedge_enabled')),
+            generation_params=TongyiService.clamp_generation_params(config.get('temperature'), config.get('max_tokens')),
+            system_message=Message(role="system", content=system_prompt),
+            system_tokens=ContextService.message_tokens(system_prompt)
+        )
+
+
 class TongyiService:
     @staticmethod
-    def initialize_with_user_id(user_id: int, base_url=None):
-        """通过用户ID从数据库获取通义API密钥并初始化"""
+    def resolve_api_keys(user_id: int) -> Dict[str, str]:
+        """获取用户各模型服务的密钥 {provider: key}（走进程内缓存），按调用传递而不写入 SDK 全局变量"""
         try:
-            # 查询用户的API记录
-            api_record = Api.query.filter_by(user_id=user_id).first()
-            if not api_record:
-                raise ValueError(f"用户ID {user_id} 未找到API记录")
-
-            tongyi_api_key = api_record.tongyi_api_key
-            if not tongyi_api_key:
-                raise ValueError(f"用户ID {user_id} 的通义API密钥为空")
-
-            # 初始化通义API配置
-            dashscope.api_key = tongyi_api_key
-            if base_url:
-                dashscope.base_url = base_url
-            return True
+            api_keys = ApiService.get_provider_keys(user_id)
         except Exception as e:
             raise RuntimeError(f"API初始化失败: {str(e)}") from e
+        if not api_keys:
+            raise RuntimeError(f"API初始化失败: 用户ID {user_id} 未配置任何API密钥")
+        return api_keys
 
     @staticmethod
     def generate_response(
@@ -41,44 +88,91 @@ class TongyiService:
             user_input: str,
             execution_id: Optional[int] = None,
             history_messages: Optional[List[Message]] = None,
-            max_history_turns: int = 3
+            max_history_turns: int = Config.CONTEXT_MAX_HISTORY_TURNS,
+            execution: Optional[AgentExecution] = None,
+            deadline: Optional[Deadline] = None
     ):
-        """增强版多轮对话支持（类型安全版本）"""
+        """增强版多轮对话支持（类型安全版本）
+
+        每轮对话只对应一条执行记录：先插入 running 状态，模型返回后再更新一次。
+        传入 execution 时复用该执行记录（例如异步队列预先创建的记录），否则新建一条。
+        超过 deadline（默认 AGENT_EXECUTION_TIMEOUT）时执行记录标记为 timeout 并抛出 DeadlineExceeded。
+        :return: (ai_response, execution)
+        """
         messages = []
-        execution = None
+        deadline = deadline or Deadline.for_request()
         try:
-            TongyiService.initialize_with_user_id(agent.user_id)
+            api_keys = TongyiService.resolve_api_keys(agent.user_id)
             # 初始化消息列表（系统提示）
             messages = TongyiService.generate_context_messages(agent, user_input, execution_id, history_messages, max_history_turns)
 
-            # 创建执行记录
-            execution = TongyiService.create_execution_record(agent, user_input, execution_id)
-            db.session.add(execution)
-            db.session.flush()
+            # 创建执行记录（提交后再调用模型，避免事务跨越整个上游调用）
+            if execution is None:
+                execution = TongyiService.create_execution_record(agent, user_input, execution_id)
+                execution.status = 'running'
+                db.session.add(execution)
+                db.session.commit()
 
-            # 调用大模型接口
+            # 调用大模型接口（命中回复缓存时跳过）
             dashscope_messages = TongyiService.convert_messages_to_dashscope_format(messages)
-            response = TongyiService.call_model_api(agent, dashscope_messages)
-
-            if not response or not hasattr(response, 'output') or not hasattr(response.output, 'text'):
-                raise ValueError("AI模型返回结果为空，请检查输入内容或API密钥")
-
-            ai_response = response.output.text
+            ai_response, cached = TongyiService.complete(agent, dashscope_messages, api_keys, deadline)
 
             # 更新执行记录
-            TongyiService.update_execution_record(execution, ai_response)
-
-            db.session.commit()
-            return ai_response
-
+            TongyiService.update_execution_record(execution, ai_response, cached=cached)
+            return ai_response, execution
 
         except Exception as e:
             db.session.rollback()
             if execution is not None:  # 先判断是否已创建执行记录
-                execution.status = 'failed'
-                execution.output = str(e)
-                db.session.commit()
+                execution_writer.save(execution, status=TongyiService.failure_status(e, deadline), output=str(e),
+                                      end_time=datetime.utcnow())
             raise
+
+    @staticmethod
+    def failure_status(error: Exception, deadline: Optional[Deadline] = None) -> str:
+        """超过截止时间的失败记为 timeout，其余记为 failed"""
+        if isinstance(error, DeadlineExceeded) or (deadline is not None and deadline.expired()):
+            return 'timeout'
+        return 'failed'
+
+    @staticmethod
+    def complete(agent: Agent, dashscope_messages: List[dict], api_keys: Dict[str, str],
+                 deadline: Optional[Deadline] = None) -> Tuple[str, bool]:
+        """不涉及数据库的单次补全，返回 (回复文本, 是否命中缓存)；可在工作线程中调用"""
+        deadline = deadline or Deadline.for_request()
+        cache_key = TongyiService._completion_cache_key(agent, dashscope_messages)
+        ai_response = CompletionCache.get(cache_key)
+        if ai_response is not None:
+            return ai_response, True
+
+        with metrics.EXECUTIONS_IN_FLIGHT.labels(mode='blocking').track_inprogress():
+            try:
+                response = TongyiService.call_model_api(agent, dashscope_messages, api_keys=api_keys,
+                                                        deadline=deadline)
+                if not response or not hasattr(response, 'output') or not hasattr(response.output, 'text'):
+                    raise ValueError("AI模型返回结果为空，请检查输入内容或API密钥")
+            except Exception as e:
+                metrics.record_upstream_error(agent.model, e)
+                raise
+
+        ai_response = response.output.text
+        CompletionCache.set(cache_key, ai_response)
+        TongyiService._record_usage(agent, getattr(response, 'usage', None), dashscope_messages, ai_response)
+        return ai_response, False
+
+    @staticmethod
+    def _record_usage(agent: Agent, usage, dashscope_messages: List[dict], ai_response: str):
+        """按上游返回的用量扣减用户 token 限额，缺失时用本地估算"""
+        prompt_tokens = completion_tokens = 0
+        if usage is not None:
+            prompt_tokens = getattr(usage, 'input_tokens', 0) or 0
+            completion_tokens = getattr(usage, 'output_tokens', 0) or 0
+        if not prompt_tokens and not completion_tokens:
+            prompt_tokens = sum(ContextService.message_tokens(m["content"]) for m in dashscope_messages)
+            completion_tokens = ContextService.estimate_tokens(ai_response)
+        metrics.record_tokens(agent.model, prompt_tokens, completion_tokens)
+        rate_limiter.record_tokens(agent.user_id, prompt_tokens + completion_tokens)
+
     @staticmethod
     def generate_context_messages(
             agent: Agent,
@@ -87,12 +181,21 @@ class TongyiService:
             history_messages: Optional[List[Message]],
             max_history_turns: int
     ) -> List[Message]:
-        messages = [Message(role="system", content=agent.system_prompt)]
+        """系统提示 + 预算内的历史 + 本轮输入；历史从最新一轮向前填充，不超过模型上下文窗口"""
+        _, max_tokens = TongyiService.resolve_generation_params(agent)
+        if isinstance(agent, CompiledAgent):
+            messages = [agent.system_message]
+            budget = ContextService.history_budget(agent.model, max_tokens, agent.system_prompt, user_input,
+                                                   system_tokens=agent.system_tokens)
+        else:
+            messages = [Message(role="system", content=agent.system_prompt)]
+            budget = ContextService.history_budget(agent.model, max_tokens, agent.system_prompt, user_input)
 
         if history_messages:
-            messages.extend(history_messages)
+            messages.extend(ContextService.trim_messages(history_messages, budget))
         elif execution_id:
-            history = TongyiService._get_conversation_history(execution_id, max_turns=max_history_turns)
+            history = TongyiService._get_conversation_history(execution_id, max_turns=max_history_turns,
+                                                              token_budget=budget)
             messages.extend(history)
 
         messages.append(Message(role="user", content=user_input))
@@ -103,43 +206,158 @@ class TongyiService:
             agent_id=agent.id,
             user_id=agent.user_id,
             input=user_input,
-            status='processing',
-            parent_execution_id=execution_id
+            status='pending',
+            parent_execution_id=execution_id,
+            agent_version=agent.version
         )
     @staticmethod
     def convert_messages_to_dashscope_format(messages: List[Message]) -> List[dict]:
         return [{"role": msg.role, "content": msg.content} for msg in messages]
     @staticmethod
-    def call_model_api(agent: Agent, dashscope_messages: List[dict]):
-        temperature = max(0.0, min(1.0, agent.temperature)) if agent.temperature is not None else 0.7
-        max_tokens = agent.max_tokens if agent.max_tokens and agent.max_tokens > 0 else DEFAULT_MAX_TOKENS
+    def stream_response(
+            agent: Agent,
+            user_input: str,
+            execution_id: Optional[int] = None,
+            history_messages: Optional[List[Message]] = None,
+            max_history_turns: int = Config.CONTEXT_MAX_HISTORY_TURNS,
+            deadline: Optional[Deadline] = None
+    ) -> Tuple[AgentExecution, Iterator[str]]:
+        """流式多轮对话：先落库执行记录，再返回增量文本迭代器；超过 deadline 时中断上游并标记为 timeout"""
+        deadline = deadline or Deadline.for_request()
+        api_keys = TongyiService.resolve_api_keys(agent.user_id)
+        # 响应头发出后无法再改状态码：后端全部熔断时在建立流之前直接失败
+        model_router.available(agent.model, api_keys)
+        messages = TongyiService.generate_context_messages(agent, user_input, execution_id, history_messages, max_history_turns)
+
+        # 先提交执行记录，客户端在首个事件中即可拿到 execution_id
+        execution = TongyiService.create_execution_record(agent, user_input, execution_id)
+        execution.status = 'running'
+        db.session.add(execution)
+        db.session.commit()
+
+        dashscope_messages = TongyiService.convert_messages_to_dashscope_format(messages)
+        return execution, TongyiService._iter_stream(agent, execution, dashscope_messages, api_keys, deadline)
 
-        return Generation.call(
-            model=agent.model,
-            messages=dashscope_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
     @staticmethod
-    def update_execution_record(execution: AgentExecution, ai_response: str):
-        execution.output = ai_response
-        execution.status = 'completed'
-        execution.end_time = datetime.utcnow()
+    def _iter_stream(agent: Agent, execution: AgentExecution, dashscope_messages: List[dict],
+                     api_keys: Dict[str, str], deadline: Deadline) -> Iterator[str]:
+        """逐段产出模型增量输出，结束时把完整文本写回执行记录；提前关闭时执行记录同样会结束
+        （超过截止时间为 timeout，否则为 cancelled）"""
+        parts = []
+        usage = None
+        cached_response = None
+        try:
+            cache_key = TongyiService._completion_cache_key(agent, dashscope_messages)
+            cached_response = CompletionCache.get(cache_key)
+            if cached_response is not None:
+                # 命中缓存时整段一次性下发
+                parts.append(cached_response)
+                yield cached_response
+            else:
+                metrics.EXECUTIONS_IN_FLIGHT.labels(mode='stream').inc()
+                start = time.perf_counter()
+                chunks = None
+                try:
+                    responses = TongyiService.call_model_api(agent, dashscope_messages, stream=True,
+                                                             api_keys=api_keys, deadline=deadline)
+                    # 上游停滞时在截止时间即中断，而不是等到读超时
+                    chunks = iter_within(responses, deadline)
+                    for response in chunks:
+                        if response.status_code != 200:
+                            raise ValueError(f"AI模型调用失败: {response.code} {response.message}")
+                        usage = getattr(response, 'usage', None) or usage
+                        chunk = response.output.text if response.output else None
+                        if chunk:
+                            if not parts:
+                                metrics.MODEL_FIRST_TOKEN_LATENCY.labels(model=metrics.model_label(agent.model)).observe(time.perf_counter() - start)
+                            parts.append(chunk)
+                            yield chunk
+                        deadline.check()
+                    metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(agent.model), stream='true').observe(time.perf_counter() - start)
+                except GeneratorExit:
+                    raise
+                except Exception as e:
+                    metrics.record_upstream_error(agent.model, e)
+                    raise
+                finally:
+                    # 提前结束（超时、客户端断开）时通知读取线程关闭上游连接
+                    if chunks is not None:
+                        chunks.close()
+                    metrics.EXECUTIONS_IN_FLIGHT.labels(mode='stream').dec()
+                CompletionCache.set(cache_key, ''.join(parts))
+                TongyiService._record_usage(agent, usage, dashscope_messages, ''.join(parts))
+
+            TongyiService.update_execution_record(execution, ''.join(parts), cached=cached_response is not None)
+        except GeneratorExit:
+            # 迭代器被提前关闭（客户端断开）：保留已下发的部分输出
+            db.session.rollback()
+            execution_writer.save(execution, status='timeout' if deadline.expired() else 'cancelled',
+                                  output=''.join(parts), end_time=datetime.utcnow())
+            raise
+        except Exception as e:
+            db.session.rollback()
+            execution_writer.save(execution, status=TongyiService.failure_status(e, deadline),
+                                  output=''.join(parts) or str(e), end_time=datetime.utcnow())
+            raise
 
     @staticmethod
-    def _get_conversation_history(execution_id: int, max_turns: int = 3) -> List[Message]:
-        """获取历史消息并转换为Message对象列表"""
-        history = []
-        current = AgentExecution.query.get(execution_id)
+    def resolve_generation_params(agent: Agent) -> Tuple[float, int]:
+        """对Agent配置做边界裁剪，返回 (temperature, max_tokens)；CompiledAgent 直接使用编译结果"""
+        if isinstance(agent, CompiledAgent):
+            return agent.generation_params
+        return TongyiService.clamp_generation_params(agent.temperature, agent.max_tokens)
+
+    @staticmethod
+    def clamp_generation_params(temperature: Optional[float], max_tokens: Optional[int]) -> Tuple[float, int]:
+        temperature = max(0.0, min(1.0, temperature)) if temperature is not None else DEFAULT_TEMPERATURE
+        max_tokens = max_tokens if max_tokens and max_tokens > 0 else DEFAULT_MAX_TOKENS
+        return temperature, max_tokens
 
-        while current and max_turns > 0:
-            if current.parent:
-                # 将数据库记录转换为Message对象
-                if current.output:
-                    history.insert(0, Message(role="assistant", content=current.output))
-                history.insert(0, Message(role="user", content=current.input))
-                max_turns -= 1
-            current = current.parent
+    @staticmethod
+    def _completion_cache_key(agent: Agent, dashscope_messages: List[dict]) -> Optional[str]:
+        """Agent 未启用回复缓存时返回 None"""
+        if not CompletionCache.enabled_for(agent):
+            return None
+        temperature, max_tokens = TongyiService.resolve_generation_params(agent)
+        return CompletionCache.make_key(agent, temperature, max_tokens, dashscope_messages)
 
-        return history
+    @staticmethod
+    def call_model_api(agent: Agent, dashscope_messages: List[dict], stream: bool = False,
+                       api_keys: Optional[Dict[str, str]] = None, deadline: Optional[Deadline] = None):
+        """经 model_router 调用 Agent 可用的后端（DashScope / OpenAI 兼容），主后端异常时自动切换"""
+        temperature, max_tokens = TongyiService.resolve_generation_params(agent)
+        if api_keys is None:
+            api_keys = TongyiService.resolve_api_keys(agent.user_id)
 
+        if stream:
+            return model_router.call(agent.model, dashscope_messages, api_keys, temperature, max_tokens,
+                                     stream=True, deadline=deadline)
+
+        with metrics.MODEL_CALL_LATENCY.labels(model=metrics.model_label(agent.model), stream='false').time():
+            return model_router.call(agent.model, dashscope_messages, api_keys, temperature, max_tokens,
+                                     deadline=deadline, hedge=bool(agent.hedge_enabled))
+
+    @staticmethod
+    def update_execution_record(execution: AgentExecution, ai_response: str, cached: bool = False):
+        execution_writer.save(
+            execution,
+            output=ai_response,
+            status='completed',
+            cached=cached,
+            end_time=datetime.utcnow()
+        )
+
+    @staticmethod
+    def _get_conversation_history(execution_id: int, max_turns: int = 3,
+                                  token_budget: Optional[int] = None) -> List[Message]:
+        """获取历史消息并转换为Message对象列表（单次递归查询，可按 token 预算裁剪）"""
+        executions = ArchiveService.hydrate(AgentExecution.ancestor_chain(execution_id, max_turns=max_turns))
+        if token_budget is not None:
+            executions = ContextService.select_executions(executions, token_budget)
+
+        history = []
+        for execution in executions:
+            history.append(Message(role="user", content=execution.input))
+            if execution.output:
+                history.append(Message(role="assistant", content=execution.output))
+        return history
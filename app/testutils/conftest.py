@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import pytest
+from dashscope import Generation
+
+from app import create_app
+from app.extensions import db
+from config import Config
+
+REPLY = "你好，世界！这是一段流式回复"
+
+
+class TestingConfig(Config):
+    # 每个测试一个文件库（见 app fixture）；内存库只有一条共享连接，队列工作线程和请求线程的事务会互相干扰
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    TESTING = True
+    SECRET_KEY = 'testing'
+    JWT_SECRET_KEY = 'testing-jwt-secret-key-with-enough-length'
+    AGENT_REAPER_ENABLED = False
+
+
+def fake_generation_call(*args, **kwargs):
+    """替代 dashscope 的 Generation.call：流式时每 3 个字一个分片"""
+    if kwargs.get('stream'):
+        return (
+            SimpleNamespace(status_code=200, code='', message='',
+                            output=SimpleNamespace(text=REPLY[i:i + 3]),
+                            usage=SimpleNamespace(input_tokens=5, output_tokens=1))
+            for i in range(0, len(REPLY), 3)
+        )
+    return SimpleNamespace(status_code=200, code='', message='', output=SimpleNamespace(text=REPLY),
+                           usage=SimpleNamespace(input_tokens=5, output_tokens=8))
+
+
+def clear_process_caches():
+    """进程级缓存以数据库 ID 为键；每个测试一个新库，ID 会重复，不清空会读到上个测试的数据"""
+    from app.services.agent_config_service import current_config_cache, version_config_cache
+    from app.services.api_service import api_key_cache
+    from app.services.catalog_service import agent_catalog
+    from app.services.completion_cache import completion_cache
+    from app.services.context_service import execution_token_cache
+    from app.services.identity_service import identity_cache
+    for cache in (current_config_cache, version_config_cache, api_key_cache, completion_cache,
+                  execution_token_cache, identity_cache):
+        cache.clear()
+    agent_catalog.invalidate()
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(Generation, 'call', staticmethod(fake_generation_call))
+    monkeypatch.setattr(Config, 'RATE_LIMIT_ENABLED', False)
+    clear_process_caches()
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app, client):
+    """注册并登录一个配置了通义密钥的用户"""
+    response = client.post('/auth/register', json={'username': 'alice', 'email': 'alice@example.com',
+                                                   'password': 'password123'})
+    assert response.status_code == 201, response.get_json()
+    with app.app_context():
+        from app.models import Api
+        Api.query.first().tongyi_api_key = 'sk-test'
+        db.session.commit()
+    response = client.post('/auth/login', json={'username_or_email': 'alice', 'password': 'password123'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+@pytest.fixture
+def agent_id(client, auth_headers):
+    response = client.post('/agents/', json={'name': 'assistant', 'system_prompt': '你是助手', 'temperature': 0},
+                           headers=auth_headers)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
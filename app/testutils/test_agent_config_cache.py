@@ -0,0 +1,35 @@
+from app.services import agent_config_service
+from app.services.agent_config_service import AgentConfigService
+from app.services.agent_service import AgentService
+from app.utils.cache import TTLCache
+from config import Config
+
+
+def test_cache_sees_changes_made_by_another_process(monkeypatch, app, auth_headers, agent_id):
+    """两个进程各自的缓存：B 修改、删除 Agent 后，A 缓存中的旧快照不再被使用"""
+    cache_a = TTLCache(maxsize=16, ttl=Config.AGENT_CONFIG_CACHE_TTL)
+    cache_b = TTLCache(maxsize=16, ttl=Config.AGENT_CONFIG_CACHE_TTL)
+
+    def process(cache):
+        monkeypatch.setattr(agent_config_service, 'current_config_cache', cache)
+
+    with app.app_context():
+        process(cache_a)
+        before = AgentConfigService.current(agent_id)
+        assert cache_a.get(agent_id) is before
+
+        process(cache_b)
+        user_id = before.user_id
+        AgentService.update_agent(user_id, agent_id, {'system_prompt': '新的提示词'})
+
+        process(cache_a)
+        after = AgentConfigService.current(agent_id)
+        assert after.version == before.version + 1
+        assert cache_a.get(agent_id) is after
+
+        process(cache_b)
+        assert AgentService.delete_agent(user_id, agent_id)
+
+        process(cache_a)
+        assert AgentConfigService.current(agent_id) is None
+        assert cache_a.get(agent_id) is None
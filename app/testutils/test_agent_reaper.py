@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models import Agent, AgentExecution, AgentVersion
+from app.services import agent_reaper as reaper_module
+from app.services.agent_reaper import agent_reaper
+from app.services.archive_service import ArchiveService, segment_index_cache
+from config import Config
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def archive_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    segment_index_cache.clear()
+
+
+def _add_executions(agent_id, count, prefix):
+    db.session.add_all([
+        AgentExecution(agent_id=agent_id, user_id=1, input=f'{prefix}{i}', output='回复', status='completed',
+                       start_time=datetime(2020, 1, 15), end_time=datetime(2020, 1, 15))
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def test_reaper_purges_in_chunks_and_resumes(monkeypatch, archive_dir, app, client, auth_headers, agent_id):
+    """分块删除并记录进度；中途中断后从剩余部分继续，最后删除Agent及其归档正文"""
+    other_id = client.post('/agents/', json={'name': 'keep', 'system_prompt': '保留'},
+                           headers=auth_headers).get_json()['id']
+    with app.app_context():
+        _add_executions(agent_id, 5, '删除')
+        _add_executions(other_id, 1, '保留')
+        ArchiveService.archive(older_than_days=1)
+        total = AgentExecution.query.filter_by(agent_id=agent_id).count()  # 含创建时的连接测试记录
+    assert client.delete(f'/agents/{agent_id}', headers=auth_headers).status_code == 200
+
+    monkeypatch.setattr(agent_reaper, 'chunk_size', 2)
+    monkeypatch.setattr(agent_reaper, 'pause', 0.01)
+    progress = []
+
+    def interrupt_after_first_chunk(seconds):
+        progress.append(db.session.query(Agent.purged_executions).filter_by(id=agent_id).scalar())
+        if len(progress) == 1:
+            raise Interrupted()
+
+    monkeypatch.setattr(reaper_module.time, 'sleep', interrupt_after_first_chunk)
+    with app.app_context():
+        with pytest.raises(Interrupted):
+            agent_reaper.reap()
+        assert AgentExecution.query.filter_by(agent_id=agent_id).count() == total - 2
+
+        # 归档正文在删除执行记录前已清除，其他Agent的记录不受影响
+        segment = ArchiveService.segment_path(datetime(2020, 1, 15), 1)
+        assert set(ArchiveService.load_index(segment)) == {
+            execution_id for (execution_id,) in db.session.query(AgentExecution.id)
+            .filter(AgentExecution.agent_id == other_id, AgentExecution.archive_segment.isnot(None))
+        }
+
+        assert agent_reaper.reap() == total - 2
+        assert progress == [min(n, total) for n in range(2, total + 2, 2)]
+        assert db.session.get(Agent, agent_id) is None
+        assert AgentVersion.query.filter_by(agent_id=agent_id).count() == 0
+        assert AgentExecution.query.filter_by(agent_id=agent_id).count() == 0
+        kept = ArchiveService.hydrate(AgentExecution.query.filter(
+            AgentExecution.agent_id == other_id, AgentExecution.archive_segment.isnot(None)).all())
+        assert [execution.input for execution in kept] == ['保留0']
+
+
+def test_reaper_counts_only_rows_it_deleted(monkeypatch, app, client, auth_headers, agent_id):
+    """另一进程已删除同一块时，进度只累加本进程实际删除的行数"""
+    with app.app_context():
+        _add_executions(agent_id, 3, '并发')
+        total = AgentExecution.query.filter_by(agent_id=agent_id).count()
+    assert client.delete(f'/agents/{agent_id}', headers=auth_headers).status_code == 200
+
+    original = reaper_module.db.session.query
+
+    def query_then_race(*entities, **kwargs):
+        query = original(*entities, **kwargs)
+        if len(entities) == 1 and entities[0] is AgentExecution:
+            # 模拟另一个进程在本进程 SELECT 之后先删除了其中一条
+            original(AgentExecution).filter(AgentExecution.input == '并发0').delete(synchronize_session=False)
+        return query
+
+    monkeypatch.setattr(agent_reaper, 'pause', 0)
+    monkeypatch.setattr(reaper_module.db.session, 'query', query_then_race)
+    with app.app_context():
+        assert agent_reaper.reap() == total - 1
@@ -0,0 +1,17 @@
+from app.models import Agent
+
+
+def test_update_ignores_server_managed_fields(app, client, auth_headers, agent_id):
+    """PUT 只修改允许的字段，deleted_at、purged_executions、user_id 等不能被客户端写入"""
+    response = client.put(f'/agents/{agent_id}', json={
+        'name': 'renamed', 'is_public': True, 'deleted_at': '2020-01-01T00:00:00',
+        'purged_executions': 99, 'user_id': 42, 'version': 7, 'id': 1000}, headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        agent = Agent.query.get(agent_id)
+        assert agent.name == 'renamed' and agent.is_public
+        assert agent.deleted_at is None
+        assert agent.purged_executions == 0
+        assert agent.user_id != 42
+        assert agent.version == 2
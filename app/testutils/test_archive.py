@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.services.archive_service import ArchiveService, segment_index_cache
+from config import Config
+
+
+@pytest.fixture
+def archive_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    segment_index_cache.clear()
+    return tmp_path / 'archive'
+
+
+def _add_old_executions(agent_id, texts):
+    executions = [AgentExecution(agent_id=agent_id, user_id=1, input=text, output=f'答：{text}', status='completed',
+                                 start_time=datetime(2020, 1, 15), end_time=datetime(2020, 1, 15))
+                  for text in texts]
+    db.session.add_all(executions)
+    db.session.commit()
+    return [execution.id for execution in executions]
+
+
+def test_archive_and_hydrate_round_trip(monkeypatch, archive_dir, app, client, auth_headers, agent_id):
+    """归档后数据库只留索引行，单条读取按偏移定位，不扫描整个段文件"""
+    with app.app_context():
+        ids = _add_old_executions(agent_id, ['第一问', '第二问', '第三问'])
+        assert ArchiveService.archive(older_than_days=1) == 3
+        row = db.session.get(AgentExecution, ids[1])
+        assert (row.input, row.output, row.archive_segment) == ('', None, '2020-01/user_1.jsonl.gz')
+    assert (archive_dir / '2020-01' / 'user_1.jsonl.gz.idx').exists()
+
+    def no_scan(path):
+        raise AssertionError("不应扫描整个段文件")
+
+    monkeypatch.setattr(ArchiveService, '_iter_segment', staticmethod(no_scan))
+    response = client.get(f'/api/execution/{ids[1]}', headers=auth_headers)
+    assert response.status_code == 200
+    current = response.get_json()['current']
+    assert (current['input'], current['output']) == ('第二问', '答：第二问')
+
+
+def test_legacy_segment_is_scanned_then_converted(archive_dir, app, agent_id):
+    """旧格式（无索引）的段文件仍可回填，再次追加归档时转换为带索引的格式"""
+    with app.app_context():
+        legacy_id, new_id = _add_old_executions(agent_id, ['旧记录', '新记录'])
+        segment = ArchiveService.segment_path(datetime(2020, 1, 15), 1)
+        path = archive_dir / segment
+        os.makedirs(path.parent)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'id': legacy_id, 'agent_id': agent_id, 'input': '旧记录', 'output': '旧回复'},
+                               ensure_ascii=False) + '\n')
+        AgentExecution.query.filter_by(id=legacy_id).update({'input': '', 'output': None,
+                                                              'archive_segment': segment})
+        db.session.commit()
+
+        legacy = ArchiveService.hydrate([db.session.get(AgentExecution, legacy_id)])[0]
+        assert legacy.output == '旧回复'
+
+        assert ArchiveService.archive(older_than_days=1) == 1
+        assert set(ArchiveService.load_index(segment)) == {legacy_id, new_id}
+        db.session.expire_all()
+        rows = ArchiveService.hydrate(AgentExecution.query.filter(AgentExecution.id.in_([legacy_id, new_id]))
+                                      .order_by(AgentExecution.id).all())
+        assert [(row.input, row.output) for row in rows] == [('旧记录', '旧回复'), ('新记录', '答：新记录')]
+
+
+def test_listing_and_export_hydrate_archived_rows(archive_dir, app, client, auth_headers, agent_id):
+    """执行历史列表（含游标分页）和导出中，已归档记录的输入输出从段文件回填"""
+    with app.app_context():
+        ids = _add_old_executions(agent_id, ['第一问', '第二问'])
+        assert ArchiveService.archive(older_than_days=1) == 2
+
+    url = f'/agents/{agent_id}/executions'
+    listed = {item['id']: item for item in client.get(url, headers=auth_headers).get_json()}
+    paged = client.get(url, query_string={'limit': 10, 'fields': 'id,output'}, headers=auth_headers).get_json()
+    exported = [json.loads(line) for line in
+                client.get(f'{url}/export', headers=auth_headers).get_data(as_text=True).splitlines()]
+
+    assert [(listed[i]['input'], listed[i]['output']) for i in ids] == [('第一问', '答：第一问'), ('第二问', '答：第二问')]
+    assert {item['id']: item['output'] for item in paged['items'] if item['id'] in ids} == {
+        ids[0]: '答：第一问', ids[1]: '答：第二问'}
+    assert [item['input'] for item in exported if item['id'] in ids] == ['第一问', '第二问']
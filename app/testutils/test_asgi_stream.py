@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import httpx
+from prometheus_client import REGISTRY
+
+from app.asgi import create_asgi_app
+from app.models import AgentExecution
+from app.services import model_router as router_module
+
+
+def _observed(endpoint, status):
+    """after_request 钩子记录的请求数（依赖 before_request 钩子设置的开始时间）"""
+    return REGISTRY.get_sample_value('http_request_duration_seconds_count', {
+        'blueprint': 'agents', 'endpoint': endpoint, 'method': 'POST', 'status': str(status)
+    }) or 0
+
+
+def _sse(text):
+    return 'data: ' + json.dumps({"output": {"choices": [{"message": {"content": text}}]},
+                                  "usage": {"input_tokens": 5, "output_tokens": 1}}) + '\n\n'
+
+
+def _upstream(monkeypatch, chunks, stall=30):
+    """模拟 DashScope 流式接口：先下发 chunks，随后停滞 stall 秒"""
+    async def body():
+        for chunk in chunks:
+            yield _sse(chunk).encode()
+        await asyncio.sleep(stall)
+        yield _sse('不该出现').encode()
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=body())))
+    monkeypatch.setattr(router_module, 'get_async_model_client', lambda: client)
+
+
+def _post(asgi_app, path, payload, headers, disconnect_after_deltas=None):
+    """直接驱动 ASGI 应用；收到指定数量的 delta 事件后模拟客户端断开"""
+    body = json.dumps(payload).encode()
+
+    async def main():
+        messages = []
+        disconnected = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            deltas = sum(m.get('body', b'').count(b'event: delta') for m in messages)
+            if disconnect_after_deltas is not None and deltas >= disconnect_after_deltas:
+                disconnected.set()
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] +
+                       [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        await asyncio.wait_for(asgi_app(scope, receive, send), timeout=10)
+        return messages
+
+    return asyncio.run(main())
+
+
+def test_asgi_disconnect_finalizes_execution(monkeypatch, app, auth_headers, agent_id):
+    """ASGI 模式下 SSE 读到一半断开：执行记录以 cancelled 结束，保留已下发的部分输出"""
+    _upstream(monkeypatch, ['你好', '世界'])
+    messages = _post(create_asgi_app(app), f'/agents/{agent_id}/execute', {'input': '异步故事', 'stream': True},
+                     auth_headers, disconnect_after_deltas=2)
+    assert messages[0]['status'] == 200
+
+    with app.app_context():
+        execution = AgentExecution.query.filter_by(input='异步故事').one()
+        assert execution.status == 'cancelled'
+        assert execution.end_time is not None
+        assert execution.output == '你好世界'
+
+
+def test_asgi_stalled_stream_is_cut_at_deadline(monkeypatch, app, auth_headers, agent_id):
+    """ASGI 模式下上游停滞：到截止时间即结束，执行记录为 timeout"""
+    _upstream(monkeypatch, ['你好'])
+    messages = _post(create_asgi_app(app), f'/agents/{agent_id}/execute',
+                     {'input': '异步卡住', 'stream': True, 'timeout': 1}, auth_headers)
+    body = b''.join(m.get('body', b'') for m in messages)
+    assert b'event: error' in body
+
+    with app.app_context():
+        execution = AgentExecution.query.filter_by(input='异步卡住').one()
+        assert execution.status == 'timeout'
+        assert execution.output == '你好'
+
+
+def test_asgi_runs_request_hooks_and_delegates_other_routes(monkeypatch, app, auth_headers, agent_id):
+    """模型接口同样经过 before_request/after_request；其余接口经 a2wsgi 交给 Flask"""
+    _upstream(monkeypatch, ['你好'], stall=0)
+    asgi_app = create_asgi_app(app)
+    executed = _observed('/agents/<int:agent_id>/execute', 200)
+    created = _observed('/agents/', 201)
+
+    messages = _post(asgi_app, f'/agents/{agent_id}/execute', {'input': '钩子', 'stream': True}, auth_headers)
+    assert messages[0]['status'] == 200
+    assert (b'cache-control', b'no-cache') in messages[0]['headers']
+    assert _observed('/agents/<int:agent_id>/execute', 200) == executed + 1
+
+    messages = _post(asgi_app, '/agents/', {'name': 'delegated', 'system_prompt': '你是助手'}, auth_headers)
+    assert messages[0]['status'] == 201
+    assert json.loads(b''.join(m.get('body', b'') for m in messages))['name'] == 'delegated'
+    assert _observed('/agents/', 201) == created + 1
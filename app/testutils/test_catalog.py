@@ -0,0 +1,59 @@
+from app.services.catalog_service import agent_catalog
+from config import Config
+
+
+def _create(client, auth_headers, name, description='', is_public=True):
+    response = client.post('/agents/', json={'name': name, 'description': description, 'system_prompt': '你是助手',
+                                             'is_public': is_public}, headers=auth_headers)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def _search(client, auth_headers, q):
+    response = client.get('/agents/', query_string={'public': 'true', 'q': q}, headers=auth_headers)
+    assert response.status_code == 200
+    return [item['id'] for item in response.get_json()['items']]
+
+
+def test_etag_revalidation(client, auth_headers):
+    """内容未变时带 If-None-Match 返回 304；公开Agent变化后 ETag 随之改变"""
+    first = _create(client, auth_headers, 'translator')
+    response = client.get('/agents/?public=true', headers=auth_headers)
+    etag = response.headers['ETag']
+    assert [item['id'] for item in response.get_json()] == [first]
+
+    cached = client.get('/agents/?public=true', headers={**auth_headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    # 查询参数不同，ETag 也不同
+    assert client.get('/agents/?public=true&limit=1', headers=auth_headers).headers['ETag'] != etag
+
+    second = _create(client, auth_headers, 'summarizer')
+    response = client.get('/agents/?public=true', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [item['id'] for item in response.get_json()] == [second, first]
+
+
+def test_changes_are_applied_incrementally(monkeypatch, client, auth_headers):
+    """目录加载一次后，新建、修改、取消公开和删除都增量更新快照，不重新查询全部Agent"""
+    monkeypatch.setattr(Config, 'CATALOG_REFRESH_INTERVAL', 3600)
+    translator = _create(client, auth_headers, 'translator', '中英文翻译助手')
+    assert _search(client, auth_headers, 'trans') == [translator]
+    loaded_at = agent_catalog._loaded_at
+
+    writer = _create(client, auth_headers, 'writer', '写作助手')
+    _create(client, auth_headers, 'private', '私有翻译', is_public=False)
+    assert _search(client, auth_headers, '助手') == [writer, translator]
+    assert _search(client, auth_headers, '翻译') == [translator]
+
+    client.put(f'/agents/{writer}', json={'description': '翻译润色'}, headers=auth_headers)
+    assert _search(client, auth_headers, '翻译') == [writer, translator]
+    assert _search(client, auth_headers, '写作') == []
+
+    client.put(f'/agents/{translator}', json={'is_public': False}, headers=auth_headers)
+    client.delete(f'/agents/{writer}', headers=auth_headers)
+    assert _search(client, auth_headers, '翻译') == []
+    # 全量加载时会刷新 _loaded_at
+    assert agent_catalog._loaded_at == loaded_at
@@ -0,0 +1,62 @@
+import pytest
+from dashscope import Generation
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.testutils.conftest import REPLY, fake_generation_call
+
+
+@pytest.fixture
+def model_calls(monkeypatch, app):
+    """记录实际发给模型的请求次数"""
+    calls = []
+
+    def call(*args, **kwargs):
+        calls.append(kwargs)
+        return fake_generation_call(*args, **kwargs)
+
+    monkeypatch.setattr(Generation, 'call', staticmethod(call))
+    return calls
+
+
+def _execute(client, auth_headers, agent_id, text):
+    response = client.post(f'/agents/{agent_id}/execute', json={'input': text}, headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _create_agent(client, auth_headers, **fields):
+    response = client.post('/agents/', json={'name': 'creative', 'system_prompt': '你是助手', **fields},
+                           headers=auth_headers)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def test_repeated_input_is_served_from_cache(app, client, auth_headers, agent_id, model_calls):
+    """temperature 为 0 的 Agent 默认缓存：相同输入不再调用模型，执行记录标记 cached"""
+    calls_before = len(model_calls)
+    first = _execute(client, auth_headers, agent_id, '介绍一下你自己')
+    # 首尾空白不影响命中
+    second = _execute(client, auth_headers, agent_id, ' 介绍一下你自己\n')
+
+    assert len(model_calls) == calls_before + 1
+    assert first['response_text'] == second['response_text'] == REPLY
+    with app.app_context():
+        assert db.session.get(AgentExecution, first['execution_id']).cached is False
+        row = db.session.get(AgentExecution, second['execution_id'])
+        assert (row.status, row.output, row.cached) == ('completed', REPLY, True)
+
+
+def test_cache_is_off_by_default_for_nonzero_temperature(client, auth_headers, model_calls):
+    """temperature 非 0 且未显式开启时每次都调用模型；cache_enabled 显式设置优先"""
+    creative = _create_agent(client, auth_headers, temperature=0.7)
+    opted_in = _create_agent(client, auth_headers, temperature=0.7, cache_enabled=True)
+    calls_before = len(model_calls)
+
+    for _ in range(2):
+        _execute(client, auth_headers, creative, '写一首诗')
+    assert len(model_calls) == calls_before + 2
+
+    results = [_execute(client, auth_headers, opted_in, '写一首诗') for _ in range(2)]
+    assert len(model_calls) == calls_before + 3
+    assert results[1]['response_text'] == REPLY
@@ -0,0 +1,75 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.utils.json_provider import OrjsonProvider, TimedJSONProvider
+
+
+@pytest.fixture
+def history(app, agent_id):
+    """足够大的执行历史，响应体超过 COMPRESSION_MIN_SIZE"""
+    with app.app_context():
+        db.session.add_all([AgentExecution(agent_id=agent_id, user_id=1, input=f'问题{i}', output='很长的回答' * 20,
+                                           status='completed') for i in range(20)])
+        db.session.commit()
+    return f'/agents/{agent_id}/executions'
+
+
+def test_gzip_when_accepted(client, auth_headers, history):
+    plain = client.get(history, headers=auth_headers)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get(history, headers={**auth_headers, 'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.data) < len(plain.data)
+    assert json.loads(gzip.decompress(response.data)) == plain.get_json()
+
+
+@pytest.mark.parametrize('accept', ['identity', 'gzip;q=0', 'br'])
+def test_identity_when_gzip_not_accepted(client, auth_headers, history, accept):
+    response = client.get(history, headers={**auth_headers, 'Accept-Encoding': accept})
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.get_json()) == 21
+
+
+def test_small_responses_are_not_compressed(client, auth_headers, history):
+    response = client.get(history, query_string={'limit': 1, 'fields': 'id'},
+                          headers={**auth_headers, 'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.get_json()['items']) == 1
+
+
+def test_zstd_preferred_when_available(client, auth_headers, history):
+    zstandard = pytest.importorskip('zstandard')
+    response = client.get(history, headers={**auth_headers, 'Accept-Encoding': 'gzip, zstd'})
+    assert response.headers['Content-Encoding'] == 'zstd'
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+    assert len(json.loads(body)) == 21
+
+
+def test_compressed_catalog_keeps_revalidation(client, auth_headers):
+    """压缩后 ETag 降级为弱 ETag，带 If-None-Match 仍返回 304"""
+    for i in range(10):
+        client.post('/agents/', json={'name': f'公开助手{i}', 'description': '翻译与写作' * 20,
+                                      'system_prompt': '你是助手', 'is_public': True}, headers=auth_headers)
+    headers = {**auth_headers, 'Accept-Encoding': 'gzip'}
+    response = client.get('/agents/?public=true', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].startswith('W/')
+
+    cached = client.get('/agents/?public=true', headers={**headers, 'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+
+def test_json_providers_agree(app):
+    """orjson 与标准库实现输出相同的内容，datetime 均为 ISO 8601"""
+    payload = {'id': 1, 'text': '你好', 'start_time': datetime(2024, 5, 1, 12, 30), 'items': [1.5, None, True]}
+    fast, standard = OrjsonProvider(app), TimedJSONProvider(app)
+    assert json.loads(fast.dumps(payload)) == json.loads(standard.dumps(payload))
+    assert fast.loads(fast.dumps(payload))['start_time'] == '2024-05-01T12:30:00'
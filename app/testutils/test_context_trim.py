@@ -0,0 +1,25 @@
+from app.services.context_service import ContextService
+from app.services.tongyi_service import Message
+
+
+def _cost(*contents):
+    return sum(ContextService.message_tokens(content) for content in contents)
+
+
+def test_trim_keeps_whole_turns():
+    """预算只够半轮时整轮丢弃，不会留下没有提问的回复"""
+    history = [
+        Message(role='user', content='第一个问题'), Message(role='assistant', content='第一个回答'),
+        Message(role='user', content='第二个问题'), Message(role='assistant', content='第二个回答比较长一些'),
+    ]
+    budget = _cost('第二个问题', '第二个回答比较长一些') - 1
+    assert ContextService.trim_messages(history, budget) == []
+
+    budget = _cost('第二个问题', '第二个回答比较长一些', '第一个回答')
+    assert ContextService.trim_messages(history, budget) == history[2:]
+
+
+def test_trim_drops_reply_without_question():
+    history = [Message(role='assistant', content='孤立的回答'), Message(role='user', content='问题'),
+               Message(role='assistant', content='回答')]
+    assert ContextService.trim_messages(history, 10000) == history[1:]
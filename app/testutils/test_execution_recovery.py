@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import AgentExecution
+from app.services.execution_queue import execution_queue
+from config import Config
+
+
+def test_recover_requeues_recent_and_fails_stale(app, auth_headers, agent_id):
+    """重启后遗留的 pending：较新的重新入队并执行，过旧的标记为 failed"""
+    with app.app_context():
+        recent = AgentExecution(agent_id=agent_id, user_id=1, input='recent', status='pending')
+        stale = AgentExecution(agent_id=agent_id, user_id=1, input='stale', status='pending',
+                               start_time=datetime.utcnow() - timedelta(seconds=execution_queue.recover_max_age + 60))
+        db.session.add_all([recent, stale])
+        db.session.commit()
+
+        requeued, failed = execution_queue.recover()
+        assert (requeued, failed) == (1, 1)
+        execution_queue._queue.join()
+
+        db.session.expire_all()
+        assert AgentExecution.query.filter_by(input='recent').one().status == 'completed'
+        stale = AgentExecution.query.filter_by(input='stale').one()
+        assert stale.status == 'failed' and stale.end_time is not None
+
+
+def test_recover_fails_interrupted_running(app, auth_headers, agent_id):
+    """执行中途进程退出、停留在 running 的记录：超过排队上限加截止时间上限后标记为 failed"""
+    with app.app_context():
+        interrupted = AgentExecution(agent_id=agent_id, user_id=1, input='interrupted', status='running',
+                                     start_time=datetime.utcnow() - timedelta(
+                                         seconds=execution_queue.recover_max_age + Config.AGENT_EXECUTION_TIMEOUT + 60))
+        running = AgentExecution(agent_id=agent_id, user_id=1, input='running', status='running')
+        db.session.add_all([interrupted, running])
+        db.session.commit()
+
+        assert execution_queue.recover() == (0, 1)
+
+        db.session.expire_all()
+        interrupted = AgentExecution.query.filter_by(input='interrupted').one()
+        assert interrupted.status == 'failed' and interrupted.end_time is not None
+        assert AgentExecution.query.filter_by(input='running').one().status == 'running'
+
+
+def test_deleted_agent_execution_is_finished(app, client, auth_headers, agent_id):
+    """排队期间 Agent 被删除：记录以 failed 结束并写入结束时间"""
+    with app.app_context():
+        execution = AgentExecution(agent_id=agent_id, user_id=1, input='orphan', status='pending')
+        db.session.add(execution)
+        db.session.commit()
+        execution_id = execution.id
+
+    assert client.delete(f'/agents/{agent_id}', headers=auth_headers).status_code == 200
+    with app.app_context():
+        execution_queue._run(execution_id)
+        execution = db.session.get(AgentExecution, execution_id)
+        assert execution.status == 'failed' and execution.end_time is not None
@@ -0,0 +1,84 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models import AgentExecution
+
+
+@pytest.fixture
+def executions(app, agent_id):
+    """5 条已完成、1 条失败的记录（另有创建 Agent 时的测试连接记录），按天递增"""
+    with app.app_context():
+        rows = [AgentExecution(agent_id=agent_id, user_id=1, input=f'问题{i}', output=f'回答{i}',
+                               status='failed' if i == 5 else 'completed', start_time=datetime(2024, 5, i + 1))
+                for i in range(6)]
+        db.session.add_all(rows)
+        db.session.commit()
+        return [row.id for row in rows]
+
+
+def _export(client, auth_headers, agent_id, **params):
+    response = client.get(f'/agents/{agent_id}/executions/export', query_string=params, headers=auth_headers)
+    assert response.status_code == 200, response.data
+    return response
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_ndjson_filters_and_resume(client, auth_headers, agent_id, executions):
+    """按 id 升序输出；since/until/status 过滤；after_id 断点续传"""
+    response = _export(client, auth_headers, agent_id, since='2024-05-02', until='2024-05-06', status='completed')
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'attachment' in response.headers['Content-Disposition']
+    items = _ndjson(response)
+    assert [item['id'] for item in items] == executions[1:5]
+    assert (items[0]['input'], items[0]['output'], items[0]['start_time']) == ('问题1', '回答1', '2024-05-02T00:00:00')
+
+    resumed = _ndjson(_export(client, auth_headers, agent_id, status='completed,failed', after_id=executions[3]))
+    assert [item['id'] for item in resumed] == executions[4:]
+
+
+def test_csv_export(client, auth_headers, agent_id, executions):
+    response = _export(client, auth_headers, agent_id, format='csv', status='failed')
+    assert response.mimetype == 'text/csv'
+    header, *rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert header == list(AgentExecution.PROJECTABLE_FIELDS)
+    assert len(rows) == 1
+    row = dict(zip(header, rows[0]))
+    assert (row['id'], row['input'], row['status'], row['start_time']) == (
+        str(executions[5]), '问题5', 'failed', '2024-05-06T00:00:00')
+
+
+def test_large_export_is_streamed_in_chunks(app, client, auth_headers, agent_id):
+    """大导出分块下发（约 64KB 一块），gzip 压缩也逐块进行"""
+    with app.app_context():
+        db.session.add_all([AgentExecution(agent_id=agent_id, user_id=1, input=f'问题{i}', output='回答' * 200,
+                                           status='completed') for i in range(300)])
+        db.session.commit()
+    url = f'/agents/{agent_id}/executions/export'
+
+    response = client.get(url, headers=auth_headers, buffered=False)
+    assert response.is_streamed
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) > 2
+    plain = b''.join(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8') for chunk in chunks)
+    assert len(plain.splitlines()) == 301
+
+    compressed = client.get(url, headers={**auth_headers, 'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain
+
+
+def test_export_rejects_bad_requests(client, auth_headers, agent_id):
+    url = f'/agents/{agent_id}/executions/export'
+    assert client.get(url, query_string={'format': 'xml'}, headers=auth_headers).status_code == 400
+    assert client.get(url, query_string={'since': 'yesterday'}, headers=auth_headers).status_code == 400
+    assert client.get(f'/agents/{agent_id + 1}/executions/export', headers=auth_headers).status_code == 404
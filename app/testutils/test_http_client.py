@@ -0,0 +1,41 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.utils.http_client import build_session
+
+
+@pytest.fixture
+def upstream():
+    """每次都返回 503 + Retry-After 的上游，记录收到的请求数"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            hits.append(self.path)
+            self.send_response(503)
+            self.send_header('Retry-After', '5')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", hits
+    server.shutdown()
+
+
+def test_sent_requests_are_not_replayed(upstream):
+    """已发出的 POST 返回 5xx 时不重放、不按 Retry-After 等待，交给模型路由处理"""
+    url, hits = upstream
+    session = build_session(pool_size=1, retries=2, backoff=0.5)
+    started = time.monotonic()
+    response = session.post(f"{url}/chat/completions", json={"model": "qwen-turbo"}, timeout=(1, 5))
+    assert response.status_code == 503
+    assert len(hits) == 1
+    assert time.monotonic() - started < 1
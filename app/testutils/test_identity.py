@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import event
+
+from app.extensions import db
+from app.services import identity_service
+from app.services.auth_service import AuthService
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    """每个测试独立的进程内吊销列表"""
+    monkeypatch.setattr(identity_service, '_revocations', identity_service.MemoryRevocationList())
+    return identity_service._revocations
+
+
+@pytest.fixture
+def user_queries(app):
+    """记录查询 user 表的 SQL"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if 'FROM user' in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_authenticated_reads_use_cached_identity(client, auth_headers, revocations, user_queries):
+    """身份快照缓存后，令牌校验和读取当前用户都不再查询 user 表"""
+    identity_service.identity_cache.clear()
+    assert client.get('/auth/center', headers=auth_headers).status_code == 200
+    assert len(user_queries) == 1
+    user_queries.clear()
+    for _ in range(3):
+        response = client.get('/auth/center', headers=auth_headers)
+        assert response.status_code == 200
+    assert response.get_json()['username'] == 'alice'
+    assert user_queries == []
+
+
+def test_deactivation_revokes_tokens_immediately(app, client, auth_headers, revocations):
+    """停用用户后已签发的令牌立即失效（缓存中仍是启用状态的快照也不例外），恢复后重新可用"""
+    assert client.get('/auth/center', headers=auth_headers).status_code == 200
+
+    with app.app_context():
+        AuthService.update_user_profile(1, {'is_active': False})
+    assert revocations.contains(1)
+    assert client.get('/auth/center', headers=auth_headers).status_code == 401
+
+    with app.app_context():
+        AuthService.update_user_profile(1, {'is_active': True})
+    assert not revocations.contains(1)
+    assert client.get('/auth/center', headers=auth_headers).status_code == 200
+
+
+def test_profile_update_invalidates_cached_identity(app, client, auth_headers, revocations):
+    assert client.get('/auth/center', headers=auth_headers).get_json()['username'] == 'alice'
+    with app.app_context():
+        AuthService.update_user_profile(1, {'username': 'alice2'})
+    assert client.get('/auth/center', headers=auth_headers).get_json()['username'] == 'alice2'
@@ -0,0 +1,33 @@
+from prometheus_client import REGISTRY
+
+from app.utils.metrics import model_label
+
+
+def _model_labels(metric):
+    return {sample.labels.get('model') for family in REGISTRY.collect() if family.name == metric
+            for sample in family.samples}
+
+
+def test_model_label_is_bounded():
+    assert model_label('qwen-max') == 'qwen-max'
+    assert model_label('qwen-1.8b') == 'qwen-1.8b'
+    assert model_label('gpt-4o-mini') == 'gpt-4o-mini'  # MODEL_ROUTES 中的后端模型
+    assert model_label('随便-写的-模型-123') == 'other'
+
+
+def test_unknown_agent_model_is_recorded_as_other(client, auth_headers):
+    """用户填写的任意模型名不会成为新的指标标签"""
+    response = client.post('/agents/', json={'name': 'custom', 'system_prompt': '你是助手', 'model': 'my-model-9f3a'},
+                           headers=auth_headers)
+    assert response.status_code == 201, response.get_json()
+    agent_id = response.get_json()['id']
+    assert client.post(f'/agents/{agent_id}/execute', json={'input': '你好'}, headers=auth_headers).status_code == 200
+
+    assert 'my-model-9f3a' not in _model_labels('model_call_duration_seconds')
+    assert 'my-model-9f3a' not in _model_labels('model_tokens')
+    assert 'other' in _model_labels('model_tokens')
+
+
+def test_available_models_listing(client, auth_headers):
+    models = client.get('/agents/models', headers=auth_headers).get_json()['models']
+    assert all(model_label(model['id']) == model['id'] for model in models)
@@ -0,0 +1,70 @@
+import pytest
+import requests
+
+from app.services import model_router as router_module
+from app.services.model_router import Backend, ModelRouter, ModelResponse, ModelOutput, ProviderError
+from config import Config
+
+
+class FakeProvider:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def call(self, model, messages, api_key, temperature, max_tokens, stream=False, timeout=None):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return ModelResponse(output=ModelOutput(text='ok'))
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """qwen-test 先走 dashscope，失败后切换到 openai"""
+    monkeypatch.setattr(Config, 'MODEL_ROUTES', {'qwen-test': [('dashscope', 'qwen-test'), ('openai', 'gpt-test')]})
+    fallback = FakeProvider()
+    monkeypatch.setitem(router_module.PROVIDERS, 'openai', fallback)
+
+    def install(error):
+        primary = FakeProvider(error)
+        monkeypatch.setitem(router_module.PROVIDERS, 'dashscope', primary)
+        return primary, fallback
+    return install
+
+
+def _call(router, api_key):
+    return router.call('qwen-test', [{'role': 'user', 'content': 'hi'}],
+                       {'dashscope': api_key, 'openai': api_key}, temperature=0, max_tokens=10)
+
+
+@pytest.mark.parametrize('error', [
+    ProviderError('bad request', status_code=400, code='InvalidParameter'),
+    ProviderError('blocked', status_code=400, code='DataInspectionFailed'),
+    ProviderError('blocked', code='DataInspectionFailed'),
+])
+def test_client_errors_do_not_fail_over_or_trip_breaker(routed, error):
+    primary, fallback = routed(error)
+    router = ModelRouter()
+    with pytest.raises(ProviderError):
+        _call(router, 'sk-client-error')
+    assert fallback.calls == 0
+    assert router.stats(Backend('dashscope', 'qwen-test')).snapshot()[0] == 0
+    breaker = router.breaker(Backend('dashscope', 'qwen-test'), {'dashscope': 'sk-client-error'})
+    assert breaker.snapshot()['samples'] == 0
+
+
+@pytest.mark.parametrize('error', [
+    ProviderError('upstream down', status_code=503),
+    ProviderError('throttled', status_code=429),
+    requests.exceptions.ReadTimeout('timed out'),
+    requests.exceptions.ConnectionError('refused'),
+])
+def test_server_errors_fail_over_and_count_as_failures(routed, error):
+    primary, fallback = routed(error)
+    router = ModelRouter()
+    assert _call(router, 'sk-server-error').output.text == 'ok'
+    assert fallback.calls == 1
+    assert router.stats(Backend('dashscope', 'qwen-test')).snapshot()[1] == 1.0
+    breaker = router.breaker(Backend('dashscope', 'qwen-test'), {'dashscope': 'sk-server-error'})
+    assert breaker.snapshot()['failure_rate'] == 1.0
+    breaker.reset()
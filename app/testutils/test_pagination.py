@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from app.extensions import db
+from app.models import AgentExecution
+
+
+def _walk(client, auth_headers, url, **params):
+    """沿 next_cursor 翻完所有页，返回每页的条目"""
+    pages, cursor = [], None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        response = client.get(url, query_string=query, headers=auth_headers)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        pages.append(body['items'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_execution_cursor_pages_cover_every_row_once(app, client, auth_headers, agent_id):
+    """同一时间戳的记录按 id 区分，翻页既不重复也不遗漏；fields 只返回所选字段"""
+    same_time = datetime(2024, 5, 1, 12, 0, 0)
+    with app.app_context():
+        db.session.add_all([AgentExecution(agent_id=agent_id, user_id=1, input=f'问题{i}', output='回答',
+                                           status='completed', start_time=same_time) for i in range(4)])
+        db.session.commit()
+        expected = [row.id for row in AgentExecution.query.order_by(AgentExecution.start_time.desc(),
+                                                                     AgentExecution.id.desc())]
+
+    pages = _walk(client, auth_headers, f'/agents/{agent_id}/executions', limit=2, fields='id,status')
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [item['id'] for page in pages for item in page] == expected
+    assert all(set(item) == {'id', 'status'} for page in pages for item in page)
+
+
+def test_agent_cursor_pages(client, auth_headers):
+    ids = []
+    for i in range(3):
+        response = client.post('/agents/', json={'name': f'agent-{i}', 'system_prompt': '你是助手'},
+                               headers=auth_headers)
+        ids.append(response.get_json()['id'])
+
+    pages = _walk(client, auth_headers, '/agents/', limit=2, fields='id,name')
+    assert sorted(item['id'] for page in pages for item in page) == ids
+    assert [len(page) for page in pages] == [2, 1]
+
+
+def test_invalid_cursor_and_fields_are_rejected(client, auth_headers, agent_id):
+    url = f'/agents/{agent_id}/executions'
+    assert client.get(url, query_string={'cursor': 'not-a-cursor'}, headers=auth_headers).status_code == 400
+    assert client.get(url, query_string={'limit': 2, 'fields': 'id,password'}, headers=auth_headers).status_code == 400
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from app.models import User
+from app.services import password_hasher
+from config import Config
+
+
+@pytest.fixture
+def register(monkeypatch, client):
+    monkeypatch.setattr(Config, 'BCRYPT_LOG_ROUNDS', 4)
+
+    def register(password='password123'):
+        response = client.post('/auth/register', json={'username': 'bob', 'email': 'bob@example.com',
+                                                       'password': password})
+        assert response.status_code == 201, response.get_json()
+
+    return register
+
+
+def _login(client, password):
+    return client.post('/auth/login', json={'username_or_email': 'bob', 'password': password})
+
+
+def _stored_hash(app):
+    with app.app_context():
+        return User.query.filter_by(username='bob').one().password_hash
+
+
+def test_login_rehashes_when_cost_changes(monkeypatch, app, client, register):
+    """调整 BCRYPT_LOG_ROUNDS 后，登录成功时按新 cost 重新哈希；密码错误时不改动"""
+    register()
+    old_hash = _stored_hash(app)
+    assert old_hash.startswith('$2b$04$')
+
+    monkeypatch.setattr(Config, 'BCRYPT_LOG_ROUNDS', 5)
+    assert _login(client, 'wrong-password').status_code == 401
+    assert _stored_hash(app) == old_hash
+
+    assert _login(client, 'password123').status_code == 200
+    new_hash = _stored_hash(app)
+    assert new_hash.startswith('$2b$05$')
+    assert _login(client, 'password123').status_code == 200
+    assert _stored_hash(app) == new_hash
+
+
+def test_login_fails_fast_when_hash_queue_is_full(monkeypatch, app, client, register):
+    """哈希队列已满时返回 503 + Retry-After，而不是占住请求线程排队"""
+    register()
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_USE_PROCESS_POOL', True)
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_TIMEOUT', 0.1)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(password_hasher, '_slots', slots)
+    slots.acquire()
+    try:
+        response = _login(client, 'password123')
+    finally:
+        slots.release()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert _login(client, 'password123').status_code == 200
@@ -0,0 +1,102 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from dashscope import Generation
+
+from app.models import AgentExecution
+from app.services.execution_queue import execution_queue
+from app.services.identity_service import identity_cache
+from app.services.rate_limiter import rate_limiter
+from app.testutils.conftest import fake_generation_call
+from config import Config
+
+
+@pytest.fixture
+def limited(monkeypatch, app):
+    monkeypatch.setattr(Config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(rate_limiter, '_backend', None)
+
+
+def test_async_execution_holds_slot_until_job_finishes(monkeypatch, limited, client, auth_headers, agent_id):
+    """async=true 的 202 不释放在途槽位，任务执行结束后才释放"""
+    release = threading.Event()
+
+    def blocking_call(*args, **kwargs):
+        release.wait(5)
+        return fake_generation_call(*args, **kwargs)
+
+    monkeypatch.setattr(Generation, 'call', staticmethod(blocking_call))
+    max_in_flight = Config.RATE_LIMIT_TIERS['free']['max_in_flight']
+    for i in range(max_in_flight):
+        response = client.post(f'/agents/{agent_id}/execute', json={'input': f'q{i}', 'async': True},
+                               headers=auth_headers)
+        assert response.status_code == 202
+    response = client.post(f'/agents/{agent_id}/execute', json={'input': 'one more', 'async': True},
+                           headers=auth_headers)
+    assert response.status_code == 429
+
+    release.set()
+    execution_queue._queue.join()
+    response = client.post(f'/agents/{agent_id}/execute', json={'input': 'after'}, headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_batch_over_token_budget_is_rejected(limited, app, client, auth_headers, agent_id):
+    """整批预估 token（输入 + max_tokens）超过每分钟限额时整批拒绝，不创建执行记录"""
+    tpm = Config.RATE_LIMIT_TIERS['free']['tokens_per_minute']
+    items = tpm // 1000 + 1  # 默认 max_tokens 为 1000
+    response = client.post(f'/agents/{agent_id}/batch', json={'inputs': ['hi'] * items}, headers=auth_headers)
+    assert response.status_code == 400
+    with app.app_context():
+        assert AgentExecution.query.filter_by(input='hi').count() == 0
+
+
+def test_batch_debits_tokens_after_identity_cache_expires(monkeypatch, limited, client, auth_headers, agent_id):
+    """批量执行中用户身份缓存过期：工作线程仍能查询用户等级，按实际用量扣减 token 桶"""
+    def expiring_call(*args, **kwargs):
+        identity_cache.clear()  # 模拟执行期间缓存条目到期，记录用量时需回查数据库
+        return SimpleNamespace(status_code=200, code='', message='', output=SimpleNamespace(text='ok'),
+                               usage=SimpleNamespace(input_tokens=5, output_tokens=2000))
+
+    monkeypatch.setattr(Generation, 'call', staticmethod(expiring_call))
+    inputs = ['第一条', '第二条', '第三条']
+    response = client.post(f'/agents/{agent_id}/batch', json={'inputs': inputs}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('"completed"') == len(inputs)
+
+    tpm = Config.RATE_LIMIT_TIERS['free']['tokens_per_minute']
+    tokens, ts = rate_limiter.backend._buckets.get('rl:tok:user:1')
+    tokens = min(tpm, tokens + (time.monotonic() - ts) * tpm / 60.0)
+    assert tokens < tpm - 2005 * len(inputs) + 1000  # 预扣已全部退回，只剩实际用量（容许测试期间的补充）
+
+
+def test_batch_disconnect_waits_for_in_flight_items(monkeypatch, limited, app, client, auth_headers, agent_id):
+    """批量执行中途断开：已在调用中的条目不被标记失败，调用结束后写入实际结果"""
+    release = threading.Event()
+    started = threading.Barrier(3, timeout=5)  # 三条同时在调用中
+
+    def slow_call(*args, **kwargs):
+        started.wait()
+        if '慢' in kwargs['messages'][-1]['content']:
+            release.wait(5)
+        return fake_generation_call(*args, **kwargs)
+
+    monkeypatch.setattr(Generation, 'call', staticmethod(slow_call))
+    response = client.post(f'/agents/{agent_id}/batch', json={'inputs': ['快', '慢一', '慢二']},
+                           headers=auth_headers, buffered=False)
+    assert b'"completed"' in next(iter(response.response))
+    response.close()
+
+    with app.app_context():
+        assert {e.status for e in AgentExecution.query.filter(AgentExecution.input.startswith('慢'))} == {'running'}
+    release.set()
+    deadline = time.monotonic() + 5
+    with app.app_context():
+        while time.monotonic() < deadline:
+            statuses = {e.status for e in AgentExecution.query.filter(AgentExecution.input.startswith('慢'))}
+            if statuses == {'completed'}:
+                break
+            time.sleep(0.05)
+        assert statuses == {'completed'}
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from dashscope import Generation
+
+from app.models import AgentExecution
+from app.testutils.conftest import REPLY, fake_generation_call
+
+
+def test_disconnect_finalizes_execution(app, client, auth_headers, agent_id):
+    """SSE 读到一半断开：执行记录以 cancelled 结束，保留已下发的部分输出"""
+    response = client.post(f'/agents/{agent_id}/execute', json={'input': '讲个故事', 'stream': True},
+                           headers=auth_headers, buffered=False)
+    events = iter(response.response)
+    received = [next(events) for _ in range(3)]  # start + 两个 delta
+    assert b'event: start' in received[0]
+    response.close()
+
+    with app.app_context():
+        execution = AgentExecution.query.filter_by(input='讲个故事').one()
+        assert execution.status == 'cancelled'
+        assert execution.end_time is not None
+        assert execution.output == REPLY[:6]
+
+
+def test_stalled_stream_is_cut_at_deadline(monkeypatch, app, client, auth_headers, agent_id):
+    """上游首个分片之后停滞：到截止时间即结束，执行记录为 timeout 并保留部分输出"""
+    resume = threading.Event()
+
+    def stalled_call(*args, **kwargs):
+        chunks = fake_generation_call(*args, **kwargs)
+        yield next(chunks)
+        resume.wait(10)
+        yield from chunks
+
+    monkeypatch.setattr(Generation, 'call', staticmethod(stalled_call))
+    started = time.monotonic()
+    response = client.post(f'/agents/{agent_id}/execute', json={'input': '卡住', 'stream': True, 'timeout': 1},
+                           headers=auth_headers)
+    body = response.get_data(as_text=True)
+    elapsed = time.monotonic() - started
+    resume.set()
+
+    assert elapsed < 3
+    assert 'event: error' in body
+    with app.app_context():
+        execution = AgentExecution.query.filter_by(input='卡住').one()
+        assert execution.status == 'timeout'
+        assert execution.output == REPLY[:3]
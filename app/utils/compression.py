@@ -0,0 +1,79 @@
+import zlib
+from functools import wraps
+
+from flask import current_app, request
+
+from config import Config
+
+try:
+    import zstandard  # 可选依赖
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+def _choose_encoding():
+    """按 Accept-Encoding 协商编码，优先 zstd，其次 gzip；都不接受时返回 None"""
+    accepted = request.accept_encodings
+    candidates = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+    best = None
+    for encoding in candidates:
+        quality = accepted[encoding]
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=Config.COMPRESSION_ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(Config.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
+
+
+def _compress_stream(chunks, encoding):
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """对 200 响应按协商结果压缩；普通响应需超过 COMPRESSION_MIN_SIZE，流式响应逐块压缩"""
+    if not Config.COMPRESSION_ENABLED or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.direct_passthrough:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < Config.COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(b''.join(_compress_stream([body], encoding)))
+
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的表示与原表示字节不同，强 ETag 降级为弱 ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compressed(view):
+    """视图装饰器：大列表、历史和导出类接口按 Accept-Encoding 压缩响应"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return compress_response(current_app.make_response(view(*args, **kwargs)))
+
+    return wrapper
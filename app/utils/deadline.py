@@ -0,0 +1,100 @@
+import asyncio
+import queue
+import threading
+import time
+
+from config import Config
+
+
+class DeadlineExceeded(TimeoutError):
+    """执行超过截止时间"""
+
+
+class Deadline:
+    """请求级截止时间：由执行入口创建，沿调用链传递到模型调用"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls, requested=None):
+        """以 AGENT_EXECUTION_TIMEOUT 为上限，客户端可通过 timeout 参数（秒）缩短"""
+        limit = Config.AGENT_EXECUTION_TIMEOUT
+        if requested in (None, ''):
+            return cls(limit)
+        try:
+            requested = float(requested)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid timeout")
+        return cls(min(limit, requested) if requested > 0 else limit)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"执行超时（超过 {self.seconds:g} 秒）")
+
+    def timeout(self, cap):
+        """本次网络调用可用的超时：剩余时间与 cap 取较小值"""
+        return min(self.remaining(), cap)
+
+
+_DONE = object()
+
+
+def iter_within(iterator, deadline: Deadline):
+    """在读取线程中迭代上游分片，每个分片最多等待截止时间的剩余部分
+
+    上游停滞时在截止时间到达即抛出 DeadlineExceeded，不必等到读超时；
+    提前结束后由读取线程在当前读取返回后关闭 iterator，调用方不要再直接关闭它。
+    """
+    items = queue.Queue()
+    stopped = threading.Event()
+
+    def read():
+        try:
+            for item in iterator:
+                items.put((item, None))
+                if stopped.is_set():
+                    break
+            items.put((_DONE, None))
+        except Exception as e:
+            items.put((_DONE, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=read, name='stream-reader', daemon=True).start()
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=deadline.remaining())
+            except queue.Empty:
+                raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）")
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+async def aiter_within(iterator, deadline: Deadline):
+    """iter_within 的协程版本：每个分片最多等待截止时间的剩余部分"""
+    while True:
+        try:
+            item = await asyncio.wait_for(anext(iterator), timeout=deadline.remaining())
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            if not deadline.expired():
+                raise  # 上游自身的超时
+            raise DeadlineExceeded(f"执行超时（超过 {deadline.seconds:g} 秒）") from None
+        yield item
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+
+try:
+    import httpx  # 可选依赖，仅 ASGI 模式需要
+except ImportError:  # pragma: no cover
+    httpx = None
+
+_session = None
+_session_lock = threading.Lock()
+# 事件循环 -> httpx.AsyncClient，AsyncClient 不能跨事件循环使用
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def build_session(pool_size, retries, backoff):
+    """创建带连接池、长连接的 requests.Session
+
+    只重试建立连接失败（请求尚未发出，不会重复计费），退避带抖动。
+    已发出的请求无论读超时还是返回 429/5xx 都不在这里重放：上游可能已经处理并计费，
+    而且 Retry-After 等待不受请求截止时间约束；这类失败交给模型路由切换备用后端，由它在截止时间内决定是否重试。
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        redirect=0,
+        other=0,
+        allowed_methods=frozenset(['GET', 'POST']),
+        backoff_factor=backoff,
+        backoff_jitter=backoff,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_model_session():
+    """进程内共享的模型调用会话，所有出站模型请求复用同一连接池"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session(
+                    pool_size=Config.MODEL_HTTP_POOL_SIZE,
+                    retries=Config.MODEL_HTTP_RETRIES,
+                    backoff=Config.MODEL_HTTP_BACKOFF
+                )
+    return _session
+
+
+def model_request_timeout():
+    """(连接超时, 读超时)，供 requests 直接使用"""
+    return Config.MODEL_HTTP_CONNECT_TIMEOUT, Config.MODEL_HTTP_READ_TIMEOUT
+
+
+def get_async_model_client():
+    """当前事件循环共享的 httpx.AsyncClient（ASGI 模式），连接数上限为 ASYNC_MODEL_HTTP_POOL_SIZE"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=Config.ASYNC_MODEL_HTTP_POOL_SIZE,
+                max_keepalive_connections=Config.ASYNC_MODEL_HTTP_POOL_SIZE
+            ),
+            timeout=async_request_timeout(),
+            # 只重试建立连接失败，已发出的请求不重试，避免重复计费
+            transport=httpx.AsyncHTTPTransport(retries=Config.MODEL_HTTP_RETRIES)
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def async_request_timeout(read_timeout=None):
+    """httpx 的超时设置：read_timeout 为空时使用 MODEL_HTTP_READ_TIMEOUT"""
+    return httpx.Timeout(read_timeout or Config.MODEL_HTTP_READ_TIMEOUT, connect=Config.MODEL_HTTP_CONNECT_TIMEOUT)
+
+
+async def close_async_model_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,73 @@
+import time
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+from app.utils.metrics import JSON_SERIALIZATION_LATENCY
+
+try:
+    import orjson  # 可选依赖
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """记录 jsonify 序列化耗时的 JSON Provider"""
+
+    @staticmethod
+    def default(o):
+        # 与 orjson 保持一致：datetime 输出 ISO 8601，而不是 Flask 默认的 HTTP 日期
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            JSON_SERIALIZATION_LATENCY.observe(time.perf_counter() - start)
+
+
+class OrjsonProvider(TimedJSONProvider):
+    """基于 orjson 的 JSON Provider：datetime 等类型在 C 层直接序列化，响应体不经过 str 中转"""
+
+    def _option(self, sort_keys=False, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _dump_bytes(self, obj, sort_keys=False, indent=False, default=None):
+        start = time.perf_counter()
+        try:
+            return orjson.dumps(obj, default=default or self.default, option=self._option(sort_keys, indent))
+        finally:
+            JSON_SERIALIZATION_LATENCY.observe(time.perf_counter() - start)
+
+    def dumps(self, obj, **kwargs):
+        # 自定义 cls 等 orjson 不支持的参数时退回标准库
+        if set(kwargs) - {'sort_keys', 'indent', 'ensure_ascii', 'default'}:
+            return super().dumps(obj, **kwargs)
+        return self._dump_bytes(obj, kwargs.get('sort_keys', self.sort_keys), bool(kwargs.get('indent')),
+                                kwargs.get('default')).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self._app.debug if self.compact is None else not self.compact
+        body = self._dump_bytes(obj, self.sort_keys, indent)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def create_json_provider(app, name='orjson'):
+    """按配置选择 JSON Provider；未安装 orjson 时使用标准库实现"""
+    if name == 'orjson' and orjson is not None:
+        return OrjsonProvider(app)
+    return TimedJSONProvider(app)
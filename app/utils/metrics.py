@@ -0,0 +1,111 @@
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess, REGISTRY)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+# 模型调用普遍在秒级，请求/DB/序列化在毫秒级，分别使用不同的桶
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_MODEL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP请求耗时',
+    ['blueprint', 'endpoint', 'method', 'status'],
+    buckets=_FAST_BUCKETS + _MODEL_BUCKETS[5:]
+)
+MODEL_CALL_LATENCY = Histogram(
+    'model_call_duration_seconds', '模型调用耗时（流式为整段输出耗时）',
+    ['model', 'stream'], buckets=_MODEL_BUCKETS
+)
+MODEL_FIRST_TOKEN_LATENCY = Histogram(
+    'model_time_to_first_token_seconds', '流式调用首个分片耗时',
+    ['model'], buckets=_MODEL_BUCKETS
+)
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', '单条SQL执行耗时', buckets=_FAST_BUCKETS)
+JSON_SERIALIZATION_LATENCY = Histogram('json_serialization_duration_seconds', 'JSON序列化耗时', buckets=_FAST_BUCKETS)
+UPSTREAM_ERRORS = Counter('upstream_errors_total', '上游模型调用失败次数', ['model', 'kind'])
+UPSTREAM_TIMEOUTS = Counter('upstream_timeouts_total', '上游模型调用超时次数', ['model'])
+EXECUTIONS_IN_FLIGHT = Gauge(
+    'executions_in_flight', '进行中的模型执行数', ['mode'], multiprocess_mode='livesum'
+)
+MODEL_TOKENS = Counter('model_tokens_total', '模型 token 用量', ['model', 'kind'])
+MODEL_FAILOVERS = Counter('model_failovers_total', '模型调用切换到备用后端的次数', ['model', 'backend'])
+MODEL_HEDGES = Counter('model_hedged_requests_total', '对冲请求次数（fired 为发出，won 为对冲请求先返回）',
+                       ['model', 'outcome'])
+CIRCUIT_BREAKER_TRANSITIONS = Counter('circuit_breaker_transitions_total', '熔断器状态切换次数', ['backend', 'state'])
+CIRCUIT_BREAKER_REJECTIONS = Counter('circuit_breaker_rejections_total', '熔断打开期间被直接拒绝的调用次数', ['backend'])
+AGENT_EXECUTIONS_PURGED = Counter('agent_executions_purged_total', '后台清理已删除Agent时删除的执行记录数')
+
+
+def model_label(model):
+    """Agent 的 model 由用户任意填写，未知模型统一记为 other，避免标签取值（多进程模式下还有文件数）无限增长"""
+    if model in Config.MODEL_ROUTES or any(model == item['id'] for item in Config.AVAILABLE_MODELS):
+        return model
+    for routes in Config.MODEL_ROUTES.values():
+        if any(model == backend_model for _, backend_model in routes):
+            return model
+    return 'other'
+
+
+def record_upstream_error(model, error):
+    """按异常类型区分超时和其他错误"""
+    model = model_label(model)
+    if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower() \
+            or 'timed out' in str(error).lower():
+        UPSTREAM_TIMEOUTS.labels(model=model).inc()
+    else:
+        UPSTREAM_ERRORS.labels(model=model, kind=type(error).__name__).inc()
+
+
+def record_tokens(model, prompt_tokens, completion_tokens):
+    model = model_label(model)
+    if prompt_tokens:
+        MODEL_TOKENS.labels(model=model, kind='prompt').inc(prompt_tokens)
+    if completion_tokens:
+        MODEL_TOKENS.labels(model=model, kind='completion').inc(completion_tokens)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERY_LATENCY.observe(time.perf_counter() - conn.info['query_start_time'].pop())
+
+
+def _collect():
+    """gunicorn 等多进程部署设置 PROMETHEUS_MULTIPROC_DIR 后，汇总所有 worker 的指标"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def init_metrics(app):
+    @app.before_request
+    def _start_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('request_start_time', None)
+        if start is not None:
+            REQUEST_LATENCY.labels(
+                blueprint=request.blueprint or 'app',
+                endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                method=request.method,
+                status=response.status_code
+            ).observe(time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(_collect(), mimetype=CONTENT_TYPE_LATEST)
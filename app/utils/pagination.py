@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp, row_id):
+    """把 (时间, id) 编码为不透明游标"""
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (datetime, id)；格式非法时抛出 ValueError"""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(raw):
+    if raw is None or raw == '':
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_fields(raw, allowed):
+    """解析 fields=a,b,c 参数，只允许模型声明的可投影字段"""
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def keyset_page(query, time_column, id_column, limit, cursor=None):
+    """按 (time, id) 倒序做游标分页，返回 (items, next_cursor)"""
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(
+            (time_column < timestamp) | ((time_column == timestamp) & (id_column < row_id))
+        )
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, time_column.key), last.id)
+    return rows, next_cursor
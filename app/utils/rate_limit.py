@@ -0,0 +1,76 @@
+from functools import wraps
+
+from flask import g, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from app.services.rate_limiter import rate_limiter, RateLimitExceeded
+from config import Config
+
+
+def admit_request():
+    """按当前请求的用户（未登录时按 IP）申请准入，返回 (在途槽位 key, 超限时的 429 响应)"""
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    subject = f"user:{user_id}" if user_id else f"ip:{request.remote_addr}"
+
+    try:
+        return rate_limiter.admit(subject, rate_limiter.tier_for(user_id)), None
+    except RateLimitExceeded as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return None, (response, 429)
+
+
+def hand_off_slot():
+    """取走当前请求占用的在途槽位，之后由调用方负责释放（例如异步入队的任务执行结束时）；未限流时返回 None"""
+    return g.pop('rate_limit_slot', None)
+
+
+def rate_limited(view):
+    """模型调用类接口的准入控制：超限时直接返回 429 + Retry-After"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.RATE_LIMIT_ENABLED:
+            return view(*args, **kwargs)
+
+        slot_key, rejected = admit_request()
+        if rejected is not None:
+            return rejected
+
+        g.rate_limit_slot = slot_key
+        try:
+            response = view(*args, **kwargs)
+        except Exception:
+            if g.pop('rate_limit_slot', None):
+                rate_limiter.release(slot_key)
+            raise
+
+        response = make_response(response)
+        if g.pop('rate_limit_slot', None):
+            # 流式响应在连接关闭时才释放在途槽位
+            response.call_on_close(lambda: rate_limiter.release(slot_key))
+        return response
+
+    return wrapper
+
+
+def login_concurrency_limited(view):
+    """限制单个 IP 同时进行的登录/注册请求数，防止哈希计算被单一来源占满"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.RATE_LIMIT_ENABLED:
+            return view(*args, **kwargs)
+
+        slot_key = f"rl:login:{request.remote_addr}"
+        if not rate_limiter.backend.acquire_slot(slot_key, Config.LOGIN_MAX_CONCURRENT_PER_IP):
+            response = jsonify({"error": "登录请求过于频繁，请稍后重试", "retry_after": 1})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        try:
+            return view(*args, **kwargs)
+        finally:
+            rate_limiter.release(slot_key)
+
+    return wrapper
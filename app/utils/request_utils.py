@@ -0,0 +1,5 @@
+def body_flag(data, name):
+    """读取请求体中的布尔开关，兼容 true/"true"/1 等写法"""
+    if not data:
+        return False
+    return str(data.get(name, '')).lower() in ('true', '1')
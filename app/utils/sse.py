@@ -0,0 +1,75 @@
+import json
+
+from flask import Response, request, stream_with_context
+
+from app.utils.request_utils import body_flag
+
+
+def wants_event_stream(data):
+    """请求体 stream=true 或 Accept: text/event-stream 时启用流式输出"""
+    if body_flag(data, 'stream'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+
+def format_sse(data, event=None):
+    """按 Server-Sent Events 协议编码单条事件"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+def execution_event_stream(execution, chunks):
+    """把执行记录和增量文本迭代器包装成 SSE 响应"""
+
+    def generate():
+        yield format_sse({"execution_id": execution.id, "status": execution.status}, event='start')
+        try:
+            for chunk in chunks:
+                yield format_sse({"delta": chunk}, event='delta')
+            yield format_sse({
+                "execution_id": execution.id,
+                "status": execution.status,
+                "output": execution.output
+            }, event='done')
+        except Exception as e:
+            # 执行记录已被标记为 failed 或 timeout
+            status = execution.status if execution.status in ('failed', 'timeout') else 'failed'
+            yield format_sse({"execution_id": execution.id, "status": status, "error": str(e)}, event='error')
+        finally:
+            # 客户端断开时 generate 在 yield 处被关闭，随即关闭 chunks：断开上游并结束执行记录
+            chunks.close()
+
+    return event_stream_response(stream_with_context(generate()))
+
+
+def event_stream_response(body=()):
+    """SSE 响应；ASGI 模式下不传 body，只取经过 after_request 处理的状态和响应头，事件由协程逐条下发"""
+    return Response(
+        body,
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止反向代理缓冲，保证首个分片立即下发
+        }
+    )
+
+
+async def async_execution_events(state, chunks):
+    """execution_event_stream 的协程版本（ASGI 模式），事件顺序和内容与同步版本一致"""
+    yield format_sse({"execution_id": state.execution_id, "status": state.status}, event='start')
+    try:
+        async for chunk in chunks:
+            yield format_sse({"delta": chunk}, event='delta')
+        yield format_sse({
+            "execution_id": state.execution_id,
+            "status": state.status,
+            "output": state.output
+        }, event='done')
+    except Exception as e:
+        status = state.status if state.status in ('failed', 'timeout') else 'failed'
+        yield format_sse({"execution_id": state.execution_id, "status": status, "error": str(e)}, event='error')
+    finally:
+        # 客户端断开时由 ASGI 层 aclose，随即关闭 chunks：断开上游并结束执行记录
+        await chunks.aclose()
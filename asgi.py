@@ -0,0 +1,5 @@
+"""ASGI 入口：uvicorn asgi:app --workers 4"""
+from app.asgi import create_asgi_app
+from run import app as flask_app
+
+app = create_asgi_app(flask_app)
@@ -0,0 +1,70 @@
+"""以压测配置启动应用：临时目录下的 SQLite（或 BENCH_DATABASE_URL 指定的本地 MySQL），
+每个响应附带 X-DB-Queries 头，记录本次请求执行的 SQL 条数。
+
+    python -m benchmarks.bench_app --port 5055
+"""
+import argparse
+import logging
+import os
+import tempfile
+
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server
+
+from config import Config
+
+# 压测库放在系统临时目录（绝对路径），避免相对路径被 Flask 解析到 instance/ 下
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'agent-bench.db')
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.getenv('BENCH_DATABASE_URL', DEFAULT_DATABASE_URL)
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else Config.SQLALCHEMY_ENGINE_OPTIONS
+    SECRET_KEY = Config.SECRET_KEY or 'bench-secret'
+    RATE_LIMIT_ENABLED = False
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    try:
+        g.db_queries = g.get('db_queries', 0) + 1
+    except RuntimeError:
+        pass  # 请求上下文之外（后台线程）的查询不计入
+
+
+def create_bench_app(reset=True):
+    from app import create_app
+    from app.extensions import db
+
+    app = create_app(BenchConfig)
+
+    @app.after_request
+    def _attach_query_count(response):
+        response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+        return response
+
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以压测配置启动应用')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--keep-data', action='store_true', help='不清空已有数据')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # 关闭逐请求访问日志
+    app = create_bench_app(reset=not args.keep_data)
+    server = make_server(args.host, args.port, app, threaded=True)
+    print(f"bench app listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
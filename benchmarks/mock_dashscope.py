@@ -0,0 +1,151 @@
+"""本地模拟 DashScope 文本生成接口，用于离线压测。
+
+支持普通/流式（SSE）两种返回、text/message 两种 result_format，
+延迟服从对数正态分布，可配置错误率和限流比例。
+
+    python -m benchmarks.mock_dashscope --port 8089 --latency-ms 800 --error-rate 0.01
+"""
+import argparse
+import json
+import math
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "这是模拟的通义千问回复，用于压测。The quick brown fox jumps over the lazy dog. "
+
+
+class MockSettings:
+    latency_ms = 800.0      # 整体延迟中位数
+    latency_sigma = 0.5     # 对数正态分布的 sigma，越大长尾越明显
+    first_token_ms = 200.0  # 流式首个分片延迟中位数
+    tokens_per_sec = 50.0
+    output_tokens = 60
+    error_rate = 0.0        # 返回 500 的比例
+    throttle_rate = 0.0     # 返回 429 的比例
+
+
+def _sample(median_ms):
+    return random.lognormvariate(math.log(max(median_ms, 1.0)), MockSettings.latency_sigma) / 1000.0
+
+
+def _reply_chunks():
+    words = (REPLY * (MockSettings.output_tokens // 20 + 1)).split(' ')[:MockSettings.output_tokens]
+    return [word + ' ' for word in words]
+
+
+class MockDashScopeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        request_id = str(uuid.uuid4())
+        messages = body.get('input', {}).get('messages', [])
+        parameters = body.get('parameters', {})
+        input_tokens = sum(len(m.get('content', '')) for m in messages) // 2 + 1
+
+        roll = random.random()
+        if roll < MockSettings.throttle_rate:
+            time.sleep(0.01)
+            return self._send_json(429, {"code": "Throttling", "message": "Requests rate limit exceeded",
+                                         "request_id": request_id})
+        if roll < MockSettings.throttle_rate + MockSettings.error_rate:
+            time.sleep(_sample(MockSettings.latency_ms))
+            return self._send_json(500, {"code": "InternalError", "message": "mock upstream failure",
+                                         "request_id": request_id})
+
+        streaming = 'text/event-stream' in self.headers.get('Accept', '') \
+            or self.headers.get('X-DashScope-SSE') == 'enable'
+        if streaming:
+            return self._stream(request_id, parameters, input_tokens)
+
+        time.sleep(_sample(MockSettings.latency_ms))
+        text = ''.join(_reply_chunks())
+        usage = {"input_tokens": input_tokens, "output_tokens": MockSettings.output_tokens,
+                 "total_tokens": input_tokens + MockSettings.output_tokens}
+        self._send_json(200, {"output": self._output(text, 'stop', parameters), "usage": usage,
+                              "request_id": request_id})
+
+    def _stream(self, request_id, parameters, input_tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream;charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        time.sleep(_sample(MockSettings.first_token_ms))
+        chunks = _reply_chunks()
+        incremental = parameters.get('incremental_output', False)
+        sent = ''
+        for index, chunk in enumerate(chunks, start=1):
+            sent += chunk
+            finished = index == len(chunks)
+            usage = {"input_tokens": input_tokens, "output_tokens": index, "total_tokens": input_tokens + index}
+            data = {
+                "output": self._output(chunk if incremental else sent, 'stop' if finished else 'null', parameters),
+                "usage": usage,
+                "request_id": request_id
+            }
+            event = f"id:{index}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+            self._write_chunk(event.encode('utf-8'))
+            if not finished:
+                time.sleep(1.0 / MockSettings.tokens_per_sec)
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def _output(text, finish_reason, parameters):
+        if parameters.get('result_format') == 'message':
+            return {"choices": [{"finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": text}}]}
+        return {"text": text, "finish_reason": finish_reason}
+
+
+def build_server(host='127.0.0.1', port=8089):
+    server = ThreadingHTTPServer((host, port), MockDashScopeHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 DashScope 生成接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=MockSettings.latency_ms)
+    parser.add_argument('--latency-sigma', type=float, default=MockSettings.latency_sigma)
+    parser.add_argument('--first-token-ms', type=float, default=MockSettings.first_token_ms)
+    parser.add_argument('--tokens-per-sec', type=float, default=MockSettings.tokens_per_sec)
+    parser.add_argument('--output-tokens', type=int, default=MockSettings.output_tokens)
+    parser.add_argument('--error-rate', type=float, default=MockSettings.error_rate)
+    parser.add_argument('--throttle-rate', type=float, default=MockSettings.throttle_rate)
+    args = parser.parse_args()
+
+    MockSettings.latency_ms = args.latency_ms
+    MockSettings.latency_sigma = args.latency_sigma
+    MockSettings.first_token_ms = args.first_token_ms
+    MockSettings.tokens_per_sec = args.tokens_per_sec
+    MockSettings.output_tokens = args.output_tokens
+    MockSettings.error_rate = args.error_rate
+    MockSettings.throttle_rate = args.throttle_rate
+
+    server = build_server(args.host, args.port)
+    print(f"mock dashscope listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""离线压测：启动模拟 DashScope 和应用，在给定并发下驱动各个接口，输出吞吐、延迟分位数和每请求 SQL 数。
+
+    python -m benchmarks.run_benchmark --concurrency 16 --requests 400
+    python -m benchmarks.run_benchmark --scenarios execute,execute_stream --compare benchmarks/results/<旧结果>.json
+
+结果以 JSON 写入 benchmarks/results/，文件名包含 git 提交号，便于跨提交对比。
+整个压测受 --timeout 限制；无论正常结束、超时还是被中断，都会关闭启动的应用和模拟服务。
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+SCENARIOS = ('login', 'execute', 'execute_stream', 'chat', 'list_agents', 'list_executions')
+PASSWORD = 'bench-password'
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'agent-bench.db')
+
+
+class BenchTimeout(Exception):
+    pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程 {process.args} 启动失败，退出码 {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口 {port} 在 {timeout}s 内未就绪")
+
+
+def _start(args, env):
+    """子进程放在独立进程组中，关闭时连同它派生的进程（如口令哈希进程池）一起结束"""
+    return subprocess.Popen([sys.executable, '-m', *args], cwd=ROOT, env=env, start_new_session=True)
+
+
+def _shutdown(processes, timeout=10):
+    for process in processes:
+        _signal_group(process, signal.SIGTERM)
+    deadline = time.time() + timeout
+    for process in processes:
+        try:
+            process.wait(timeout=max(0.1, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            pass
+        # 主进程已退出时组内仍可能残留子进程，统一强制结束
+        _signal_group(process, signal.SIGKILL)
+        process.wait()
+
+
+def _signal_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _on_timeout(signum, frame):
+    raise BenchTimeout()
+
+
+def _on_terminate(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class BenchClient:
+    """每个压测线程复用一个 keep-alive 会话"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def call(self, method, path, token=None, stream=False, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, headers=headers, stream=stream,
+                                        timeout=self.timeout, **kwargs)
+        first_byte = None
+        if stream:
+            for _ in response.iter_content(chunk_size=None):
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+        else:
+            _ = response.content
+        elapsed = time.perf_counter() - start
+        return response, elapsed, first_byte
+
+
+def seed(client, users):
+    """注册用户、写入API密钥并各创建一个Agent，返回 [(username, token, agent_id)]"""
+    seeded = []
+    for i in range(users):
+        username = f'bench{i}'
+        client.call('POST', '/auth/register', json={
+            'username': username, 'email': f'{username}@bench.local', 'password': PASSWORD})
+        response, _, _ = client.call('POST', '/auth/login', json={'username_or_email': username, 'password': PASSWORD})
+        token = response.json()['access_token']
+        client.call('POST', '/auth/center', token=token, json={'tongyi_api_key': 'sk-bench'})
+        response, _, _ = client.call('POST', '/agents/', token=token, json={
+            'name': f'bench-agent-{i}', 'system_prompt': '你是一个压测助手', 'temperature': 0.7, 'max_tokens': 200})
+        seeded.append((username, token, response.json()['id']))
+    return seeded
+
+
+def _scenario_request(name, client, user, index):
+    username, token, agent_id = user
+    if name == 'login':
+        return client.call('POST', '/auth/login', json={'username_or_email': username, 'password': PASSWORD})
+    if name == 'execute':
+        return client.call('POST', f'/agents/{agent_id}/execute', token=token, json={'input': f'问题 {index}'})
+    if name == 'execute_stream':
+        return client.call('POST', f'/agents/{agent_id}/execute', token=token, stream=True,
+                           json={'input': f'问题 {index}', 'stream': True})
+    if name == 'chat':
+        return client.call('POST', '/api/chat', json={'session_id': f'bench-{index}', 'input': f'问题 {index}'})
+    if name == 'list_agents':
+        return client.call('GET', '/agents/', token=token)
+    if name == 'list_executions':
+        return client.call('GET', f'/agents/{agent_id}/executions', token=token, params={'limit': 50})
+    raise ValueError(f'unknown scenario {name}')
+
+
+def run_scenario(name, client, users, total, concurrency):
+    samples = []
+    lock = threading.Lock()
+
+    def worker(index):
+        user = users[index % len(users)]
+        try:
+            response, elapsed, first_byte = _scenario_request(name, client, user, index)
+            status, queries = response.status_code, response.headers.get('X-DB-Queries')
+        except Exception:
+            elapsed, first_byte, status, queries = None, None, 'error', None
+        with lock:
+            samples.append((elapsed, first_byte, status, queries))
+
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        list(executor.map(worker, range(total)))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)  # 超时中止时不再等待排队中的请求
+    wall = time.perf_counter() - started
+
+    ok = sorted(s[0] * 1000 for s in samples if isinstance(s[2], int) and s[2] < 400)
+    ttfb = sorted(s[1] * 1000 for s in samples if s[1] is not None)
+    queries = [int(s[3]) for s in samples if s[3] is not None]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+
+    result = {
+        'requests': total,
+        'concurrency': concurrency,
+        'duration_s': round(wall, 3),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else None,
+        'errors': total - len(ok),
+        'status_codes': statuses,
+        'p50_ms': _round(_percentile(ok, 50)),
+        'p95_ms': _round(_percentile(ok, 95)),
+        'p99_ms': _round(_percentile(ok, 99)),
+        'mean_ms': _round(sum(ok) / len(ok)) if ok else None,
+        'db_queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+    if ttfb:
+        result['ttfb_p50_ms'] = _round(_percentile(ttfb, 50))
+        result['ttfb_p95_ms'] = _round(_percentile(ttfb, 95))
+    return result
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def compare(current, baseline_path, threshold):
+    """与历史结果对比，延迟上升或吞吐下降超过阈值视为回归"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+    regressions = []
+    print(f"\n对比基线 {baseline['meta'].get('git_commit')} ({baseline_path})")
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('p99_ms', True),
+                                        ('throughput_rps', False), ('db_queries_per_request', True)):
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = ''
+            if (change > threshold) if higher_is_worse else (change < -threshold):
+                flag = '  <-- regression'
+                regressions.append(f'{name}.{metric}')
+            print(f"  {name:16s} {metric:24s} {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线压测（模拟 DashScope）')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL', DEFAULT_DATABASE_URL))
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--first-token-ms', type=float, default=100)
+    parser.add_argument('--tokens-per-sec', type=float, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='结果文件路径，默认 benchmarks/results/<时间>-<提交>.json')
+    parser.add_argument('--compare', help='对比的历史结果文件')
+    parser.add_argument('--threshold', type=float, default=0.1, help='回归判定阈值（比例）')
+    parser.add_argument('--timeout', type=int, default=600, help='整个压测的超时秒数，超时后中止并关闭子进程')
+    parser.add_argument('--request-timeout', type=float, default=30, help='单个请求的超时秒数')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    mock_port, app_port = _free_port(), _free_port()
+    mock_base = f'http://127.0.0.1:{mock_port}/api/v1'
+    env = dict(os.environ,
+               DASHSCOPE_HTTP_BASE_URL=mock_base,
+               TONGYI_API_URL=f'{mock_base}/services/aigc/text-generation/generation',
+               TONGYI_API_KEY='sk-bench',
+               BENCH_DATABASE_URL=args.database_url,
+               RATE_LIMIT_ENABLED='False',
+               PYTHONUNBUFFERED='1')
+
+    signal.signal(signal.SIGTERM, _on_terminate)  # 被 kill/timeout 结束时也走 finally 清理子进程
+    signal.signal(signal.SIGALRM, _on_timeout)
+    signal.alarm(args.timeout)
+
+    processes = []
+    try:
+        processes.append(_start(['benchmarks.mock_dashscope', '--port', str(mock_port),
+                                 '--latency-ms', str(args.latency_ms), '--first-token-ms', str(args.first_token_ms),
+                                 '--tokens-per-sec', str(args.tokens_per_sec), '--error-rate', str(args.error_rate),
+                                 '--throttle-rate', str(args.throttle_rate)], env))
+        processes.append(_start(['benchmarks.bench_app', '--port', str(app_port)], env))
+        _wait_for_port(mock_port, processes[0])
+        _wait_for_port(app_port, processes[1])
+        client = BenchClient(f'http://127.0.0.1:{app_port}', timeout=args.request_timeout)
+        users = seed(client, args.users)
+
+        results = {}
+        for name in scenarios:
+            results[name] = run_scenario(name, client, users, args.requests, args.concurrency)
+            r = results[name]
+            print(f"{name:16s} rps={r['throughput_rps']:<8} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                  f"p99={r['p99_ms']}ms errors={r['errors']} db/req={r['db_queries_per_request']}", flush=True)
+    except BenchTimeout:
+        print(f"压测超过 {args.timeout}s 未完成，已中止", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # 清理期间再次收到的信号（如 timeout 对进程组重发）不能打断关闭
+        _shutdown(processes)
+
+    report = {
+        'meta': {
+            'git_commit': _git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'database': args.database_url.split('://')[0],
+            'mock': {'latency_ms': args.latency_ms, 'first_token_ms': args.first_token_ms,
+                     'tokens_per_sec': args.tokens_per_sec, 'error_rate': args.error_rate,
+                     'throttle_rate': args.throttle_rate},
+            'users': args.users,
+        },
+        'scenarios': results,
+    }
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{report['meta']['git_commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"\n结果已写入 {output}")
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -38,6 +39,9 @@ class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     # 通义
     TONGYI_API_KEY = os.getenv('TONGYI_API_KEY')
+    TONGYI_API_URL = os.getenv(
+        'TONGYI_API_URL', 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+    )
     # 数据库配置
     SQLALCHEMY_DATABASE_URI = (
         f"{os.getenv('DB_ENGINE')}://"
@@ -57,4 +61,131 @@ class Config:
 
     # 业务配置
     MAX_AGENT_COUNT_PER_USER = int(os.getenv('MAX_AGENT_COUNT_PER_USER', '50'))
-    AGENT_EXECUTION_TIMEOUT = int(os.getenv('AGENT_EXECUTION_TIMEOUT', '30'))
\ No newline at end of file
+    AGENT_EXECUTION_TIMEOUT = int(os.getenv('AGENT_EXECUTION_TIMEOUT', '30'))
+
+    # 异步执行队列
+    EXECUTION_QUEUE_WORKERS = int(os.getenv('EXECUTION_QUEUE_WORKERS', '4'))
+    EXECUTION_QUEUE_MAXSIZE = int(os.getenv('EXECUTION_QUEUE_MAXSIZE', '1000'))
+    # 队列不持久：重启后遗留的 pending 任务重新入队，超过该秒数的不再执行、标记为 failed
+    EXECUTION_QUEUE_RECOVER_MAX_AGE = int(os.getenv('EXECUTION_QUEUE_RECOVER_MAX_AGE', '3600'))
+
+    # API密钥缓存
+    API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', '300'))
+    API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', '10000'))
+
+    # 上下文构建
+    CONTEXT_MAX_HISTORY_TURNS = int(os.getenv('CONTEXT_MAX_HISTORY_TURNS', '20'))
+    CONTEXT_TOKEN_CACHE_SIZE = int(os.getenv('CONTEXT_TOKEN_CACHE_SIZE', '50000'))
+
+    # 模型回复缓存
+    COMPLETION_CACHE_SIZE = int(os.getenv('COMPLETION_CACHE_SIZE', '2000'))
+    COMPLETION_CACHE_TTL = int(os.getenv('COMPLETION_CACHE_TTL', '3600'))
+
+    # 模型调用 HTTP 连接池
+    MODEL_HTTP_POOL_SIZE = int(os.getenv('MODEL_HTTP_POOL_SIZE', '20'))
+    MODEL_HTTP_CONNECT_TIMEOUT = float(os.getenv('MODEL_HTTP_CONNECT_TIMEOUT', '3'))
+    MODEL_HTTP_READ_TIMEOUT = float(os.getenv('MODEL_HTTP_READ_TIMEOUT', '60'))
+    # 只重试建立连接失败；429/5xx 由模型路由切换备用后端
+    MODEL_HTTP_RETRIES = int(os.getenv('MODEL_HTTP_RETRIES', '2'))
+    MODEL_HTTP_BACKOFF = float(os.getenv('MODEL_HTTP_BACKOFF', '0.5'))
+    # ASGI 模式（uvicorn asgi:app）：模型调用连接池上限、执行记录写入的异步数据库地址（默认由 SQLALCHEMY_DATABASE_URI 换成异步驱动）、同步部分使用的线程数
+    ASYNC_MODEL_HTTP_POOL_SIZE = int(os.getenv('ASYNC_MODEL_HTTP_POOL_SIZE', '1000'))
+    ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+    ASGI_THREAD_POOL_SIZE = int(os.getenv('ASGI_THREAD_POOL_SIZE', '64'))
+
+    # 批量执行
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '5000'))
+    BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+    BATCH_COMMIT_SIZE = int(os.getenv('BATCH_COMMIT_SIZE', '50'))
+
+    # 限流（RATE_LIMIT_STORAGE_URL 为 redis:// 时多进程共享限额）
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMIT_STORAGE_URL = os.getenv('RATE_LIMIT_STORAGE_URL', 'memory://')
+    # memory:// 时进程内最多保留的限流桶数（按 LRU 淘汰）
+    RATE_LIMIT_MEMORY_MAX_KEYS = int(os.getenv('RATE_LIMIT_MEMORY_MAX_KEYS', '100000'))
+    RATE_LIMIT_TIERS = json.loads(os.getenv('RATE_LIMIT_TIERS', '{}')) or {
+        'anonymous': {'requests_per_minute': 10, 'tokens_per_minute': 5000, 'max_in_flight': 2},
+        'free': {'requests_per_minute': 30, 'tokens_per_minute': 20000, 'max_in_flight': 3},
+        'pro': {'requests_per_minute': 120, 'tokens_per_minute': 100000, 'max_in_flight': 10},
+        'admin': {'requests_per_minute': 600, 'tokens_per_minute': 500000, 'max_in_flight': 50},
+    }
+
+    # 执行记录写入（write-behind 模式下合并提交）
+    EXECUTION_WRITE_BEHIND = os.getenv('EXECUTION_WRITE_BEHIND', 'False').lower() == 'true'
+    EXECUTION_WRITE_BATCH_SIZE = int(os.getenv('EXECUTION_WRITE_BATCH_SIZE', '100'))
+    EXECUTION_WRITE_FLUSH_INTERVAL = float(os.getenv('EXECUTION_WRITE_FLUSH_INTERVAL', '0.05'))
+
+    # 密码哈希（bcrypt cost 变更后，用户下次登录成功时自动重新哈希）
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+    PASSWORD_HASH_USE_PROCESS_POOL = os.getenv('PASSWORD_HASH_USE_PROCESS_POOL', 'True').lower() == 'true'
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', '64'))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+    LOGIN_MAX_CONCURRENT_PER_IP = int(os.getenv('LOGIN_MAX_CONCURRENT_PER_IP', '4'))
+
+    # 身份缓存（吊销列表默认与限流共用存储）
+    IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', '60'))
+    IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', '50000'))
+    IDENTITY_REVOCATION_URL = os.getenv('IDENTITY_REVOCATION_URL', RATE_LIMIT_STORAGE_URL)
+
+    # 公开Agent目录快照的全量刷新间隔（秒），用于同步其他进程的写入
+    CATALOG_REFRESH_INTERVAL = int(os.getenv('CATALOG_REFRESH_INTERVAL', '60'))
+
+    # JSON 序列化：orjson（未安装时自动退回标准库）或 default
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'orjson')
+    # 列表/历史/导出接口的响应压缩（zstd 需安装 zstandard）
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+    COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+
+    # 执行记录归档：超过 ARCHIVE_AFTER_DAYS 天的正文移入按 月/用户 分区的 gzip JSONL 段文件
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', str(Path(__file__).resolve().parent / 'archive'))
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '1000'))
+    ARCHIVE_SEGMENT_CACHE_SIZE = int(os.getenv('ARCHIVE_SEGMENT_CACHE_SIZE', '64'))
+
+    # 执行记录导出：服务端游标每批读取的行数
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+    # 已删除Agent的后台清理：每块删除的执行记录数、块间休眠（秒）、轮询间隔（秒）
+    AGENT_REAPER_ENABLED = os.getenv('AGENT_REAPER_ENABLED', 'true').lower() == 'true'
+    AGENT_REAPER_CHUNK_SIZE = int(os.getenv('AGENT_REAPER_CHUNK_SIZE', '1000'))
+    AGENT_REAPER_PAUSE = float(os.getenv('AGENT_REAPER_PAUSE', '0.2'))
+    AGENT_REAPER_INTERVAL = int(os.getenv('AGENT_REAPER_INTERVAL', '300'))
+
+    # 可选模型（GET /agents/models）；指标的 model 标签只使用这些模型和 MODEL_ROUTES 中的模型，其余记为 other
+    AVAILABLE_MODELS = [
+        {"id": "qwen-turbo", "name": "通义千问Turbo"},
+        {"id": "qwen-plus", "name": "通义千问Plus"},
+        {"id": "qwen-max", "name": "通义千问Max"},
+        {"id": "qwen-1.8b", "name": "通义千问1.8B"}
+    ]
+
+    # 多模型服务路由：模型 -> 按优先级排列的 [provider, 后端模型]，未配置的模型只走同名后端
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+    MODEL_ROUTES = json.loads(os.getenv('MODEL_ROUTES', 'null')) or {
+        'qwen-turbo': [['dashscope', 'qwen-turbo'], ['openai', 'gpt-4o-mini']],
+        'qwen-plus': [['dashscope', 'qwen-plus'], ['openai', 'gpt-4o-mini']],
+        'qwen-max': [['dashscope', 'qwen-max'], ['openai', 'gpt-4o']],
+    }
+    # 后端健康度：滑动窗口内错误率或 p95 延迟（秒）超限即视为不健康，优先切换到备用后端
+    ROUTER_WINDOW_SECONDS = int(os.getenv('ROUTER_WINDOW_SECONDS', '60'))
+    ROUTER_WINDOW_SIZE = int(os.getenv('ROUTER_WINDOW_SIZE', '200'))
+    ROUTER_MIN_SAMPLES = int(os.getenv('ROUTER_MIN_SAMPLES', '5'))
+    ROUTER_MAX_ERROR_RATE = float(os.getenv('ROUTER_MAX_ERROR_RATE', '0.3'))
+    ROUTER_LATENCY_SLO = float(os.getenv('ROUTER_LATENCY_SLO', '8'))
+    # 对冲请求（按 Agent 开启）：等待超过后端 p95（不低于 ROUTER_HEDGE_MIN_DELAY 秒）后再发一次
+    ROUTER_HEDGE_MIN_DELAY = float(os.getenv('ROUTER_HEDGE_MIN_DELAY', '0.5'))
+    ROUTER_HEDGE_WORKERS = int(os.getenv('ROUTER_HEDGE_WORKERS', '32'))
+    # Agent 配置快照缓存：当前版本最多缓存 AGENT_CONFIG_CACHE_TTL 秒，命中时按版本号校验（其他进程的修改/删除立即生效）
+    AGENT_CONFIG_CACHE_TTL = int(os.getenv('AGENT_CONFIG_CACHE_TTL', '30'))
+    AGENT_CONFIG_CACHE_SIZE = int(os.getenv('AGENT_CONFIG_CACHE_SIZE', '4096'))
+    # 熔断器（按 provider/model/API 密钥）：窗口内失败率或慢调用率超限后打开，冷却 BREAKER_OPEN_SECONDS 秒后半开试探
+    BREAKER_WINDOW_SECONDS = int(os.getenv('BREAKER_WINDOW_SECONDS', '30'))
+    BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+    BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+    BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '15'))
+    BREAKER_SLOW_CALL_RATE = float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.8'))
+    BREAKER_OPEN_SECONDS = int(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+    BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', '3'))